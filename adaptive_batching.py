@@ -0,0 +1,93 @@
+import threading
+import logging
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+MIN_BATCH_ROWS = 500
+MAX_BATCH_ROWS = 50000
+# Plafond mémoire d'un lot, estimé à partir de la taille moyenne observée d'une ligne
+MAX_BATCH_BYTES = 64 * 1024 * 1024
+# Au-delà de ce retard on privilégie le débit (gros lots), en dessous la latence (petits lots)
+TARGET_LAG = 1.0
+MAX_BATCH_SECONDS = 5.0
+MIN_FLUSH_INTERVAL = 0.2
+MAX_FLUSH_INTERVAL = 2.0
+# Lissage exponentiel de la taille moyenne d'une ligne
+ROW_BYTES_SMOOTHING = 0.2
+
+
+def new_controller(min_rows=MIN_BATCH_ROWS, max_rows=MAX_BATCH_ROWS, max_bytes=MAX_BATCH_BYTES,
+                   target_lag=TARGET_LAG, max_batch_seconds=MAX_BATCH_SECONDS):
+    return {
+        'min_rows': min_rows,
+        'max_rows': max_rows,
+        'max_bytes': max_bytes,
+        'target_lag': target_lag,
+        'max_batch_seconds': max_batch_seconds,
+        'batch_rows': min_rows,
+        'flush_interval': MIN_FLUSH_INTERVAL,
+        'row_bytes': None,
+        'lock': threading.Lock(),
+    }
+
+
+def batch_rows(controller, default=MIN_BATCH_ROWS):
+    return controller['batch_rows'] if controller else default
+
+
+def flush_interval(controller):
+    return controller['flush_interval'] if controller else MIN_FLUSH_INTERVAL
+
+
+def observe(controller, rows, byte_count, seconds, backlog, lag=None):
+    # Croissance multiplicative en rattrapage, décroissance quand la file se vide ou qu'un lot est trop long
+    if controller is None or not rows:
+        return batch_rows(controller)
+    with controller['lock']:
+        row_bytes = byte_count / rows if byte_count else controller['row_bytes']
+        if row_bytes:
+            previous = controller['row_bytes'] or row_bytes
+            controller['row_bytes'] = previous + ROW_BYTES_SMOOTHING * (row_bytes - previous)
+
+        size = controller['batch_rows']
+        behind = backlog or (lag is not None and lag > controller['target_lag'])
+        if seconds > controller['max_batch_seconds']:
+            size = size // 2
+        elif behind:
+            size = size * 2
+        elif rows < size // 2:
+            size = size // 2
+
+        ceiling = controller['max_rows']
+        if controller['row_bytes']:
+            ceiling = min(ceiling, int(controller['max_bytes'] / controller['row_bytes']))
+        size = max(controller['min_rows'], min(ceiling, size))
+        if size != controller['batch_rows']:
+            logging.info(f"Batch size {controller['batch_rows']} -> {size} rows (backlog={backlog}, lag={lag}, batch took {seconds:.3f}s)")
+        controller['batch_rows'] = size
+
+        # L'intervalle de flush suit la taille du lot : réactif à vide, plus long en rattrapage
+        span = max(1, controller['max_rows'] - controller['min_rows'])
+        ratio = (size - controller['min_rows']) / span
+        controller['flush_interval'] = MIN_FLUSH_INTERVAL + ratio * (MAX_FLUSH_INTERVAL - MIN_FLUSH_INTERVAL)
+        return size
+
+
+def catch_up(controller):
+    # Rattrapage forcé (ex. WAL retenu critique) : taille de lot maximale autorisée par la mémoire
+    if controller is None:
+        return
+    with controller['lock']:
+        ceiling = controller['max_rows']
+        if controller['row_bytes']:
+            ceiling = min(ceiling, int(controller['max_bytes'] / controller['row_bytes']))
+        controller['batch_rows'] = max(controller['min_rows'], ceiling)
+        controller['flush_interval'] = MAX_FLUSH_INTERVAL
+
+
+def controller_status(controller):
+    if controller is None:
+        return None
+    return {'batch_rows': controller['batch_rows'], 'flush_interval': round(controller['flush_interval'], 3),
+            'row_bytes': round(controller['row_bytes'], 1) if controller['row_bytes'] else None}
@@ -0,0 +1,110 @@
+import random
+import select
+import logging
+
+import psycopg2
+
+import drivers
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DML_CHANNEL = "replication_wakeup"
+DDL_CHANNEL = "replication_wakeup_ddl"
+
+IDLE_MIN_DELAY = 0.1
+IDLE_MAX_DELAY = 5
+ERROR_MIN_DELAY = 1
+ERROR_MAX_DELAY = 60
+# Tranche maximale d'attente pour rester réactif à l'arrêt du job
+WAIT_SLICE = 0.5
+
+
+def next_delay(previous_delay, busy=False, error=False, min_delay=IDLE_MIN_DELAY, max_delay=IDLE_MAX_DELAY):
+    # Backlog : on enchaîne sans attendre ; sinon backoff exponentiel avec jitter
+    if busy and not error:
+        return 0
+    if error:
+        min_delay, max_delay = max(min_delay, ERROR_MIN_DELAY), max(max_delay, ERROR_MAX_DELAY)
+    ceiling = min(max_delay, max(min_delay, previous_delay * 2))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+def install_wakeup_triggers(conn, table_names):
+    # Déclencheurs par instruction : un seul NOTIFY par ordre, quel que soit le nombre de lignes
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE OR REPLACE FUNCTION replication_wakeup_notify() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('{DML_CHANNEL}', TG_TABLE_NAME);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """)
+        for table_name in table_names:
+            cur.execute(f"DROP TRIGGER IF EXISTS replication_wakeup ON {table_name}")
+            cur.execute(f"""
+                CREATE TRIGGER replication_wakeup
+                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table_name}
+                FOR EACH STATEMENT EXECUTE FUNCTION replication_wakeup_notify()
+                """)
+
+        cur.execute(f"""
+            CREATE OR REPLACE FUNCTION replication_wakeup_ddl_notify() RETURNS event_trigger AS $$
+            BEGIN
+                PERFORM pg_notify('{DDL_CHANNEL}', tg_tag);
+            END;
+            $$ LANGUAGE plpgsql;
+            """)
+        cur.execute("SELECT 1 FROM pg_event_trigger WHERE evtname = 'replication_wakeup_ddl'")
+        if not cur.fetchone():
+            cur.execute("""
+                CREATE EVENT TRIGGER replication_wakeup_ddl ON ddl_command_end
+                EXECUTE FUNCTION replication_wakeup_ddl_notify()
+                """)
+    conn.commit()
+    logging.info(f"Installed wakeup triggers on {', '.join(table_names)}")
+
+
+def listen_connection(source_db, channel):
+    try:
+        conn = psycopg2.connect(**drivers.connection_params('postgresql', source_db))
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {channel}")
+        logging.info(f"Listening on channel {channel} of {source_db}")
+        return conn
+    except Exception as e:
+        logging.error(f"Error listening on {channel}, falling back to polling: {e}")
+        return None
+
+
+def drain_notifications(conn, notifications=None):
+    conn.poll()
+    received = bool(conn.notifies)
+    if notifications is not None:
+        notifications.extend(notify.payload for notify in conn.notifies)
+    conn.notifies.clear()
+    return received
+
+
+def wait_for_wakeup(stop_event, delay, listen_conn=None, wakeup_event=None, notifications=None):
+    # Rend la main dès qu'une notification arrive, que le job est arrêté ou réveillé, ou après delay ;
+    # notifications reçoit les charges utiles reçues (balises DDL du déclencheur d'événement)
+    remaining = delay
+    while remaining > 0 and not stop_event.is_set():
+        step = min(remaining, WAIT_SLICE)
+        if wakeup_event is not None and wakeup_event.is_set():
+            wakeup_event.clear()
+            return True
+        if listen_conn is not None:
+            try:
+                if select.select([listen_conn], [], [], step)[0] and drain_notifications(listen_conn, notifications):
+                    return True
+            except Exception as e:
+                logging.error(f"Error waiting for notifications: {e}")
+                stop_event.wait(step)
+        else:
+            (wakeup_event or stop_event).wait(step)
+        remaining -= step
+    return False
@@ -0,0 +1,272 @@
+import argparse
+import datetime
+import decimal
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+import types
+import logging
+
+import dml_replication_postgresql
+import dml_replication_mysql
+from change_records import ChangeRecord, UNCHANGED_TOAST
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+BASELINE_FILE = "benchmark_baseline.json"
+# Écart toléré par rapport à la référence avant de signaler une régression
+TOLERANCE = 0.15
+PG_EPOCH = datetime.datetime(2000, 1, 1)
+
+WIDE_COLUMNS = 40
+NULL_RATIO = 0.2
+TOAST_RATIO = 0.1
+ROWS_PER_TRANSACTION = 20
+
+
+# Encodage pgoutput (protocole 1), symétrique des décodeurs de dml_replication_postgresql
+
+def encode_begin(lsn, xid, timestamp):
+    micros = int((timestamp - PG_EPOCH).total_seconds() * 1000000)
+    return b'B' + lsn.to_bytes(8, 'big') + micros.to_bytes(8, 'big') + xid.to_bytes(4, 'big')
+
+
+def encode_commit(lsn, end_lsn, timestamp):
+    micros = int((timestamp - PG_EPOCH).total_seconds() * 1000000)
+    return b'C' + b'\x00' + lsn.to_bytes(8, 'big') + end_lsn.to_bytes(8, 'big') + micros.to_bytes(8, 'big')
+
+
+def encode_relation(oid, namespace, name, column_names, key_positions):
+    data = b'R' + oid.to_bytes(4, 'big') + (0).to_bytes(4, 'big')
+    data += namespace.encode('utf-8') + b'\x00' + name.encode('utf-8') + b'\x00'
+    data += b'd' + len(column_names).to_bytes(2, 'big')
+    for position, column_name in enumerate(column_names):
+        data += bytes([1 if position in key_positions else 0]) + column_name.encode('utf-8') + b'\x00'
+        data += (25).to_bytes(4, 'big') + (0xFFFFFFFF).to_bytes(4, 'big')
+    return data
+
+
+def encode_tuple(values):
+    data = len(values).to_bytes(2, 'big')
+    for value in values:
+        if value is None:
+            data += b'n'
+        elif value is UNCHANGED_TOAST:
+            data += b'u'
+        else:
+            encoded = str(value).encode('utf-8')
+            data += b't' + len(encoded).to_bytes(4, 'big') + encoded
+    return data
+
+
+def encode_insert(oid, values):
+    return b'I' + oid.to_bytes(4, 'big') + b'N' + encode_tuple(values)
+
+
+def encode_update(oid, values, key_values=None):
+    data = b'U' + oid.to_bytes(4, 'big')
+    if key_values is not None:
+        data += b'K' + encode_tuple(key_values)
+    return data + b'N' + encode_tuple(values)
+
+
+def encode_delete(oid, key_values):
+    return b'D' + oid.to_bytes(4, 'big') + b'K' + encode_tuple(key_values)
+
+
+def encode_truncate(oids):
+    return b'T' + len(oids).to_bytes(4, 'big') + b'\x00' + b''.join(oid.to_bytes(4, 'big') for oid in oids)
+
+
+def synthetic_row(rng, row_id, column_count, toast=False):
+    values = [row_id]
+    for position in range(1, column_count):
+        if rng.random() < NULL_RATIO:
+            values.append(None)
+        elif toast and rng.random() < TOAST_RATIO:
+            values.append(UNCHANGED_TOAST)
+        elif position % 3 == 0:
+            values.append(rng.randint(-10 ** 6, 10 ** 6))
+        else:
+            values.append(f"value {rng.random():.12f} l'exemple")
+    return values
+
+
+def pgoutput_stream(message_count, column_count=WIDE_COLUMNS, seed=42):
+    # Flux réaliste : RELATION puis transactions B / I,U,D / C, et un TRUNCATE de temps en temps
+    rng = random.Random(seed)
+    oid = 16384
+    column_names = [f"col_{position}" for position in range(column_count)]
+    messages = [encode_relation(oid, 'public', 'bench_table', column_names, (0,))]
+    lsn, xid, row_id = 0x1000000, 1000, 0
+    timestamp = datetime.datetime(2024, 1, 1)
+    while len(messages) < message_count:
+        xid += 1
+        messages.append(encode_begin(lsn, xid, timestamp))
+        for _ in range(ROWS_PER_TRANSACTION):
+            row_id += 1
+            choice = rng.random()
+            if choice < 0.6:
+                messages.append(encode_insert(oid, synthetic_row(rng, row_id, column_count)))
+            elif choice < 0.9:
+                key = [rng.randint(1, row_id)] + [None] * (column_count - 1)
+                messages.append(encode_update(oid, synthetic_row(rng, key[0], column_count, toast=True), key))
+            else:
+                messages.append(encode_delete(oid, [rng.randint(1, row_id)] + [None] * (column_count - 1)))
+            lsn += 128
+        if xid % 500 == 0:
+            messages.append(encode_truncate([oid]))
+        timestamp += datetime.timedelta(milliseconds=5)
+        messages.append(encode_commit(lsn, lsn + 64, timestamp))
+        lsn += 128
+    return messages[:message_count], column_names
+
+
+def binlog_stream(event_count, column_count=WIDE_COLUMNS, rows_per_event=10, seed=42):
+    # Événements de lignes minimaux : mêmes attributs que ceux lus par dml_replication_mysql
+    rng = random.Random(seed)
+    columns = [types.SimpleNamespace(name=f"col_{position}") for position in range(column_count)]
+    events = []
+    row_id = 0
+    for _ in range(event_count):
+        op = rng.choice('IIIUUD')
+        rows = []
+        for _ in range(rows_per_event):
+            row_id += 1
+            values = dict(zip((column.name for column in columns), synthetic_row(rng, row_id, column_count)))
+            values['col_1'] = decimal.Decimal('12.50')
+            if op == 'U':
+                before = dict(values, col_2='before')
+                rows.append({'before_values': before, 'after_values': values})
+            else:
+                rows.append({'values': values})
+        events.append(types.SimpleNamespace(op=op, schema='bench', table='bench_table', columns=columns,
+                                            primary_key='col_0', rows=rows))
+    return events
+
+
+def binlog_records(event):
+    relation = dml_replication_mysql.get_relation(event, 'bench_table')
+    return dml_replication_mysql.event_records(event.op, relation, event.rows)
+
+
+def decode_pgoutput(messages, column_names, relations):
+    records = []
+    for data in messages:
+        decoded = dml_replication_postgresql.decode_message(data, relations)
+        if isinstance(decoded, ChangeRecord):
+            records.append(decoded)
+        elif decoded is not None and not isinstance(decoded, (dict, tuple)):
+            # Hors base, les types viennent du flux synthétique et non du catalogue
+            decoded.column_types = tuple('integer' if position % 3 == 0 else 'text' for position in range(len(column_names)))
+    return records
+
+
+def measure(name, items, operation, item_size=None, sample=2000):
+    # Débit sur la totalité, latence par élément sur un échantillon, mémoire sur un passage tracé
+    started = time.perf_counter()
+    for item in items:
+        operation(item)
+    elapsed = time.perf_counter() - started
+
+    latencies = []
+    for item in items[:sample]:
+        item_started = time.perf_counter_ns()
+        operation(item)
+        latencies.append(time.perf_counter_ns() - item_started)
+    latencies.sort()
+
+    tracemalloc.start()
+    for item in items[:sample]:
+        operation(item)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        'items': len(items),
+        'items_per_second': round(len(items) / elapsed, 1),
+        'p99_latency_us': round(latencies[int(len(latencies) * 0.99) - 1] / 1000, 2) if latencies else None,
+        'peak_alloc_bytes': peak,
+    }
+    if item_size is not None:
+        result['bytes_per_second'] = round(sum(map(item_size, items)) / elapsed, 1)
+    logging.info(f"{name}: {result}")
+    return result
+
+
+def run_benchmarks(message_count, event_count):
+    messages, column_names = pgoutput_stream(message_count)
+    # Les RELATION sont décodés une fois : les messages suivants s'appuient sur la carte de la session
+    relations = {}
+    records = decode_pgoutput(messages, column_names, relations)
+    row_messages = [data for data in messages if data[:1] in (b'I', b'U', b'D')]
+    tuples = [data for data in messages if data[:1] == b'I']
+    events = binlog_stream(event_count)
+    binlog_change_records = [record for event in events for record in binlog_records(event)]
+
+    pg_builders = dml_replication_postgresql.QUERY_BUILDERS
+    mysql_builders = dml_replication_mysql.QUERY_BUILDERS
+    return {
+        'pgoutput_decode_message': measure('pgoutput_decode_message', row_messages,
+                                           lambda data: dml_replication_postgresql.decode_message(data, relations), len),
+        'pgoutput_read_tuple_data': measure('pgoutput_read_tuple_data', tuples,
+                                            lambda data: dml_replication_postgresql.read_tuple_data(data, 6), len),
+        'pgoutput_build_queries': measure('pgoutput_build_queries', records, lambda record: pg_builders[record.op](record)),
+        'binlog_records': measure('binlog_records', events, binlog_records),
+        'binlog_build_queries': measure('binlog_build_queries', binlog_change_records,
+                                        lambda record: mysql_builders[record.op](record)),
+    }
+
+
+def compare_to_baseline(results, baseline, tolerance=TOLERANCE):
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        if result['items_per_second'] < reference['items_per_second'] * (1 - tolerance):
+            regressions.append(f"{name}: {result['items_per_second']} items/s vs {reference['items_per_second']} baseline")
+        if result['p99_latency_us'] and reference.get('p99_latency_us') and result['p99_latency_us'] > reference['p99_latency_us'] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {result['p99_latency_us']} us vs {reference['p99_latency_us']} baseline")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the pgoutput / binlog decoding and SQL building hot path")
+    parser.add_argument('--messages', type=int, default=50000, help="Number of synthetic pgoutput messages")
+    parser.add_argument('--events', type=int, default=5000, help="Number of synthetic binlog row events")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="Baseline JSON file to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="Store these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help="Allowed slowdown ratio before failing")
+    parser.add_argument('--with-logging', action='store_true', help="Keep the per-message INFO logging of the decoders")
+    args = parser.parse_args()
+
+    if not args.with_logging:
+        # Les décodeurs journalisent chaque message en INFO : on mesure le chemin critique seul
+        logging.disable(logging.INFO)
+    results = run_benchmarks(args.messages, args.events)
+    logging.disable(logging.NOTSET)
+    print(json.dumps(results, indent=2))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        logging.info(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        logging.info(f"No baseline at {args.baseline}, run with --save-baseline to create one")
+        return 0
+    with open(args.baseline) as baseline_file:
+        regressions = compare_to_baseline(results, json.load(baseline_file), args.tolerance)
+    for regression in regressions:
+        logging.error(f"Regression: {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,353 @@
+import io
+import json
+import time
+import logging
+
+import psycopg2.extras
+
+from change_records import UNCHANGED_TOAST
+import dead_letter
+import profiling
+import replication_lag
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+BATCH_MAX_ROWS = 5000
+
+
+class ColumnarBatch:
+    # Changements consécutifs d'une même relation et d'une même opération, stockés par colonne
+    __slots__ = ('relation', 'op', 'columns', 'old_columns', 'records')
+
+    def __init__(self, relation, op, records):
+        self.relation = relation
+        self.op = op
+        self.records = records
+        # Transposition en bloc : zip(*) s'exécute en C, sans boucle Python par valeur
+        self.columns = list(zip(*[record.values for record in records])) if records[0].values is not None else []
+        self.old_columns = list(zip(*[record.old_values for record in records])) if records[0].old_values is not None else []
+
+    @property
+    def row_count(self):
+        return len(self.records)
+
+    def rows(self):
+        return zip(*self.columns)
+
+    def key_rows(self):
+        key_columns = self.old_columns or self.columns
+        return zip(*[key_columns[position] for position in self.relation.key_positions])
+
+
+def build_batches(records, max_rows=BATCH_MAX_ROWS):
+    # L'ordre est conservé : un lot ne regroupe que des enregistrements consécutifs
+    batches = []
+    run = []
+    for record in records:
+        if run and (record.relation is not run[0].relation or record.op != run[0].op or len(run) >= max_rows):
+            batches.append(ColumnarBatch(run[0].relation, run[0].op, run))
+            run = []
+        run.append(record)
+    if run:
+        batches.append(ColumnarBatch(run[0].relation, run[0].op, run))
+    return batches
+
+
+def format_copy_value(value):
+    # Format texte de COPY : bytea en hexadécimal, json sérialisé ; str() donnerait b'..' ou la repr Python
+    if value is None:
+        return '\\N'
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        text = '\\x' + bytes(value).hex()
+    elif isinstance(value, (dict, list)):
+        text = json.dumps(value)
+    else:
+        text = str(value)
+    return text.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_insert_sink(conn, batch):
+    # Encodage colonne par colonne, puis une seule transposition vers les lignes du flux COPY
+    encoded_columns = [list(map(format_copy_value, column)) for column in batch.columns]
+    buffer = io.StringIO()
+    buffer.writelines('\t'.join(row) + '\n' for row in zip(*encoded_columns))
+    buffer.seek(0)
+    with conn.cursor() as cur:
+        cur.copy_expert(f"COPY {batch.relation.name} ({', '.join(batch.relation.column_names)}) FROM STDIN", buffer)
+
+
+def values_insert_sink(conn, batch):
+    # executemany réécrit l'INSERT en VALUES multi-lignes côté MySQL
+    placeholders = ', '.join(['%s'] * len(batch.relation.column_names))
+    cur = conn.cursor()
+    try:
+        cur.executemany(f"INSERT INTO {batch.relation.name} ({', '.join(batch.relation.column_names)}) VALUES ({placeholders})",
+                        list(batch.rows()))
+    finally:
+        cur.close()
+
+
+def delete_keys(cur, relation, key_rows):
+    key_names = [relation.column_names[position] for position in relation.key_positions]
+    row_placeholder = f"({', '.join(['%s'] * len(key_names))})"
+    cur.execute(f"DELETE FROM {relation.name} WHERE ({', '.join(key_names)}) IN ({', '.join([row_placeholder] * len(key_rows))})",
+                [value for key_row in key_rows for value in key_row])
+
+
+def keyed_delete_sink(conn, batch):
+    cur = conn.cursor()
+    try:
+        delete_keys(cur, batch.relation, list(batch.key_rows()))
+    finally:
+        cur.close()
+
+
+# Puits par système cible et par opération ; une opération absente est appliquée ligne à ligne
+BATCH_SINKS = {
+    'postgresql': {'I': copy_insert_sink, 'D': keyed_delete_sink},
+    'mysql': {'I': values_insert_sink, 'D': keyed_delete_sink},
+    'redshift': {'I': values_insert_sink, 'D': keyed_delete_sink},
+}
+
+# 'insert' : INSERT / UPDATE tels que reçus ; 'upsert' : rejouable sans doublon ni échec sur clé existante
+APPLY_MODES = ('insert', 'upsert')
+
+
+def upsertable(record):
+    # Ligne complète, identifiée par sa clé, sans changement de clé : l'upsert reproduit exactement l'état final
+    relation = record.relation
+    if not relation.key_positions or record.values is None or any(value is UNCHANGED_TOAST for value in record.values):
+        return False
+    return record.old_values is None or record.key_values() == tuple(record.values[position] for position in relation.key_positions)
+
+
+def upsert_statement(relation, syst_dest):
+    columns = ', '.join(relation.column_names)
+    key_names = [relation.column_names[position] for position in relation.key_positions]
+    other_names = [column_name for column_name in relation.column_names if column_name not in key_names]
+    if syst_dest == 'postgresql':
+        action = f"UPDATE SET {', '.join(f'{name} = EXCLUDED.{name}' for name in other_names)}" if other_names else 'NOTHING'
+        return f"INSERT INTO {relation.name} ({columns}) VALUES %s ON CONFLICT ({', '.join(key_names)}) DO {action}"
+    if syst_dest == 'mysql':
+        updates = ', '.join(f"{name} = VALUES({name})" for name in other_names or key_names[:1])
+        return f"INSERT INTO {relation.name} ({columns}) VALUES ({', '.join(['%s'] * len(relation.column_names))}) ON DUPLICATE KEY UPDATE {updates}"
+    # Sans upsert natif (Redshift) : suppression par clé puis insertion dans la même transaction
+    return None
+
+
+def latest_rows(batch):
+    # Une instruction ON CONFLICT ne peut toucher deux fois la même ligne : seul le dernier état par clé est gardé
+    rows = {}
+    for record in batch.records:
+        rows[record.key_values()] = record.values
+    return list(rows.values())
+
+
+def upsert_sink(conn, batch, syst_dest):
+    rows = latest_rows(batch)
+    statement = upsert_statement(batch.relation, syst_dest)
+    cur = conn.cursor()
+    try:
+        if syst_dest == 'postgresql':
+            psycopg2.extras.execute_values(cur, statement, rows, page_size=1000)
+        elif statement is not None:
+            cur.executemany(statement, rows)
+        else:
+            delete_keys(cur, batch.relation, [tuple(row[position] for position in batch.relation.key_positions) for row in rows])
+            placeholders = ', '.join(['%s'] * len(batch.relation.column_names))
+            cur.executemany(f"INSERT INTO {batch.relation.name} ({', '.join(batch.relation.column_names)}) VALUES ({placeholders})", rows)
+    finally:
+        cur.close()
+
+
+def batch_sink(syst_dest, batch, apply_mode='insert'):
+    if apply_mode == 'upsert' and batch.op in ('I', 'U') and all(upsertable(record) for record in batch.records):
+        return lambda conn, batch: upsert_sink(conn, batch, syst_dest)
+    sink = BATCH_SINKS.get(syst_dest, {}).get(batch.op)
+    if batch.op == 'D' and not batch.relation.key_positions:
+        return None
+    if batch.op == 'I' and any(value is UNCHANGED_TOAST for record in batch.records for value in record.values):
+        return None
+    return sink
+
+
+def execute_record(cur, record, syst_dest, query_builders, apply_mode='insert'):
+    # Un DELETE sans ligne correspondante n'échoue pas : seuls INSERT et UPDATE sont réécrits en upsert
+    if apply_mode == 'upsert' and record.op in ('I', 'U') and upsertable(record):
+        statement = upsert_statement(record.relation, syst_dest)
+        if syst_dest == 'postgresql':
+            psycopg2.extras.execute_values(cur, statement, [record.values])
+        elif statement is not None:
+            cur.execute(statement, record.values)
+        else:
+            delete_keys(cur, record.relation, [record.key_values()])
+            placeholders = ', '.join(['%s'] * len(record.relation.column_names))
+            cur.execute(f"INSERT INTO {record.relation.name} ({', '.join(record.relation.column_names)}) VALUES ({placeholders})", record.values)
+        return
+    # Les constructeurs rendent (requête, paramètres) : les valeurs sont échappées par le pilote cible
+    statement = query_builders[record.op](record)
+    if statement is not None:
+        cur.execute(*statement)
+
+
+def execute_rows(conn, batch, syst_dest, query_builders, apply_mode='insert'):
+    cur = conn.cursor()
+    try:
+        for record in batch.records:
+            execute_record(cur, record, syst_dest, query_builders, apply_mode)
+    finally:
+        cur.close()
+
+
+# Un changement plus récent ne doit pas écraser la ligne avant la reprise de celui qui a échoué
+PARKED_ERROR = "Parked behind an earlier dead-lettered change of the same row"
+
+
+def is_parked(record, parked_rows):
+    return bool(parked_rows) and any(key in parked_rows for key in dead_letter.row_keys(record) if key)
+
+
+def park_row(record, parked_rows):
+    if parked_rows is not None:
+        parked_rows.update(key for key in dead_letter.row_keys(record) if key)
+
+
+def reject_record(reject, record, error):
+    if reject:
+        # La ligne part en file de reprise : le reste du flux continue sans elle
+        try:
+            reject(record, error)
+        except Exception as reject_error:
+            logging.error(f"Error dead-lettering {record}: {reject_error}")
+
+
+def apply_rows(conn, batch, syst_dest, query_builders, apply_mode='insert', reject=None, parked_rows=None):
+    applied = 0
+    cur = conn.cursor()
+    try:
+        for record in batch.records:
+            if reject and is_parked(record, parked_rows):
+                reject_record(reject, record, PARKED_ERROR)
+                continue
+            try:
+                execute_record(cur, record, syst_dest, query_builders, apply_mode)
+                conn.commit()
+                applied += 1
+            except Exception as e:
+                logging.error(f"Error applying {record}: {e}")
+                conn.rollback()
+                if reject:
+                    park_row(record, parked_rows)
+                reject_record(reject, record, e)
+    finally:
+        cur.close()
+    return applied
+
+
+# Points de sauvegarde : une ligne en échec est écartée sans annuler le reste de sa transaction
+SAVEPOINT_SYSTEMS = ('postgresql', 'mysql')
+
+
+def apply_in_transaction(conn, records, syst_dest, query_builders, max_rows=BATCH_MAX_ROWS, apply_mode='insert', reject=None,
+                         parked_rows=None):
+    # records : une ou plusieurs transactions source complètes, validées ensemble et jamais à moitié
+    with profiling.timed('transform'):
+        batches = build_batches(records, max_rows)
+    if reject and any(is_parked(record, parked_rows) for record in records):
+        # Des lignes attendent en file de reprise : ligne à ligne pour mettre leurs changements derrière
+        applied = apply_rows_fallback(conn, records, batches, syst_dest, query_builders, apply_mode, reject, parked_rows)
+    else:
+        try:
+            with profiling.timed('apply'):
+                for batch in batches:
+                    sink = batch_sink(syst_dest, batch, apply_mode)
+                    if sink:
+                        sink(conn, batch)
+                    else:
+                        execute_rows(conn, batch, syst_dest, query_builders, apply_mode)
+            with profiling.timed('commit'):
+                conn.commit()
+            applied = len(records)
+        except Exception as e:
+            logging.error(f"Error applying transaction of {len(records)} changes, retrying row by row: {e}")
+            conn.rollback()
+            applied = apply_rows_fallback(conn, records, batches, syst_dest, query_builders, apply_mode, reject, parked_rows)
+    now = time.time()
+    for batch in batches:
+        replication_lag.observe_records(batch.relation.name, batch.records, now)
+    return applied
+
+
+def apply_rows_fallback(conn, records, batches, syst_dest, query_builders, apply_mode='insert', reject=None, parked_rows=None):
+    if syst_dest in SAVEPOINT_SYSTEMS:
+        return apply_rows_in_transaction(conn, records, syst_dest, query_builders, apply_mode, reject, parked_rows)
+    return sum(apply_rows(conn, batch, syst_dest, query_builders, apply_mode, reject, parked_rows) for batch in batches)
+
+
+def apply_rows_in_transaction(conn, records, syst_dest, query_builders, apply_mode='insert', reject=None, parked_rows=None):
+    applied = 0
+    rejected = []
+    cur = conn.cursor()
+    try:
+        for record in records:
+            if reject and is_parked(record, parked_rows):
+                rejected.append((record, PARKED_ERROR))
+                continue
+            cur.execute("SAVEPOINT change_row")
+            try:
+                execute_record(cur, record, syst_dest, query_builders, apply_mode)
+                cur.execute("RELEASE SAVEPOINT change_row")
+                applied += 1
+            except Exception as e:
+                logging.error(f"Error applying {record}: {e}")
+                cur.execute("ROLLBACK TO SAVEPOINT change_row")
+                if reject:
+                    park_row(record, parked_rows)
+                rejected.append((record, e))
+        with profiling.timed('commit'):
+            conn.commit()
+    finally:
+        cur.close()
+    # Les lignes écartées ne partent en file de reprise qu'une fois le reste validé
+    for record, error in rejected:
+        reject_record(reject, record, error)
+    return applied
+
+
+def dead_letter_reject(target_db, syst_dest, connect, apply_mode='insert'):
+    # Le module de connect fournit aussi les QUERY_BUILDERS utilisés à la reprise
+    return lambda record, error: dead_letter.add(record, target_db, syst_dest, connect.__module__, apply_mode, error)
+
+
+def apply_records(records, target_db, syst_dest, query_builders, connect, max_rows=BATCH_MAX_ROWS, apply_mode='insert'):
+    records, heartbeats = replication_lag.split_heartbeats(records)
+    try:
+        return apply_change_records(records, target_db, syst_dest, query_builders, connect, max_rows, apply_mode)
+    finally:
+        # Le heartbeat n'est pas répliqué : il mesure le retard une fois les changements précédents appliqués
+        replication_lag.observe_records(replication_lag.HEARTBEAT_TABLE, heartbeats, time.time())
+
+
+def open_target(connect, target_db, syst_dest):
+    conn = connect(target_db, syst_dest)
+    if conn is None:
+        # target_connection renvoie None si la cible est injoignable : l'appelant ne doit pas acquitter la source
+        raise ConnectionError(f"Cannot connect to target database {target_db} using {syst_dest}")
+    return conn
+
+
+def apply_change_records(records, target_db, syst_dest, query_builders, connect, max_rows=BATCH_MAX_ROWS, apply_mode='insert'):
+    if not records:
+        return 0
+    with profiling.timed('connect'):
+        conn = open_target(connect, target_db, syst_dest)
+    try:
+        # Les lots arrivent en transactions source complètes : un seul commit, jamais une transaction à moitié appliquée
+        applied = apply_in_transaction(conn, records, syst_dest, query_builders, max_rows, apply_mode,
+                                       dead_letter_reject(target_db, syst_dest, connect, apply_mode),
+                                       dead_letter.pending_rows(target_db, syst_dest))
+        logging.info(f"Applied {applied} of {len(records)} changes on {target_db} using {syst_dest}")
+        return applied
+    finally:
+        conn.close()
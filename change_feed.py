@@ -0,0 +1,118 @@
+import itertools
+import json
+import queue
+import threading
+import time
+import logging
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Tampon borné par client : un client trop lent est déconnecté plutôt que de retenir la publication
+CLIENT_BUFFER_SIZE = 256
+MAX_SUBSCRIBERS = 100
+KEEPALIVE_INTERVAL = 15
+STATS_INTERVAL = 2
+
+_subscribers = {}
+_subscribers_lock = threading.Lock()
+_event_ids = itertools.count(1)
+
+# Fonction renvoyant l'état des pipelines (lu en mémoire, sans requête sur les bases)
+_stats_source = None
+_stats_thread = None
+
+
+def set_stats_source(snapshot):
+    global _stats_source
+    _stats_source = snapshot
+
+
+def subscribe(pipeline=None):
+    subscriber = {
+        'id': next(_event_ids),
+        'pipeline': pipeline,
+        'queue': queue.Queue(maxsize=CLIENT_BUFFER_SIZE),
+        'dropped': threading.Event(),
+        'subscribed_at': time.time(),
+    }
+    with _subscribers_lock:
+        if len(_subscribers) >= MAX_SUBSCRIBERS:
+            return None
+        _subscribers[subscriber['id']] = subscriber
+    ensure_stats_publisher()
+    return subscriber
+
+
+def unsubscribe(subscriber):
+    with _subscribers_lock:
+        _subscribers.pop(subscriber['id'], None)
+
+
+def subscriber_count():
+    with _subscribers_lock:
+        return len(_subscribers)
+
+
+def publish(event_type, data, pipeline=None):
+    # Appelé depuis les threads de réplication : jamais bloquant, rien à faire sans abonné
+    if not _subscribers:
+        return
+    event = (next(_event_ids), event_type, data)
+    with _subscribers_lock:
+        subscribers = list(_subscribers.values())
+    for subscriber in subscribers:
+        if pipeline is not None and subscriber['pipeline'] not in (None, pipeline):
+            continue
+        try:
+            subscriber['queue'].put_nowait(event)
+        except queue.Full:
+            subscriber['dropped'].set()
+            unsubscribe(subscriber)
+            logging.warning(f"Change feed subscriber {subscriber['id']} dropped: buffer of {CLIENT_BUFFER_SIZE} events full")
+
+
+def format_event(event_id, event_type, data):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def events(subscriber):
+    # Flux Server-Sent Events ; le commentaire périodique garde la connexion ouverte derrière les proxys
+    try:
+        yield "retry: 3000\n\n"
+        while not subscriber['dropped'].is_set():
+            try:
+                event = subscriber['queue'].get(timeout=KEEPALIVE_INTERVAL)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            yield format_event(*event)
+        yield format_event(next(_event_ids), 'dropped', {'reason': 'slow consumer', 'buffer_size': CLIENT_BUFFER_SIZE})
+    finally:
+        unsubscribe(subscriber)
+
+
+def publish_stats():
+    global _stats_thread
+    while True:
+        with _subscribers_lock:
+            if not _subscribers:
+                _stats_thread = None
+                return
+        try:
+            if _stats_source is not None:
+                for pipeline_stats in _stats_source():
+                    publish('stats', pipeline_stats, pipeline_stats['id'])
+        except Exception as e:
+            logging.error(f"Error publishing pipeline stats to the change feed: {e}")
+        time.sleep(STATS_INTERVAL)
+
+
+def ensure_stats_publisher():
+    # Le thread ne tourne que tant qu'il y a des abonnés
+    global _stats_thread
+    with _subscribers_lock:
+        if _stats_thread is not None:
+            return
+        _stats_thread = threading.Thread(target=publish_stats, name='change-feed-stats', daemon=True)
+        _stats_thread.start()
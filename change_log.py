@@ -0,0 +1,200 @@
+import json
+import mmap
+import os
+import pickle
+import struct
+import threading
+import zlib
+import logging
+
+from change_records import RelationDescriptor, ChangeRecord
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+CHANGE_LOG_DIR = "change_log"
+SEGMENT_MAX_SIZE = 64 * 1024 * 1024
+# Segments entièrement appliqués conservés pour rejouer ou reconstruire une cible
+RETENTION_SEGMENTS = 4
+READ_MAX_ENTRIES = 5000
+
+# En-tête de trame : longueur du contenu puis CRC32, suivis du contenu sérialisé
+FRAME_HEADER = struct.Struct('>II')
+
+
+def segment_path(log, base_offset):
+    return os.path.join(log['directory'], f"{base_offset:020d}.log")
+
+
+def valid_length(buffer):
+    # Longueur du préfixe de trames complètes : une écriture interrompue laisse une trame tronquée
+    offset = 0
+    while offset + FRAME_HEADER.size <= len(buffer):
+        length, checksum = FRAME_HEADER.unpack_from(buffer, offset)
+        end = offset + FRAME_HEADER.size + length
+        if end > len(buffer) or zlib.crc32(buffer[offset + FRAME_HEADER.size:end]) != checksum:
+            break
+        offset = end
+    return offset
+
+
+def open_log(name):
+    directory = os.path.join(CHANGE_LOG_DIR, name)
+    os.makedirs(directory, exist_ok=True)
+    segments = sorted(int(file_name[:-4]) for file_name in os.listdir(directory) if file_name.endswith('.log'))
+    log = {'name': name, 'directory': directory, 'segments': segments or [0], 'relations': {},
+           'active': None, 'size': 0, 'lock': threading.Lock()}
+
+    active_path = segment_path(log, log['segments'][-1])
+    size = 0
+    if os.path.exists(active_path):
+        with open(active_path, 'rb') as segment:
+            size = valid_length(segment.read())
+        if size != os.path.getsize(active_path):
+            logging.error(f"Truncating torn tail of change log segment {active_path} at {size}")
+            os.truncate(active_path, size)
+    log['active'] = open(active_path, 'ab')
+    log['size'] = size
+    return log
+
+
+def close_log(log):
+    with log['lock']:
+        log['active'].close()
+
+
+def end_offset(log):
+    return log['segments'][-1] + log['size']
+
+
+def encode_entry(position, record):
+    relation = record.relation
+    relation_state = (relation.oid, relation.namespace, relation.name, tuple(relation.column_names),
+                      tuple(relation.column_types) if relation.column_types is not None else None,
+                      tuple(relation.key_positions))
+    payload = pickle.dumps((position, record.op, relation_state, record.values, record.old_values, record.commit_ts),
+                           pickle.HIGHEST_PROTOCOL)
+    return FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_entry(log, payload):
+    position, op, relation_state, values, old_values, commit_ts = pickle.loads(payload)
+    # Un seul descripteur par relation : les lots colonnes regroupent par identité de relation
+    relation = log['relations'].get(relation_state)
+    if relation is None:
+        relation = RelationDescriptor(*relation_state)
+        log['relations'][relation_state] = relation
+    return position, ChangeRecord(op, relation, values, old_values, commit_ts)
+
+
+def append(log, entries):
+    # entries : (position source, enregistrement) ; tout est sur disque (fsync) au retour
+    if not entries:
+        return end_offset(log)
+    with log['lock']:
+        for position, record in entries:
+            if log['size'] >= SEGMENT_MAX_SIZE:
+                roll_segment(log)
+            frame = encode_entry(position, record)
+            log['active'].write(frame)
+            log['size'] += len(frame)
+        log['active'].flush()
+        os.fsync(log['active'].fileno())
+        return end_offset(log)
+
+
+def roll_segment(log):
+    log['active'].flush()
+    os.fsync(log['active'].fileno())
+    log['active'].close()
+    base_offset = end_offset(log)
+    log['segments'].append(base_offset)
+    log['active'] = open(segment_path(log, base_offset), 'ab')
+    log['size'] = 0
+    logging.info(f"Rolled change log {log['name']} to segment {base_offset}")
+
+
+def read(log, offset, max_entries=READ_MAX_ENTRIES):
+    # Lecture par mmap à partir d'un offset global ; renvoie les entrées et l'offset suivant
+    # Les entrées d'une même position source forment des transactions complètes : max_entries est dépassé
+    # plutôt que de couper une transaction entre deux lectures
+    entries = []
+    full = False
+    with log['lock']:
+        segments = list(log['segments'])
+        limit = end_offset(log)
+    for index, base_offset in enumerate(segments):
+        segment_end = segments[index + 1] if index + 1 < len(segments) else limit
+        if segment_end <= max(offset, base_offset) or full:
+            continue
+        with open(segment_path(log, base_offset), 'rb') as segment:
+            with mmap.mmap(segment.fileno(), segment_end - base_offset, access=mmap.ACCESS_READ) as buffer:
+                local_offset = max(offset, base_offset) - base_offset
+                while local_offset < segment_end - base_offset:
+                    length, checksum = FRAME_HEADER.unpack_from(buffer, local_offset)
+                    start = local_offset + FRAME_HEADER.size
+                    payload = buffer[start:start + length]
+                    if zlib.crc32(payload) != checksum:
+                        raise ValueError(f"Corrupted change log frame at offset {base_offset + local_offset}")
+                    entry = decode_entry(log, payload)
+                    if len(entries) >= max_entries and entry[0] != entries[-1][0]:
+                        full = True
+                        break
+                    entries.append(entry)
+                    local_offset = start + length
+                offset = base_offset + local_offset
+    return entries, offset
+
+
+def last_position(log):
+    # Position source de la dernière entrée : la capture reprend juste après
+    with log['lock']:
+        segments = list(log['segments'])
+        size = log['size']
+    for base_offset in reversed(segments):
+        path = segment_path(log, base_offset)
+        length = size if base_offset == segments[-1] else os.path.getsize(path)
+        if not length:
+            continue
+        with open(path, 'rb') as segment:
+            buffer = segment.read(length)
+        offset, payload = 0, None
+        while offset < length:
+            frame_length, _ = FRAME_HEADER.unpack_from(buffer, offset)
+            payload = buffer[offset + FRAME_HEADER.size:offset + FRAME_HEADER.size + frame_length]
+            offset += FRAME_HEADER.size + frame_length
+        return pickle.loads(payload)[0]
+    return None
+
+
+def cursor_path(log, consumer):
+    return os.path.join(log['directory'], f"{consumer}.cursor")
+
+
+def load_cursor(log, consumer):
+    path = cursor_path(log, consumer)
+    if not os.path.exists(path):
+        return log['segments'][0]
+    with open(path) as cursor_file:
+        return json.load(cursor_file)['offset']
+
+
+def save_cursor(log, consumer, offset):
+    path = cursor_path(log, consumer)
+    with open(f"{path}.tmp", 'w') as cursor_file:
+        json.dump({'offset': offset}, cursor_file)
+    os.replace(f"{path}.tmp", path)
+
+
+def purge(log, applied_offset, keep_segments=RETENTION_SEGMENTS):
+    # Supprime les segments appliqués au-delà de la rétention ; le segment actif n'est jamais supprimé
+    with log['lock']:
+        removable = [base_offset for index, base_offset in enumerate(log['segments'][:-1])
+                     if log['segments'][index + 1] <= applied_offset]
+        removable = removable[:max(0, len(removable) - keep_segments)]
+        for base_offset in removable:
+            os.remove(segment_path(log, base_offset))
+            log['segments'].remove(base_offset)
+    if removable:
+        logging.info(f"Purged {len(removable)} segments of change log {log['name']}")
+    return len(removable)
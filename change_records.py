@@ -0,0 +1,50 @@
+class UnchangedToast:
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'UNCHANGED_TOAST'
+
+    def __reduce__(self):
+        # Désérialisé vers l'instance partagée : les tests « is UNCHANGED_TOAST » restent valides
+        return 'UNCHANGED_TOAST'
+
+
+# Valeur TOAST absente du message ('u') : une seule instance partagée
+UNCHANGED_TOAST = UnchangedToast()
+
+
+class RelationDescriptor:
+    # Partagé par toutes les lignes d'une même table : les enregistrements n'en portent qu'une référence
+    __slots__ = ('oid', 'namespace', 'name', 'column_names', 'column_types', 'key_positions')
+
+    def __init__(self, oid, namespace, name, column_names, column_types=None, key_positions=()):
+        self.oid = oid
+        self.namespace = namespace
+        self.name = name
+        self.column_names = column_names
+        self.column_types = column_types
+        self.key_positions = key_positions
+
+    def __repr__(self):
+        return f"RelationDescriptor({self.namespace}.{self.name}, columns={self.column_names})"
+
+
+class ChangeRecord:
+    # op : 'I', 'U', 'D' ou 'T' ; values / old_values sont des tuples alignés sur relation.column_names
+    # commit_ts : horodatage (epoch) du commit source de la transaction, pour mesurer le retard
+    __slots__ = ('op', 'relation', 'values', 'old_values', 'commit_ts')
+
+    def __init__(self, op, relation, values=None, old_values=None, commit_ts=None):
+        self.op = op
+        self.relation = relation
+        self.values = values
+        self.old_values = old_values
+        self.commit_ts = commit_ts
+
+    def key_values(self):
+        # Valeurs identifiant la ligne : ancienne clé si elle est transmise, sinon la nouvelle
+        row = self.old_values if self.old_values is not None else self.values
+        return tuple(row[position] for position in self.relation.key_positions)
+
+    def __repr__(self):
+        return f"ChangeRecord({self.op}, {self.relation.name}, values={self.values}, old_values={self.old_values})"
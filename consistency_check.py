@@ -0,0 +1,284 @@
+import datetime
+import decimal
+import math
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import drivers
+import initial_load
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+CHUNK_COUNT = 64
+FANOUT = 16
+LEAF_SIZE = 1000
+WORKERS = 8
+
+
+# Rendu texte canonique par famille de types, identique d'un moteur à l'autre :
+# booléens en 0/1, horodatages en UTC à la microseconde, décimaux sans zéros de fin, octets en hexadécimal
+TIMESTAMP_FORMAT = 'YYYY-MM-DD HH24:MI:SS.US'
+MYSQL_TIMESTAMP_FORMAT = '%%Y-%%m-%%d %%H:%%i:%%s.%%f'
+FLOAT_SCALE = 6
+BYTE_TYPES = ('bytea', 'varbyte', 'binary', 'varbinary', 'tinyblob', 'blob', 'mediumblob', 'longblob')
+
+
+def type_family(syst, data_type):
+    data_type = data_type.lower()
+    if data_type == 'boolean':
+        return 'boolean'
+    if data_type.startswith('timestamp with time zone') or (syst == 'mysql' and data_type == 'timestamp'):
+        return 'timestamptz'
+    if data_type.startswith('timestamp') or data_type == 'datetime':
+        return 'timestamp'
+    if data_type.startswith(('numeric', 'decimal')):
+        return 'numeric'
+    if data_type in ('real', 'double precision', 'float', 'double'):
+        return 'float'
+    if data_type.split('(')[0] in BYTE_TYPES:
+        return 'bytes'
+    return 'text'
+
+
+def column_text(syst, column, family):
+    if syst == 'mysql':
+        if family == 'timestamptz':
+            return f"DATE_FORMAT(CONVERT_TZ({column}, @@session.time_zone, '+00:00'), '{MYSQL_TIMESTAMP_FORMAT}')"
+        if family == 'timestamp':
+            return f"DATE_FORMAT({column}, '{MYSQL_TIMESTAMP_FORMAT}')"
+        if family in ('numeric', 'float'):
+            text = column if family == 'numeric' else f"CAST({column} AS DECIMAL(38, {FLOAT_SCALE}))"
+            return f"IF(LOCATE('.', {text}) > 0, TRIM(TRAILING '.' FROM TRIM(TRAILING '0' FROM {text})), {text})"
+        if family == 'bytes':
+            return f"LOWER(HEX({column}))"
+        return column
+    if family == 'boolean':
+        return f"CASE WHEN {column} THEN '1' ELSE '0' END"
+    if family == 'timestamptz':
+        return f"to_char({column} AT TIME ZONE 'UTC', '{TIMESTAMP_FORMAT}')"
+    if family == 'timestamp':
+        return f"to_char({column}, '{TIMESTAMP_FORMAT}')"
+    if family in ('numeric', 'float'):
+        text = f"{column}::text" if family == 'numeric' else f"CAST({column} AS DECIMAL(38, {FLOAT_SCALE}))::text"
+        return f"CASE WHEN position('.' in {text}) > 0 THEN rtrim(rtrim({text}, '0'), '.') ELSE {text} END"
+    if family == 'bytes':
+        return f"to_hex({column})" if syst == 'redshift' else f"encode({column}, 'hex')"
+    return f"{column}::text"
+
+
+def row_hash_expression(syst, columns, families=None):
+    # Empreinte md5 du texte canonique des colonnes, NULL explicite : les sommes se comparent entre moteurs
+    families = families or {}
+    column_texts = [f"COALESCE({column_text(syst, column, families.get(column, 'text'))}, 'NULL')" for column in columns]
+    if syst == 'mysql':
+        return f"CAST(CONV(SUBSTRING(MD5(CONCAT_WS('|', {', '.join(column_texts)})), 1, 8), 16, 10) AS UNSIGNED)"
+    row_text = f"concat_ws('|', {', '.join(column_texts)})"
+    if syst == 'redshift':
+        return f"strtol(substring(md5({row_text}), 1, 8), 16)"
+    return f"('x' || substr(md5({row_text}), 1, 8))::bit(32)::bigint"
+
+
+def connect(syst, db_name, pipeline_id=None):
+    # pipeline_id explicite : les threads du vérificateur ne sont liés à aucun pipeline
+    return drivers.connect(syst, db_name, pipeline_id)
+
+
+def get_columns(conn, table_name):
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SELECT * FROM {table_name} LIMIT 0")
+        columns = [desc[0] for desc in cur.description]
+        cur.fetchall()
+        return columns
+    finally:
+        cur.close()
+
+
+def get_column_families(conn, syst, db_name, table_name):
+    cur = conn.cursor()
+    try:
+        if syst == 'mysql':
+            cur.execute("""
+                SELECT column_name, data_type
+                FROM information_schema.columns
+                WHERE table_name = %s AND table_schema = %s;
+                """, (table_name, db_name))
+        else:
+            cur.execute("""
+                SELECT attname, pg_catalog.format_type(atttypid, atttypmod)
+                FROM pg_catalog.pg_attribute
+                WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped;
+                """, (table_name,))
+        return {column: type_family(syst, data_type) for column, data_type in cur.fetchall()}
+    finally:
+        cur.close()
+
+
+def get_key_column(conn, syst, db_name, table_name):
+    if syst == 'mysql':
+        return initial_load.get_integer_key_mysql(conn, table_name, db_name)
+    return initial_load.get_integer_key_postgresql(conn, table_name)
+
+
+def fetch_one(conn, query, params=None):
+    cur = conn.cursor()
+    try:
+        cur.execute(query, params)
+        return cur.fetchone()
+    finally:
+        cur.close()
+
+
+def range_checksum(conn, syst, table_name, columns, key_column, key_range, families=None):
+    lower, upper = key_range
+    row = fetch_one(conn, f"""
+        SELECT COUNT(*), COALESCE(SUM({row_hash_expression(syst, columns, families)}), 0)
+        FROM {table_name}
+        WHERE {key_column} >= %s AND {key_column} < %s
+        """, (lower, upper))
+    return int(row[0]), int(row[1])
+
+
+def fetch_range_rows(conn, table_name, columns, key_column, key_range):
+    lower, upper = key_range
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SELECT {', '.join(columns)} FROM {table_name} WHERE {key_column} >= %s AND {key_column} < %s",
+                    (lower, upper))
+        key_index = columns.index(key_column)
+        return {row[key_index]: row for row in cur.fetchall()}
+    finally:
+        cur.close()
+
+
+def normalize_value(value):
+    # Comparaison ligne à ligne entre moteurs : bool/tinyint, timestamptz/datetime, numeric/decimal
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, decimal.Decimal) and value.is_finite():
+        return format(value.normalize(), 'f')
+    if isinstance(value, float) and math.isfinite(value) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+        return str(value.astimezone(datetime.timezone.utc).replace(tzinfo=None))
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    return str(value)
+
+
+def normalize_row(row):
+    return tuple(normalize_value(value) for value in row)
+
+
+def split_range(key_range, parts):
+    lower, upper = key_range
+    return initial_load.compute_key_ranges(lower, upper - 1, parts)
+
+
+def verify_table(syst_source, source_db, table_source, syst_dest, target_db, table_dest,
+                 repair=False, chunk_count=CHUNK_COUNT, leaf_size=LEAF_SIZE, workers=WORKERS, pipeline_id=None):
+    local = threading.local()
+    opened = []
+    opened_lock = threading.Lock()
+
+    def connections():
+        if not hasattr(local, 'source'):
+            local.source = connect(syst_source, source_db, pipeline_id)
+            local.target = connect(syst_dest, target_db, pipeline_id)
+            with opened_lock:
+                opened.extend([local.source, local.target])
+        return local.source, local.target
+
+    report = {
+        'table': table_source,
+        'ranges_checked': 0,
+        'mismatched_ranges': 0,
+        'missing_on_target': [],
+        'extra_on_target': [],
+        'different': [],
+        'repaired': 0,
+    }
+
+    def compare_range(key_range):
+        source_conn, target_conn = connections()
+        source_sum = range_checksum(source_conn, syst_source, table_source, columns, key_column, key_range, source_families)
+        target_sum = range_checksum(target_conn, syst_dest, table_dest, columns, key_column, key_range, target_families)
+        return key_range, max(source_sum[0], target_sum[0]), source_sum == target_sum
+
+    def diff_range(key_range):
+        source_conn, target_conn = connections()
+        source_rows = fetch_range_rows(source_conn, table_source, columns, key_column, key_range)
+        target_rows = fetch_range_rows(target_conn, table_dest, columns, key_column, key_range)
+        missing = [key for key in source_rows if key not in target_rows]
+        extra = [key for key in target_rows if key not in source_rows]
+        different = [key for key in source_rows
+                     if key in target_rows and normalize_row(source_rows[key]) != normalize_row(target_rows[key])]
+        repaired = 0
+        if repair and (missing or extra or different):
+            repaired = repair_rows(target_conn, table_dest, columns, key_column, source_rows, missing, extra, different)
+        return missing, extra, different, repaired
+
+    try:
+        source_conn, target_conn = connections()
+        key_column = get_key_column(source_conn, syst_source, source_db, table_source)
+        if not key_column:
+            raise ValueError(f"Table {table_source} needs a single integer primary key to be verified by ranges")
+        columns = get_columns(source_conn, table_source)
+        source_families = get_column_families(source_conn, syst_source, source_db, table_source)
+        target_families = get_column_families(target_conn, syst_dest, target_db, table_dest)
+        min_key, max_key = fetch_one(source_conn, f"SELECT MIN({key_column}), MAX({key_column}) FROM {table_source}")
+        target_min, target_max = fetch_one(target_conn, f"SELECT MIN({key_column}), MAX({key_column}) FROM {table_dest}")
+        bounds = [key for key in (min_key, max_key, target_min, target_max) if key is not None]
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            level = initial_load.compute_key_ranges(min(bounds), max(bounds), chunk_count) if bounds else []
+            leaves = []
+            # Descente par niveaux : seules les plages divergentes sont redécoupées
+            while level:
+                next_level = []
+                for key_range, row_count, matches in executor.map(compare_range, level):
+                    report['ranges_checked'] += 1
+                    if matches:
+                        continue
+                    report['mismatched_ranges'] += 1
+                    if key_range[1] - key_range[0] <= leaf_size or row_count <= leaf_size:
+                        leaves.append(key_range)
+                    else:
+                        next_level.extend(split_range(key_range, FANOUT))
+                level = next_level
+
+            for missing, extra, different, repaired in executor.map(diff_range, leaves):
+                report['missing_on_target'].extend(missing)
+                report['extra_on_target'].extend(extra)
+                report['different'].extend(different)
+                report['repaired'] += repaired
+    finally:
+        for conn in opened:
+            conn.close()
+
+    logging.info(f"Verified {table_source}: {report['ranges_checked']} ranges checked, "
+                 f"{len(report['missing_on_target'])} missing, {len(report['extra_on_target'])} extra, "
+                 f"{len(report['different'])} different, {report['repaired']} repaired")
+    return report
+
+
+def repair_rows(target_conn, table_name, columns, key_column, source_rows, missing, extra, different):
+    placeholders = ', '.join(['%s'] * len(columns))
+    cur = target_conn.cursor()
+    try:
+        for key in extra + different:
+            cur.execute(f"DELETE FROM {table_name} WHERE {key_column} = %s", (key,))
+        for key in missing + different:
+            cur.execute(f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})", source_rows[key])
+        target_conn.commit()
+    except Exception as e:
+        logging.error(f"Error repairing rows of {table_name}: {e}")
+        target_conn.rollback()
+        return 0
+    finally:
+        cur.close()
+    return len(missing) + len(extra) + len(different)
@@ -1,53 +1,16 @@
-import psycopg2
-import mysql.connector
 import logging
 
+import drivers
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 def source_db_connection(source_db):
-    try:
-        conn_params = {
-            'database': source_db,
-            'host': 'localhost',
-            'port': 3306,
-            'user': 'nass',
-            'password': 'mysql',
-        }
-        source_conn = mysql.connector.connect(**conn_params)
-        logging.info(f"Connected to source database: {source_db}")
-        return source_conn
-    except Exception as e:
-        logging.error(f"Error connecting to source database: {e}")
-        return None
+    return drivers.source_connection(source_db, 'mysql')
 
 
 def target_db_connection(target_db, syst_dest):
-    try:
-        if syst_dest == 'postgresql':
-            conn_params = {
-                'dbname': target_db,
-                'host': 'localhost',
-                'port': 5555,
-                'user': 'postgres',
-                'password': 'postgres',
-            }
-            target_conn = psycopg2.connect(**conn_params)
-        elif syst_dest == 'mysql':
-            conn_params = {
-                'database': target_db,
-                'host': 'localhost',
-                'port': 3306,
-                'user': 'nass',
-                'password': 'mysql',
-            }
-            target_conn = mysql.connector.connect(**conn_params)
-        else:
-            raise ValueError("Unsupported DBMS type")
-        logging.info(f"Connected to target database: {target_db} using {syst_dest}")
-        return target_conn
-    except Exception as e:
-        logging.error(f"Error connecting to target database: {e}")
-        return None
+    return drivers.target_connection(target_db, syst_dest)
+
 
 def get_table_structure(conn, table_name, target_db, syst_dest):
     try:
@@ -75,6 +38,7 @@ def get_table_structure(conn, table_name, target_db, syst_dest):
 
 
 def replicate_alter_table_add(source_conn, target_conn, table_name, target_db, source_db, syst_dest):
+    applied = []
     try:
         source_structure = get_table_structure(source_conn, table_name, source_db, syst_dest)
         target_structure = get_table_structure(target_conn, table_name, target_db, syst_dest)
@@ -88,12 +52,15 @@ def replicate_alter_table_add(source_conn, target_conn, table_name, target_db, s
                     alter_query = f"ALTER TABLE {table_name} ADD COLUMN {column} {data_type};"
                     cur.execute(alter_query)
                     target_conn.commit()
+                    applied.append(alter_query)
                     logging.info(f"Column {column} added to {table_name} in target database.")
     except Exception as e:
         logging.error(f"Error in replicate_alter_table_add for {table_name} in {target_db}: {e}")
+    return applied
 
 
 def replicate_alter_table_drop(source_conn, target_conn, table_name, target_db, source_db, syst_dest):
+    applied = []
     try:
         source_structure = get_table_structure(source_conn, table_name, source_db, syst_dest)
         target_structure = get_table_structure(target_conn, table_name, target_db, syst_dest)
@@ -107,11 +74,14 @@ def replicate_alter_table_drop(source_conn, target_conn, table_name, target_db,
                     alter_query = f"ALTER TABLE {table_name} DROP COLUMN {column};"
                     cur.execute(alter_query)
                     target_conn.commit()
+                    applied.append(alter_query)
                     logging.info(f"Column {column} dropped from {table_name} in target database.")
     except Exception as e:
         logging.error(f"Error in replicate_alter_table_drop for {table_name} in {target_db}: {e}")
+    return applied
 
 def replicate_alter_table_modify(source_conn, target_conn, table_name, target_db, syst_dest, source_db):
+    applied = []
     try:
         source_structure = get_table_structure(source_conn, table_name, source_db, syst_dest)
         target_structure = get_table_structure(target_conn, table_name, target_db, syst_dest)
@@ -128,9 +98,11 @@ def replicate_alter_table_modify(source_conn, target_conn, table_name, target_db
                         alter_query = f"ALTER TABLE {table_name} MODIFY {column} {data_type};"
                     cur.execute(alter_query)
                     target_conn.commit()
+                    applied.append(alter_query)
                     logging.info(f"Type of column {column} altered to {data_type} in {table_name} in target database.")
     except Exception as e:
         logging.error(f"Error in replicate_alter_table_modify for {table_name} in {target_db}: {e}")
+    return applied
 
 def map_data_types(postgres_type):
     mapping = {
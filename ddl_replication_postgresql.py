@@ -1,19 +1,13 @@
 import psycopg2
-import mysql.connector
 import logging
-import redshift_connector
+
+import drivers
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
 def execute_query_ddl(source_db, sql_query):
-    conn_params = {
-        'host': 'localhost',
-        'port': 5555,
-        'dbname': source_db,
-        'user': 'postgres',
-        'password': 'postgres'
-    }
+    conn_params = drivers.connection_params('postgresql', source_db)
     conn = psycopg2.connect(**conn_params)
     try:
         with conn.cursor() as cur:
@@ -25,13 +19,7 @@ def execute_query_ddl(source_db, sql_query):
         conn.close()
 
 def source_db_connection(source_db):
-    conn_params = {
-        'host': 'localhost',
-        'port': 5555,
-        'dbname': source_db,
-        'user': 'postgres',
-        'password': 'postgres',
-    }
+    conn_params = drivers.connection_params('postgresql', source_db)
     try:
         source_conn = psycopg2.connect(**conn_params)
         logging.info(f"Connected to source database: {source_db}")
@@ -41,42 +29,8 @@ def source_db_connection(source_db):
         return None
 
 def target_db_connection(target_db, syst_dest):
-    try:
-        if syst_dest == 'postgresql':
-            conn_params = {
-                'dbname': target_db,
-                'host': 'localhost',
-                'port': 5555,
-                'user': 'postgres',
-                'password': 'postgres',
-            }
-            target_conn = psycopg2.connect(**conn_params)
-        elif syst_dest == 'mysql':
-            conn_params = {
-                'database': target_db,
-                'host': 'localhost',
-                'port': 3306,
-                'user': 'nass',
-                'password': 'mysql',
-            }
-            target_conn = mysql.connector.connect(**conn_params)
-        elif syst_dest == 'redshift':
-            conn_params = {
-                'database': target_db,
-                'host': '',
-                'port': 5439,
-                'user': '',
-                'password': '',
-            }
-            target_conn = redshift_connector.connect(**conn_params)
-        else:
-            raise ValueError("Unsupported DBMS type")
-
-        logging.info(f"Connected to target database: {target_db} using {syst_dest}")
-        return target_conn
-    except Exception as e:
-        logging.error(f"Error connecting to target database {target_db} with system {syst_dest}: {e}")
-        return None
+    return drivers.target_connection(target_db, syst_dest)
+
 
 def get_table_structure(conn, table_name):
     try :
@@ -93,6 +47,7 @@ def get_table_structure(conn, table_name):
         return []
 
 def replicate_alter_table_add(source_conn, target_conn, table_name):
+    applied = []
     try:
         source_structure = get_table_structure(source_conn, table_name)
         target_structure = get_table_structure(target_conn, table_name)
@@ -106,11 +61,14 @@ def replicate_alter_table_add(source_conn, target_conn, table_name):
                     alter_query = f"ALTER TABLE {table_name} ADD COLUMN {column} {data_type};"
                     cur.execute(alter_query)
                     target_conn.commit()
+                    applied.append(alter_query)
                     logging.info(f"Column {column} added to {table_name} in target database.")
     except Exception as e:
         logging.error(f"Error in replicate_alter_table_add for {table_name}: {e}")
+    return applied
 
 def replicate_alter_table_drop(source_conn, target_conn, table_name):
+    applied = []
     try:
         source_structure = get_table_structure(source_conn, table_name)
         target_structure = get_table_structure(target_conn, table_name)
@@ -124,12 +82,15 @@ def replicate_alter_table_drop(source_conn, target_conn, table_name):
                     alter_query = f"ALTER TABLE {table_name} DROP COLUMN {column};"
                     cur.execute(alter_query)
                     target_conn.commit()
+                    applied.append(alter_query)
                     logging.info(f"Column {column} dropped from {table_name} in target database.")
     except Exception as e:
         logging.error(f"Error in replicate_alter_table_drop for {table_name}: {e}")
+    return applied
 
 def replicate_alter_table_modify(source_conn, target_conn, table_name,syst_dest):
 
+    applied = []
     try:
 
         source_structure = get_table_structure(source_conn, table_name)
@@ -148,9 +109,11 @@ def replicate_alter_table_modify(source_conn, target_conn, table_name,syst_dest)
                             alter_query = f"ALTER TABLE {table_name} MODIFY {column} {data_type};"
                         cur.execute(alter_query)
                         target_conn.commit()
+                        applied.append(alter_query)
                         logging.info(f"Type of column {column} altered to {data_type} in {table_name} in target database.")
     except Exception as e:
         logging.error(f"Error in replicate_alter_table_modify for {table_name}: {e}")
+    return applied
 
 
 def map_data_types(postgres_type):
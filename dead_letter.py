@@ -0,0 +1,265 @@
+import pickle
+import sqlite3
+import time
+import logging
+
+import change_batches
+import drivers
+import profiling
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Stockage local : les changements en échec survivent au redémarrage et sont partagés avec les processus runner
+DEAD_LETTER_DB = "dead_letters.db"
+# Reprise avec attente exponentielle ; au-delà de MAX_ATTEMPTS l'entrée attend un rejeu manuel
+RETRY_BASE_DELAY = 5
+RETRY_MAX_DELAY = 3600
+MAX_ATTEMPTS = 10
+RETRY_POLL_INTERVAL = 5
+RETRY_BATCH_SIZE = 100
+
+
+def connect():
+    conn = sqlite3.connect(DEAD_LETTER_DB, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS dead_letters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pipeline TEXT,
+            target_db TEXT NOT NULL,
+            syst_dest TEXT NOT NULL,
+            dml_module TEXT NOT NULL,
+            apply_mode TEXT NOT NULL,
+            relation TEXT NOT NULL,
+            op TEXT NOT NULL,
+            record BLOB NOT NULL,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 1,
+            state TEXT NOT NULL DEFAULT 'pending',
+            failed_at REAL NOT NULL,
+            next_retry_at REAL,
+            applied_at REAL
+        )""")
+    # Fichiers créés avant le suivi par ligne : les anciennes entrées n'ont pas de clé et ne bloquent rien
+    for column in ('row_key', 'new_row_key'):
+        try:
+            conn.execute(f"ALTER TABLE dead_letters ADD COLUMN {column} TEXT")
+        except sqlite3.OperationalError:
+            pass
+    conn.execute("CREATE INDEX IF NOT EXISTS dead_letters_due ON dead_letters (state, next_retry_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS dead_letters_rows ON dead_letters (target_db, syst_dest, row_key)")
+    return conn
+
+
+def retry_delay(attempts):
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempts - 1))
+
+
+def row_keys(record):
+    # Ligne avant et après le changement (clé primaire, ou ligne entière sans clé) ; None pour un TRUNCATE
+    if record.values is None and record.old_values is None:
+        return None, None
+    old_row = record.old_values if record.old_values is not None else record.values
+    new_row = record.values if record.values is not None else record.old_values
+    if record.relation.key_positions:
+        old_row = tuple(old_row[position] for position in record.relation.key_positions)
+        new_row = tuple(new_row[position] for position in record.relation.key_positions)
+    return f"{record.relation.name}:{old_row!r}", f"{record.relation.name}:{new_row!r}"
+
+
+def pending_rows(target_db, syst_dest):
+    # Lignes dont un changement attend encore : les suivants ne doivent pas passer devant lui
+    conn = connect()
+    try:
+        rows = conn.execute("""
+            SELECT row_key, new_row_key FROM dead_letters
+            WHERE state IN ('pending', 'failed') AND target_db = ? AND syst_dest = ? AND row_key IS NOT NULL
+            """, (target_db, syst_dest)).fetchall()
+    finally:
+        conn.close()
+    return {key for row in rows for key in row}
+
+
+def add(record, target_db, syst_dest, dml_module, apply_mode, error):
+    # dml_module : module source dont les QUERY_BUILDERS et la connexion cible servent à la reprise
+    now = time.time()
+    row_key, new_row_key = row_keys(record)
+    conn = connect()
+    try:
+        with conn:
+            conn.execute("""
+                INSERT INTO dead_letters (pipeline, target_db, syst_dest, dml_module, apply_mode, relation, op, record, error,
+                                          failed_at, next_retry_at, row_key, new_row_key)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (profiling.current_pipeline(), target_db, syst_dest, dml_module, apply_mode, record.relation.name, record.op,
+                      pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL), str(error), now, now + retry_delay(1),
+                      row_key, new_row_key))
+    finally:
+        conn.close()
+    logging.warning(f"Dead-lettered {record.op} change on {record.relation.name} for {target_db}: {error}")
+
+
+def entry_dict(row, with_record=True):
+    entry = {key: row[key] for key in row.keys() if key != 'record'}
+    if with_record:
+        record = pickle.loads(row['record'])
+        entry['values'] = [repr(value) for value in record.values] if record.values is not None else None
+        entry['old_values'] = [repr(value) for value in record.old_values] if record.old_values is not None else None
+    return entry
+
+
+def list_entries(state=None, pipeline=None, limit=100):
+    clauses, params = [], []
+    if state:
+        clauses.append("state = ?")
+        params.append(state)
+    if pipeline:
+        clauses.append("pipeline = ?")
+        params.append(pipeline)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    conn = connect()
+    try:
+        rows = conn.execute(f"SELECT * FROM dead_letters {where} ORDER BY id LIMIT ?", params + [limit]).fetchall()
+    finally:
+        conn.close()
+    return [entry_dict(row) for row in rows]
+
+
+def counts(target_db=None, syst_dest=None):
+    conn = connect()
+    try:
+        rows = conn.execute("""
+            SELECT state, COUNT(*) FROM dead_letters
+            WHERE (? IS NULL OR target_db = ?) AND (? IS NULL OR syst_dest = ?)
+            GROUP BY state
+            """, (target_db, target_db, syst_dest, syst_dest)).fetchall()
+    finally:
+        conn.close()
+    return {state: count for state, count in rows}
+
+
+def blocking_entry(conn, row):
+    # Changement plus ancien de la même ligne pas encore appliqué : celui-ci l'attend
+    if row['row_key'] is None:
+        return None
+    return conn.execute("""
+        SELECT id, next_retry_at FROM dead_letters
+        WHERE id < ? AND state IN ('pending', 'failed') AND target_db = ? AND syst_dest = ?
+          AND (row_key IN (?, ?) OR new_row_key IN (?, ?))
+        ORDER BY id LIMIT 1
+        """, (row['id'], row['target_db'], row['syst_dest'], row['row_key'], row['new_row_key'],
+              row['row_key'], row['new_row_key'])).fetchone()
+
+
+def release_followers(conn, row):
+    # La ligne est débloquée : les changements qui l'attendaient sont repris sans délai
+    if row['row_key'] is None:
+        return
+    conn.execute("""
+        UPDATE dead_letters SET next_retry_at = ?
+        WHERE id > ? AND state = 'pending' AND target_db = ? AND syst_dest = ?
+          AND (row_key IN (?, ?) OR new_row_key IN (?, ?))
+        """, (time.time(), row['id'], row['target_db'], row['syst_dest'], row['row_key'], row['new_row_key'],
+              row['row_key'], row['new_row_key']))
+
+
+def retry_entries(rows):
+    # Une connexion par cible ; chaque entrée est validée seule pour qu'un échec n'annule pas les autres
+    applied, failed = 0, 0
+    conn = connect()
+    target_conns = {}
+    try:
+        for row in rows:
+            blocker = blocking_entry(conn, row)
+            if blocker is not None:
+                # Sans tentative comptée : l'entrée repassera quand celle qui la bloque sera appliquée ou écartée
+                with conn:
+                    conn.execute("UPDATE dead_letters SET next_retry_at = ? WHERE id = ?",
+                                 (max(time.time() + RETRY_POLL_INTERVAL, blocker['next_retry_at'] or time.time() + RETRY_MAX_DELAY),
+                                  row['id']))
+                failed += 1
+                continue
+            target = (row['dml_module'], row['target_db'], row['syst_dest'])
+            dml_module = drivers.load(row['dml_module'])
+            try:
+                if target not in target_conns:
+                    target_conns[target] = dml_module.target_db_connection(row['target_db'], row['syst_dest'])
+                target_conn = target_conns[target]
+                cur = target_conn.cursor()
+                try:
+                    change_batches.execute_record(cur, pickle.loads(row['record']), row['syst_dest'], dml_module.QUERY_BUILDERS,
+                                                  row['apply_mode'])
+                finally:
+                    cur.close()
+                target_conn.commit()
+                with conn:
+                    conn.execute("UPDATE dead_letters SET state = 'applied', applied_at = ?, next_retry_at = NULL WHERE id = ?",
+                                 (time.time(), row['id']))
+                    release_followers(conn, row)
+                applied += 1
+            except Exception as e:
+                if target in target_conns:
+                    try:
+                        target_conns[target].rollback()
+                    except Exception:
+                        del target_conns[target]
+                attempts = row['attempts'] + 1
+                state = 'failed' if attempts >= MAX_ATTEMPTS else 'pending'
+                with conn:
+                    conn.execute("UPDATE dead_letters SET attempts = ?, error = ?, state = ?, next_retry_at = ? WHERE id = ?",
+                                 (attempts, str(e), state, time.time() + retry_delay(attempts) if state == 'pending' else None,
+                                  row['id']))
+                failed += 1
+                logging.error(f"Retry {attempts} of dead-lettered change {row['id']} on {row['relation']} failed: {e}")
+    finally:
+        for target_conn in target_conns.values():
+            target_conn.close()
+        conn.close()
+    return applied, failed
+
+
+def retry_due(target_db, syst_dest, limit=RETRY_BATCH_SIZE):
+    # Ordre d'arrivée : les changements d'une même ligne sont rejoués dans l'ordre où ils ont échoué
+    conn = connect()
+    try:
+        rows = conn.execute("""
+            SELECT * FROM dead_letters
+            WHERE state = 'pending' AND next_retry_at <= ? AND target_db = ? AND syst_dest = ?
+            ORDER BY id LIMIT ?
+            """, (time.time(), target_db, syst_dest, limit)).fetchall()
+    finally:
+        conn.close()
+    if not rows:
+        return 0, 0
+    applied, failed = retry_entries(rows)
+    logging.info(f"Retried {len(rows)} dead-lettered changes for {target_db}: {applied} applied, {failed} still failing")
+    return applied, failed
+
+
+def replay(entry_ids):
+    # Rejeu manuel immédiat, y compris des entrées ayant épuisé leurs tentatives
+    conn = connect()
+    try:
+        placeholders = ', '.join(['?'] * len(entry_ids))
+        rows = conn.execute(f"SELECT * FROM dead_letters WHERE id IN ({placeholders}) AND state != 'applied' ORDER BY id",
+                            list(entry_ids)).fetchall()
+    finally:
+        conn.close()
+    applied, failed = retry_entries(rows)
+    return {'requested': len(entry_ids), 'applied': applied, 'failed': failed}
+
+
+def discard(entry_ids):
+    conn = connect()
+    try:
+        placeholders = ', '.join(['?'] * len(entry_ids))
+        with conn:
+            cursor = conn.execute(f"UPDATE dead_letters SET state = 'discarded', next_retry_at = NULL "
+                                  f"WHERE id IN ({placeholders}) AND state != 'applied'", list(entry_ids))
+            for row in conn.execute(f"SELECT * FROM dead_letters WHERE id IN ({placeholders}) AND state = 'discarded'",
+                                    list(entry_ids)).fetchall():
+                release_followers(conn, row)
+        return {'requested': len(entry_ids), 'discarded': cursor.rowcount}
+    finally:
+        conn.close()
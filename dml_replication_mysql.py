@@ -4,152 +4,285 @@ from pymysqlreplication.row_event import (
     UpdateRowsEvent,
     WriteRowsEvent,
 )
-import mysql.connector
-import psycopg2
+from pymysqlreplication.event import GtidEvent, HeartbeatLogEvent, QueryEvent, RotateEvent, XidEvent
+import time
 import logging
 
+from change_records import ChangeRecord, RelationDescriptor
+import change_batches
+import change_log
+import profiling
+import replication_lag
+import adaptive_batching
+import source_filters
+import parallel_apply
+import drivers
+import metadata_cache
+
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Descripteur par (schéma, table) source
+relations = {}
 
-def replicate_insert(data, table_name, target_db, syst_dest, table_dest):
-    try:
-        columns = ', '.join(data.keys())
-        values = ', '.join([f"'{value}'" if isinstance(value, str) else str(value) for value in data.values()])
-        insert_template = f'INSERT INTO {table_dest} ({columns}) VALUES ({values});'
-        replicate_queries(insert_template, target_db, syst_dest)
-        logging.info(f"Insert query executed: {insert_template}")
-        return insert_template
-    except Exception as e:
-        logging.error(f"Error in replicate_insert: {e}")
-
-def replicate_delete(data, table_name, target_db, syst_dest, table_dest):
-    try:
-        conditions = [f"{column} = '{value}'" if isinstance(value, str) else f"{column} = {value}" for column, value in data.items()]
-        where_clause = ' AND '.join(conditions)
-        delete_template = f'DELETE FROM {table_dest} WHERE {where_clause};'
-        replicate_queries(delete_template, target_db, syst_dest)
-        logging.info(f"Delete query executed: {delete_template}")
-        return delete_template
-    except Exception as e:
-        logging.error(f"Error in replicate_delete: {e}")
-
-def replicate_update(before_values, after_values, table_name, target_db, syst_dest, table_dest):
-    try:
-        set_clauses = [f"{column} = '{after_values[column]}'" if isinstance(after_values[column], str) else f"{column} = {after_values[column]}" for column in after_values]
-        conditions = [f"{column} = '{before_values[column]}'" if isinstance(before_values[column], str) else f"{column} = {before_values[column]}" for column in before_values]
-        where_clause = ' AND '.join(conditions)
-        update_template = f"UPDATE {table_dest} SET {', '.join(set_clauses)} WHERE {where_clause};"
-        replicate_queries(update_template, target_db, syst_dest)
-        logging.info(f"Update query executed: {update_template}")
-        return update_template
-    except Exception as e:
-        logging.error(f"Error in replicate_update: {e}")
-
-def replicate_queries(query, target_db, syst_dest):
-    conn = None
+# Période (secondes) des heartbeats demandés au serveur en lecture bloquante : délai maximal d'arrêt ou de pause
+BINLOG_HEARTBEAT_PERIOD = 1
+
+
+def get_relation(binlogevent, table_dest, columns=None):
+    # Un descripteur par table, partagé par toutes les lignes ; recréé si les colonnes changent.
+    # columns restreint les colonnes répliquées (le binlog, lui, transporte toujours la ligne entière)
+    column_names = tuple(column.name for column in binlogevent.columns if columns is None or column.name in columns)
+    relation = relations.get((binlogevent.schema, binlogevent.table))
+    if relation is None or relation.column_names != column_names or relation.name != table_dest:
+        primary_key = binlogevent.primary_key
+        if isinstance(primary_key, str):
+            primary_key = (primary_key,)
+        key_positions = tuple(column_names.index(column) for column in primary_key or () if column in column_names)
+        relation = RelationDescriptor(None, binlogevent.schema, table_dest, column_names, key_positions=key_positions)
+        relations[(binlogevent.schema, binlogevent.table)] = relation
+    return relation
+
+
+def row_values(relation, values):
+    return tuple(values[column_name] for column_name in relation.column_names)
+
+
+def event_op(binlogevent):
+    if isinstance(binlogevent, DeleteRowsEvent):
+        return 'D'
+    if isinstance(binlogevent, UpdateRowsEvent):
+        return 'U'
+    return 'I'
+
+
+def event_records(op, relation, rows, commit_ts=None):
+    if op == 'D':
+        return [ChangeRecord('D', relation, None, row_values(relation, row["values"]), commit_ts) for row in rows]
+    if op == 'U':
+        return [ChangeRecord('U', relation, row_values(relation, row["after_values"]), row_values(relation, row["before_values"]), commit_ts)
+                for row in rows]
+    return [ChangeRecord('I', relation, row_values(relation, row["values"]), None, commit_ts) for row in rows]
+
+
+def key_conditions(record):
+    # Conditions et paramètres identifiant la ligne ; les valeurs passent par le pilote, jamais en littéral
+    relation = record.relation
+    row = record.old_values if record.old_values is not None else record.values
+    positions = relation.key_positions or range(len(row))
+    if not positions:
+        raise ValueError(f"No column to identify the {record.op} row on {relation.name}")
+    conditions = [f"{relation.column_names[position]} IS NULL" if row[position] is None else f"{relation.column_names[position]} = %s"
+                  for position in positions]
+    return conditions, [row[position] for position in positions if row[position] is not None]
+
+
+def build_insert_query(record):
+    relation = record.relation
+    placeholders = ', '.join(['%s'] * len(relation.column_names))
+    return f'INSERT INTO {relation.name} ({", ".join(relation.column_names)}) VALUES ({placeholders});', list(record.values)
+
+
+def build_delete_query(record):
+    conditions, params = key_conditions(record)
+    return f'DELETE FROM {record.relation.name} WHERE {" AND ".join(conditions)};', params
+
+
+def build_update_query(record):
+    relation = record.relation
+    changed = [(column_name, value)
+               for column_name, value, old_value in zip(relation.column_names, record.values, record.old_values)
+               if value != old_value]
+    if not changed:
+        return None
+    conditions, key_params = key_conditions(record)
+    set_clauses = [f"{column_name} = %s" for column_name, _ in changed]
+    return (f"UPDATE {relation.name} SET {', '.join(set_clauses)} WHERE {' AND '.join(conditions)};",
+            [value for _, value in changed] + key_params)
+
+
+QUERY_BUILDERS = {
+    'I': build_insert_query,
+    'U': build_update_query,
+    'D': build_delete_query,
+}
+
+
+def target_db_connection(target_db, syst_dest):
+    return drivers.target_connection(target_db, syst_dest)
+
+
+def binlog_position(conn):
+    # SHOW MASTER STATUS est retiré de MySQL 8.4 au profit de SHOW BINARY LOG STATUS
+    cur = conn.cursor()
     try:
-        conn = target_db_connection(target_db, syst_dest)
-        cursor = conn.cursor()
-        cursor.execute(query)
-        conn.commit()
-        logging.info(f"Query executed successfully: {query}")
-    except psycopg2.Error as e:
-        logging.error(f"PostgreSQL error: {e}")
-        if conn:
-            conn.rollback()
-    except mysql.connector.Error as e:
-        logging.error(f"MySQL error: {e}")
-        if conn and conn.is_connected():
-            conn.rollback()
+        try:
+            cur.execute("SHOW BINARY LOG STATUS")
+        except Exception:
+            cur.execute("SHOW MASTER STATUS")
+        log_file, log_pos = cur.fetchone()[:2]
     finally:
-        if conn:
-            cursor.close()
-            if syst_dest == 'mysql' and conn.is_connected():
-                conn.close()
-            elif syst_dest == 'postgresql':
-                conn.close()
+        cur.close()
+    return log_file, log_pos
 
-def target_db_connection(target_db, syst_dest):
+
+def current_binlog_position(source_db):
+    conn = drivers.connect('mysql', source_db)
     try:
-        if syst_dest == 'postgresql':
-            conn_params = {
-                'dbname': target_db,
-                'host': 'localhost',
-                'port': 5555,
-                'user': 'postgres',
-                'password': 'postgres',
-            }
-            conn = psycopg2.connect(**conn_params)
-        elif syst_dest == 'mysql':
-            conn_params = {
-                'database': target_db,
-                'host': 'localhost',
-                'port': 3306,
-                'user': 'nass',
-                'password': 'mysql',
-            }
-            conn = mysql.connector.connect(**conn_params)
-        else:
-            raise ValueError("Unsupported DBMS type")
-        logging.info(f"Connected to target database: {target_db} using {syst_dest}")
-        return conn
-    except Exception as e:
-        logging.error(f"Error connecting to database: {e}")
-        return None
+        return binlog_position(conn)
+    finally:
+        conn.close()
+
+
+def split_transactions(records, boundaries):
+    # boundaries : (last_committed, sequence_number, fin) de chaque transaction validée dans records
+    transactions, start = [], 0
+    for last_committed, sequence_number, end in boundaries:
+        if end > start:
+            transactions.append((last_committed, sequence_number, records[start:end]))
+        start = end
+    return transactions
 
 
-def main(source_db, target_db, syst_dest, table_source, table_dest):
-    mysql_settings = {
-        "host": "localhost",
-        "port": 3306,
-        "user": "nass",
-        "passwd": "mysql",
-        "db": source_db
-    }
+def main(source_db, target_db, syst_dest, table_source, table_dest, log_file=None, log_pos=None, stop_event=None, records_sink=None,
+         batching=None, apply_mode='insert', filters=None, parallel=None, blocking=False, on_progress=None, resume_event=None):
+    mysql_settings = drivers.connection_params('mysql', source_db)
+    if log_file is None:
+        # Position explicite : sans elle, chaque lecture repartirait de la position courante du serveur
+        # et sauterait ce qui a été validé depuis la précédente
+        log_file, log_pos = current_binlog_position(source_db)
 
+    # parallel : nombre de connexions cible ; les transactions indépendantes d'après le group commit
+    # (ou sans clé commune) sont appliquées en même temps
+    workers = parallel if records_sink is None and parallel and parallel > 1 else None
+    # Xid (ou COMMIT d'une table non transactionnelle) marque la fin d'une transaction : la position n'avance
+    # et le tampon n'est vidé qu'à ces frontières. Rotate : les horloges logiques repartent à zéro dans chaque fichier
+    only_events = [DeleteRowsEvent, UpdateRowsEvent, WriteRowsEvent, GtidEvent, XidEvent, QueryEvent, RotateEvent]
+    if blocking:
+        only_events.append(HeartbeatLogEvent)
+
+    # Non bloquant : main rend la main une fois le binlog rattrapé.
+    # Bloquant : un seul flux par job, les changements arrivent dès leur validation sur la source ;
+    # les heartbeats du serveur rythment l'arrêt, la pause et le vidage du tampon quand la source est inactive
     stream = BinLogStreamReader(
         connection_settings=mysql_settings,
         server_id=1,
-        only_events=[DeleteRowsEvent, UpdateRowsEvent, WriteRowsEvent],
-        blocking=True,
-        only_tables=table_source,
-        resume_stream=True
+        only_events=only_events,
+        blocking=blocking,
+        slave_heartbeat=BINLOG_HEARTBEAT_PERIOD if blocking else None,
+        resume_stream=True,
+        log_file=log_file,
+        log_pos=log_pos,
+        **source_filters.binlog_filters(filters, table_source)
     )
 
-    try:
-        for binlogevent in stream:
-            for row in binlogevent.rows:
-                table_name = f"{binlogevent.schema}.{binlogevent.table}"
-                logging.info(f"Processing table: {table_name} from {source_db}")
-
-                event = {"schema": binlogevent.schema, "table": binlogevent.table}
+    if records_sink is None:
+        def records_sink(records, log_file, log_pos):
+            return change_batches.apply_records(records, target_db, syst_dest, QUERY_BUILDERS, target_db_connection,
+                                                max_rows=adaptive_batching.batch_rows(batching, change_batches.BATCH_MAX_ROWS),
+                                                apply_mode=apply_mode)
 
-                if isinstance(binlogevent, DeleteRowsEvent):
-                    event["action"] = "delete"
-                    event["data"] = row["values"]
-                    replicate_delete(row["values"], table_name, target_db, syst_dest, table_dest)
+    def flush(records, backlog):
+        started = time.time()
+        if workers:
+            applied = parallel_apply.apply_transactions(split_transactions(records, boundaries), target_db, syst_dest, QUERY_BUILDERS,
+                                                        target_db_connection, workers,
+                                                        adaptive_batching.batch_rows(batching, change_batches.BATCH_MAX_ROWS), apply_mode)
+        else:
+            applied = records_sink(records, stats['log_file'], stats['log_pos'])
+        # Seules des transactions complètes sont vidées : les frontières restantes n'ont plus d'objet
+        boundaries.clear()
+        lag = time.time() - stats['last_commit_ts'] if stats['last_commit_ts'] is not None else None
+        adaptive_batching.observe(batching, len(records), buffered['bytes'], time.time() - started, backlog, lag)
+        buffered.update(bytes=0, since=None)
+        report(applied)
 
-                elif isinstance(binlogevent, UpdateRowsEvent):
-                    event["action"] = "update"
-                    event["before_values"] = row["before_values"]
-                    event["after_values"] = row["after_values"]
-                    replicate_update(row["before_values"], row["after_values"], table_name, target_db, syst_dest, table_dest)
+    def report(applied):
+        # Avec on_progress, chaque vidage est signalé tout de suite (position comprise) au lieu d'être cumulé
+        if on_progress is not None:
+            on_progress({'changes': applied, 'last_commit_ts': stats['last_commit_ts'],
+                         'log_file': stats['log_file'], 'log_pos': stats['log_pos']})
+        else:
+            stats['changes'] += applied
 
-                elif isinstance(binlogevent, WriteRowsEvent):
-                    event["action"] = "insert"
-                    event["data"] = row["values"]
-                    replicate_insert(row["values"], table_name, target_db, syst_dest, table_dest)
+    stats = {'changes': 0, 'last_commit_ts': None, 'log_file': log_file, 'log_pos': log_pos}
+    records = []
+    boundaries = []
+    clock = (None, None)
+    # Taille et ancienneté du tampon : le flush a lieu à la taille de lot ou à l'intervalle adaptatifs
+    buffered = {'bytes': 0, 'since': None}
+    max_rows = adaptive_batching.batch_rows(batching, change_batches.BATCH_MAX_ROWS)
+    try:
+        for binlogevent in profiling.timed_iter(stream, 'fetch'):
+            if isinstance(binlogevent, (HeartbeatLogEvent, RotateEvent)):
+                # Source inactive, ou changement de fichier binlog (les horloges du group commit repartent à zéro,
+                # une vague ne doit pas mêler deux fichiers) : seules les transactions complètes sont appliquées
+                complete = boundaries[-1][2] if boundaries else 0
+                if complete:
+                    flush(records[:complete], False)
+                    records = records[complete:]
+                if isinstance(binlogevent, HeartbeatLogEvent) and not records:
+                    stats['log_file'], stats['log_pos'] = stream.log_file, stream.log_pos
+            elif isinstance(binlogevent, GtidEvent):
+                # Horloges logiques du group commit (absentes des GTID anonymes)
+                clock = (getattr(binlogevent, 'last_committed', None), getattr(binlogevent, 'sequence_number', None))
+            elif isinstance(binlogevent, (XidEvent, QueryEvent)):
+                if isinstance(binlogevent, XidEvent) or binlogevent.query.strip().upper() == 'COMMIT':
+                    boundaries.append((*clock, len(records)))
+                    clock = (None, None)
+                    stats['log_file'], stats['log_pos'] = stream.log_file, stream.log_pos
+                    if len(records) >= max_rows:
+                        flush(records, True)
+                        records = []
+                        max_rows = adaptive_batching.batch_rows(batching, change_batches.BATCH_MAX_ROWS)
+                    elif batching and buffered['since'] and time.time() - buffered['since'] >= adaptive_batching.flush_interval(batching):
+                        flush(records, False)
+                        records = []
+                elif metadata_cache.changes_catalog(binlogevent.query):
+                    # CREATE / DROP vus dans le binlog : les listes de tables de la source en cache sont périmées
+                    metadata_cache.invalidate('mysql', source_db)
+            else:
+                # Les lignes d'un événement ne sont décodées qu'au premier accès à rows
+                with profiling.timed('decode'):
+                    rows = binlogevent.rows
+                logging.info(f"Processing {len(rows)} rows of {binlogevent.schema}.{binlogevent.table} from {source_db}")
+                with profiling.timed('transform'):
+                    # La table de heartbeat garde son nom : ses lignes sont consommées par la mesure de retard ;
+                    # sans table cible, chaque table source garde aussi le sien
+                    relation = get_relation(binlogevent, binlogevent.table if binlogevent.table == replication_lag.HEARTBEAT_TABLE
+                                            else table_dest or binlogevent.table,
+                                            source_filters.table_columns(filters, binlogevent.table))
+                    records.extend(event_records(event_op(binlogevent), relation, rows, binlogevent.timestamp))
+                stats['last_commit_ts'] = binlogevent.timestamp
+                buffered['bytes'] += getattr(binlogevent, 'event_size', 0)
+                buffered['since'] = buffered['since'] or time.time()
 
-                logging.info(f"Event processed: {event}")
+            if stop_event is not None and stop_event.is_set():
+                break
+            if resume_event is not None and not resume_event.is_set():
+                break
+        else:
+            if not records:
+                # Binlog rattrapé sans transaction en cours : la position saute les événements ignorés
+                stats['log_file'], stats['log_pos'] = stream.log_file, stream.log_pos
 
+        # Une transaction inachevée est relue au prochain passage depuis la dernière position validée
+        records = records[:boundaries[-1][2]] if boundaries else []
+        flush(records, False)
     finally:
         stream.close()
         logging.info("BinLogStreamReader closed")
+    return stats
 
 
+def capture_to_log(source_db, table_source, table_dest, log, log_file=None, log_pos=None, stop_event=None, filters=None,
+                   blocking=False, on_progress=None, resume_event=None):
+    # Chaque entrée porte la position binlog atteinte : sans position fournie, la capture reprend après la dernière entrée écrite
+    def log_records(records, log_file, log_pos):
+        change_log.append(log, [((log_file, log_pos), record) for record in records])
+        return len(records)
 
-
-
-
-
+    if log_file is None:
+        log_file, log_pos = change_log.last_position(log) or (None, None)
+    return main(source_db, None, None, table_source, table_dest, log_file, log_pos, stop_event, log_records, filters=filters,
+                blocking=blocking, on_progress=on_progress, resume_event=resume_event)
@@ -1,20 +1,30 @@
 import datetime
+import time
 import psycopg2
 from psycopg2.extras import LogicalReplicationConnection
-import mysql.connector
-import redshift_connector
 import logging
 
+from change_records import ChangeRecord, RelationDescriptor, UNCHANGED_TOAST
+import change_batches
+import change_log
+import profiling
+import adaptive_batching
+import drivers
+
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Publication par défaut ; un pipeline filtré lit sa propre publication (source_filters)
+PUBLICATION_NAME = "test_pub"
 
 
-def fetch_changes_from_slot(conn, slot_name):
+def fetch_changes_from_slot(conn, slot_name, upto_nchanges=None, publication_name=PUBLICATION_NAME):
+    # upto_nchanges borne la lecture (arrêt à la fin de la transaction qui atteint la limite)
     try:
         with conn.cursor() as cur:
             cur.execute(
-                f"SELECT lsn, xid, data FROM pg_logical_slot_get_binary_changes('{slot_name}', NULL , NULL, 'proto_version', '1', 'publication_names', 'test_pub')")
+                f"SELECT lsn, xid, data FROM pg_logical_slot_get_binary_changes('{slot_name}', NULL , %s, 'proto_version', '1', 'publication_names', %s)",
+                (upto_nchanges, publication_name))
             changes = cur.fetchall()
             logging.info(f"Fetched changes from slot: {slot_name}")
             return changes
@@ -22,6 +32,31 @@ def fetch_changes_from_slot(conn, slot_name):
         logging.error(f"Error fetching changes from slot {slot_name}: {e}")
         return []
 
+def peek_changes_from_slot(conn, slot_name, publication_name=PUBLICATION_NAME, upto_nchanges=None):
+    # Lecture non destructive : le slot n'avance qu'avec advance_slot
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"SELECT lsn, xid, data FROM pg_logical_slot_peek_binary_changes('{slot_name}', NULL , %s, 'proto_version', '1', 'publication_names', %s)",
+                (upto_nchanges, publication_name))
+            changes = cur.fetchall()
+            logging.info(f"Peeked changes from slot: {slot_name}")
+            return changes
+    except Exception as e:
+        logging.error(f"Error peeking changes from slot {slot_name}: {e}")
+        return []
+
+
+def advance_slot(conn, slot_name, lsn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_replication_slot_advance(%s, %s::pg_lsn)", (slot_name, int_to_lsn(lsn)))
+    logging.info(f"Advanced slot {slot_name} to {int_to_lsn(lsn)}")
+
+
+def int_to_lsn(value):
+    return f"{value >> 32:X}/{value & 0xFFFFFFFF:X}"
+
+
 def fetch_values_type(conn, table_name):
     try:
         with conn.cursor() as cur:
@@ -45,20 +80,6 @@ def fetch_values_type(conn, table_name):
         return {}
 
 
-def get_table_name_from_changes(changes):
-    try:
-        for _, _, data in changes:
-            message_type = data.tobytes()[0:1].decode('utf-8')
-            if message_type == 'R':
-                table_name = decode_relation(data.tobytes())
-                logging.info(f"Extracted table name from changes: {table_name}")
-                return table_name
-        return None
-    except (ValueError, TypeError) as e:
-        logging.error(f"Error extracting table name from changes: {e}")
-        return None
-
-
 def decode_begin(byte_data):
     try:
         lsn = int.from_bytes(byte_data[1:9], 'big')
@@ -97,7 +118,8 @@ def decode_commit(byte_data):
         logging.error(f"Error decoding COMMIT message: {e}")
         return None
 
-def decode_relation(byte_data):
+def decode_relation(byte_data, relations):
+    # relations : OID -> descripteur, propre à une session de décodage (les OID ne sont uniques que dans une base)
     try:
         idx = 1
 
@@ -121,8 +143,9 @@ def decode_relation(byte_data):
         num_columns = int.from_bytes(byte_data[idx:idx + 2], 'big')
         idx += 2
 
-        columns = []
-        for _ in range(num_columns):
+        column_names = []
+        key_positions = []
+        for position in range(num_columns):
             column_flags = byte_data[idx]
             idx += 1
 
@@ -130,27 +153,47 @@ def decode_relation(byte_data):
             column_name = byte_data[idx:idx + column_name_len].decode('utf-8')
             idx += column_name_len + 1
 
-            column_oid = int.from_bytes(byte_data[idx:idx + 4], 'big')
-            idx += 4
+            # OID du type et typmod : les types viennent du catalogue (fetch_values_type)
+            idx += 8
 
-            column_type_modifier = int.from_bytes(byte_data[idx:idx + 4], 'big')
-            idx += 4
+            column_names.append(column_name)
+            if column_flags & 1:
+                key_positions.append(position)
 
-            columns.append({
-                "flags": column_flags,
-                "name": column_name,
-                "oid": column_oid,
-                "type_modifier": column_type_modifier
-            })
-
-        logging.info(f"Decoded RELATION: Transaction XID={xid}, Relation OID={relation_oid}, Namespace={namespace}, Relation Name={relation_name}, Replica Identity={replica_identity}, Columns={columns}")
-        return relation_name
+        relation = RelationDescriptor(relation_oid, namespace, relation_name, tuple(column_names),
+                                      key_positions=tuple(key_positions))
+        relations[relation_oid] = relation
+        logging.info(f"Decoded RELATION: Transaction XID={xid}, Relation OID={relation_oid}, Namespace={namespace}, Relation Name={relation_name}, Replica Identity={replica_identity}, Columns={column_names}")
+        return relation
     except Exception as e:
         logging.error(f"Error decoding RELATION message: {e}")
         return None
 
 
-def decode_insert(byte_data, table_info, table_name, target_db, syst_dest):
+def read_tuple_data(buffer, idx):
+    # Un tuple par ligne : NULL -> None, TOAST inchangé -> UNCHANGED_TOAST
+    n_columns = int.from_bytes(buffer[idx:idx + 2], 'big')
+    idx += 2
+
+    values = []
+    for _ in range(n_columns):
+        col_data_category = buffer[idx]
+        idx += 1
+
+        if col_data_category == 0x74:  # 't'
+            col_data_length = int.from_bytes(buffer[idx:idx + 4], 'big')
+            idx += 4
+            values.append(buffer[idx:idx + col_data_length].decode('utf-8'))
+            idx += col_data_length
+        elif col_data_category == 0x75:  # 'u'
+            values.append(UNCHANGED_TOAST)
+        else:
+            values.append(None)
+
+    return tuple(values), idx
+
+
+def decode_insert(byte_data, relations):
     try:
         idx = 0
 
@@ -169,49 +212,14 @@ def decode_insert(byte_data, table_info, table_name, target_db, syst_dest):
             raise ValueError(f"Expected 'N' for new tuple, but got {tuple_type}")
 
         # Lire les données du tuple
-        tuple_data, idx = read_insert_tuple_data(byte_data, idx)
-        inserted_values = [column['col_data'] for column in tuple_data['column_data']]
-
-        insert_query = replicate_insert(table_info, inserted_values, table_name, target_db, syst_dest)
-        logging.info(f"Decoded INSERT: Relation OID={relation_oid}, SQL query to replicate: {insert_query}")
-        return insert_query
+        values, idx = read_tuple_data(byte_data, idx)
+        return ChangeRecord('I', relations[relation_oid], values)
     except Exception as e:
         logging.error(f"Error decoding INSERT message: {e}")
         return None
 
-def read_insert_tuple_data(buffer, idx):
-    try:
-        column_data = []
-        n_columns = int.from_bytes(buffer[idx:idx + 2], 'big')
-        idx += 2
-
-        for _ in range(n_columns):
-            col_data_category = buffer[idx:idx + 1].decode('utf-8')
-            idx += 1
-
-            if col_data_category in ("n", "u"):
-                column_data.append({"col_data_category": col_data_category})
-            elif col_data_category == "t":
-                col_data_length = int.from_bytes(buffer[idx:idx + 4], 'big')
-                idx += 4
-                col_data = buffer[idx:idx + col_data_length].decode('utf-8')
-                idx += col_data_length
-                column_data.append({
-                    "col_data_category": col_data_category,
-                    "col_data_length": col_data_length,
-                    "col_data": col_data
-                })
-
-        return {
-            "n_columns": n_columns,
-            "column_data": column_data
-        }, idx
-    except Exception as e:
-        logging.error(f"Error reading insert tuple data: {e}")
-        return {}, idx
-
 
-def decode_update(byte_data, table_info, table_name, target_db, syst_dest):
+def decode_update(byte_data, relations):
     try:
         idx = 0
 
@@ -225,211 +233,130 @@ def decode_update(byte_data, table_info, table_name, target_db, syst_dest):
         tuple_type = byte_data[idx:idx + 1].decode('utf-8')
         idx += 1
 
-        tuple_data, idx = read_update_tuple_data(byte_data, idx)
+        # 'K' (clé) ou 'O' (ligne complète) précèdent le nouveau tuple selon REPLICA IDENTITY
+        relation = relations[relation_oid]
+        old_values = None
+        if tuple_type in ('K', 'O'):
+            old_values, idx = read_tuple_data(byte_data, idx)
+            if tuple_type == 'K':
+                # Hors clé, l'ancienne valeur n'est pas transmise : elle ne peut servir de comparaison
+                old_values = tuple(value if position in relation.key_positions else UNCHANGED_TOAST
+                                   for position, value in enumerate(old_values))
+            tuple_type = byte_data[idx:idx + 1].decode('utf-8')
+            idx += 1
 
-        mid_idx = len(tuple_data) // 2
-        old_values = tuple_data[:mid_idx]
-        new_values = tuple_data[mid_idx:]
+        if tuple_type != 'N':
+            raise ValueError(f"Expected 'N' for new tuple, but got {tuple_type}")
 
-        update_query = replicate_update(table_info, old_values, new_values, table_name, target_db, syst_dest)
-        logging.info(f"Decoded UPDATE: Relation OID={relation_oid}, Old Tuple Data={old_values}, New Tuple Data={new_values}, SQL query to replicate: {update_query}")
-        return update_query
+        values, idx = read_tuple_data(byte_data, idx)
+        return ChangeRecord('U', relation, values, old_values)
     except Exception as e:
         logging.error(f"Error decoding UPDATE message: {e}")
         return None
 
-def read_update_tuple_data(buffer, idx):
-    try:
-        tuple_data = []
-        while idx < len(buffer):
-            col_data_category = buffer[idx:idx + 1].decode('utf-8')
-            idx += 1
-
-            if col_data_category == "t":
-                col_data_length = int.from_bytes(buffer[idx:idx + 4], 'big')
-                idx += 4
-                col_data = buffer[idx:idx + col_data_length].decode('utf-8')
-                idx += col_data_length
-                tuple_data.append(col_data)
-
-        return tuple_data, idx
-    except Exception as e:
-        logging.error(f"Error reading update tuple data: {e}")
-        return [], idx
-
 
-def decode_delete(byte_data, table_info, table_name, target_db, syst_dest):
+def decode_delete(byte_data, relations):
     try:
         idx = 1
 
-        # Extraire l'ID de la transaction
         relation_oid = int.from_bytes(byte_data[idx:idx + 4], 'big')
         idx += 4
 
-        idx += 1  # Passer le byte suivant
-
-        deleted_values, idx = read_delete_tuple_data(byte_data, idx)
-        delete_query = replicate_delete(table_info, deleted_values, table_name, target_db, syst_dest)
+        idx += 1  # 'K' ou 'O'
 
-        logging.info(f"Decoded DELETE: Relation OID={relation_oid}, Old Tuple Data={deleted_values}, SQL query to replicate: {delete_query}")
-        return delete_query
+        old_values, idx = read_tuple_data(byte_data, idx)
+        return ChangeRecord('D', relations[relation_oid], None, old_values)
     except Exception as e:
         logging.error(f"Error decoding DELETE message: {e}")
         return None
 
-def read_delete_tuple_data(buffer, idx):
-    try:
-        old_tuple_data = []
-        while idx < len(buffer):
-            col_data_category = buffer[idx:idx + 1].decode('utf-8')
-            idx += 1
-
-            if col_data_category == "t":
-                col_data_length = int.from_bytes(buffer[idx:idx + 4], 'big')
-                idx += 4
-                col_data = buffer[idx:idx + col_data_length].decode('utf-8')
-                idx += col_data_length
-                old_tuple_data.append(col_data)
-
-        return old_tuple_data, idx
-    except Exception as e:
-        logging.error(f"Error reading delete tuple data: {e}")
-        return [], idx
-
-
 
-def decode_truncate(byte_data, table_name,target_db,syst_dest):
-    print(byte_data)
-    idx = 1
-
-    transaction_id = int.from_bytes(byte_data[idx:idx + 4], 'big')
-    idx += 4
-
-    number_of_relations = int.from_bytes(byte_data[idx:idx + 4], 'big')
-    idx += 4
-
-    options = byte_data[idx]
-    idx += 1
+def decode_truncate(byte_data, relations):
+    try:
+        idx = 1
 
-    relation_oids = []
-    for _ in range(number_of_relations):
-        oid = int.from_bytes(byte_data[idx:idx + 4], 'big')
-        relation_oids.append(oid)
+        number_of_relations = int.from_bytes(byte_data[idx:idx + 4], 'big')
         idx += 4
 
-    truncate_query = replicate_truncate(table_name,target_db,syst_dest)
-
-    print(f"Message Type: TRUNCATE\n")
-    # print(f"Transaction ID: {transaction_id}")
-    # print(f"Number of Relations: {number_of_relations}")
-    # print(f"Options: {options}")
-    # print(f"Relation OIDs: {relation_oids}")
-    print('Here is the SQL query to replicate : ', truncate_query, '\n')
+        idx += 1  # options (CASCADE / RESTART IDENTITY)
 
-    return truncate_query
-
-
-def replicate_insert(table_info, inserted_values, table_name,target_db,syst_dest):
-    try :
-        result_insert = {}
-        for (column_name, column_type), value in zip(table_info.items(), inserted_values):
-            result_insert[column_name] = {'value': value, 'column_type': column_type}
-
-        columns = ', '.join(result_insert.keys())
-        values = ', '.join(
-            [f"'{value['value']}'" if 'character' in value['column_type'] else str(value['value']) for value in
-             result_insert.values()])
-
-        insert_template = f'INSERT INTO {table_name} ({columns}) VALUES ({values});'
-        replicate_queries(insert_template,target_db,syst_dest)
-        logging.info(f"Replicate INSERT: {insert_template}")
-        return insert_template
+        records = []
+        for _ in range(number_of_relations):
+            relation_oid = int.from_bytes(byte_data[idx:idx + 4], 'big')
+            idx += 4
+            records.append(ChangeRecord('T', relations[relation_oid]))
+        return tuple(records)
     except Exception as e:
-        logging.error(f"Error in replicate_insert: {e}")
+        logging.error(f"Error decoding TRUNCATE message: {e}")
         return None
 
 
-def replicate_delete(table_info, deleted_values, table_name,target_db,syst_dest):
-    try :
-        result = {}
-        for (column_name, column_type), value in zip(table_info.items(), deleted_values):
-            result[column_name] = {'value': value, 'column_type': column_type}
-
-        conditions = []
-        for column_name, value_info in result.items():
-            column_value = value_info['value']
-            if 'character' in value_info['column_type']:
-                conditions.append(f"{column_name} = '{column_value}'")
-            else:
-                conditions.append(f"{column_name} = {column_value}")
-
-        if conditions:
-            where_clause = ' AND '.join(conditions)
-            delete_template = f'DELETE FROM {table_name} WHERE {where_clause};'
-            replicate_queries(delete_template,target_db,syst_dest)
-            logging.info(f"Replicate DELETE: {delete_template}")
-            return delete_template
-        else:
-            logging.info("No conditions specified for DELETE")
-            return "No delete conditions specified."
-    except Exception as e:
-        logging.error(f"Error in replicate_delete: {e}")
+def key_conditions(record):
+    # Conditions et paramètres identifiant la ligne ; les valeurs passent par le pilote, jamais en littéral
+    relation = record.relation
+    row = record.old_values if record.old_values is not None else record.values
+    positions = relation.key_positions
+    if not positions and record.old_values is not None:
+        # REPLICA IDENTITY FULL sans clé : la ligne complète identifie la ligne
+        positions = [position for position, value in enumerate(row) if value is not UNCHANGED_TOAST]
+    if not positions:
+        raise ValueError(f"No key to identify the {record.op} row on {relation.name}")
+    conditions = [f"{relation.column_names[position]} IS NULL" if row[position] is None else f"{relation.column_names[position]} = %s"
+                  for position in positions]
+    return conditions, [row[position] for position in positions if row[position] is not None]
+
+
+def build_insert_query(record):
+    relation = record.relation
+    placeholders = ', '.join(['%s'] * len(relation.column_names))
+    return f'INSERT INTO {relation.name} ({", ".join(relation.column_names)}) VALUES ({placeholders});', list(record.values)
+
+
+def build_update_query(record):
+    relation = record.relation
+    key_positions = relation.key_positions
+    old_values = record.old_values
+
+    set_clauses = []
+    params = []
+    for position, value in enumerate(record.values):
+        # TOAST inchangé : absent du message, jamais réécrit
+        if value is UNCHANGED_TOAST:
+            continue
+        if old_values is None:
+            if position in key_positions:
+                continue
+        elif old_values[position] is not UNCHANGED_TOAST and old_values[position] == value:
+            continue
+        set_clauses.append(f"{relation.column_names[position]} = %s")
+        params.append(value)
+
+    if not set_clauses:
         return None
+    conditions, key_params = key_conditions(record)
+    return f"UPDATE {relation.name} SET {', '.join(set_clauses)} WHERE {' AND '.join(conditions)};", params + key_params
 
 
-def replicate_update(table_info, old_values, new_values, table_name,target_db,syst_dest):
-    try:
-        result_new = {}
-        result_old = {}
-        updated_values = []
-
-        for (column_name, column_type), new_value, old_value in zip(table_info.items(), new_values, old_values):
-            result_new[column_name] = {'value': new_value, 'column_type': column_type}
-            result_old[column_name] = {'value': old_value, 'column_type': column_type}
-
-        for key in result_new:
-            if result_new[key] != result_old[key]:
-                column_name = key
-                new_value = result_new[key]['value']
-                if 'character' in result_new[key]['column_type']:
-                    updated_values.append(f"{column_name} = '{new_value}'")
-                else:
-                    updated_values.append(f"{column_name} = {new_value}")
-
-        conditions = []
-        for key, value in result_new.items():
-            if value['value'] == result_old[key]['value']:
-                column_name = key
-                column_value = value['value']
-                if 'character' in value['column_type']:
-                    conditions.append(f"{column_name} = '{column_value}'")
-                else:
-                    conditions.append(f"{column_name} = {column_value}")
-
-        if conditions and updated_values:
-            where_clause = ' AND '.join(conditions)
-            update_clause = ', '.join(updated_values)
-            update_template = f"UPDATE {table_name} SET {update_clause} WHERE {where_clause};"
-            replicate_queries(update_template,target_db,syst_dest)
-            logging.info(f"Replicate UPDATE: {update_template}")
-            return update_template
-        else:
-            logging.info("No update conditions specified.")
-            return "No update conditions specified."
-    except Exception as e:
-        logging.error(f"Error in replicate_update: {e}")
-        return None
+def build_delete_query(record):
+    conditions, params = key_conditions(record)
+    return f"DELETE FROM {record.relation.name} WHERE {' AND '.join(conditions)};", params
 
 
-def replicate_truncate(table_name,target_db,syst_dest):
-    truncate_template = f'TRUNCATE {table_name}'
-    replicate_queries(truncate_template,target_db,syst_dest)
-    return truncate_template
+def build_truncate_query(record):
+    return f'TRUNCATE {record.relation.name}', None
 
 
-def decode_message(data, table_info, table_name, target_db, syst_dest):
+QUERY_BUILDERS = {
+    'I': build_insert_query,
+    'U': build_update_query,
+    'D': build_delete_query,
+    'T': build_truncate_query,
+}
+
+
+def decode_message(data, relations):
     try:
-        byte_data = data.tobytes()
+        byte_data = data.tobytes() if isinstance(data, memoryview) else data
         message_type = byte_data[0:1].decode('utf-8')
 
         if message_type == 'B':
@@ -437,15 +364,15 @@ def decode_message(data, table_info, table_name, target_db, syst_dest):
         elif message_type == 'C':
             return decode_commit(byte_data)
         elif message_type == 'R':
-            return decode_relation(byte_data)
+            return decode_relation(byte_data, relations)
         elif message_type == 'I':
-            return decode_insert(byte_data, table_info, table_name, target_db, syst_dest)
+            return decode_insert(byte_data, relations)
         elif message_type == 'T':
-            return decode_truncate(byte_data, table_name, target_db, syst_dest)
+            return decode_truncate(byte_data, relations)
         elif message_type == 'D':
-            return decode_delete(byte_data, table_info, table_name, target_db, syst_dest)
+            return decode_delete(byte_data, relations)
         elif message_type == 'U':
-            return decode_update(byte_data, table_info, table_name, target_db, syst_dest)
+            return decode_update(byte_data, relations)
         else:
             logging.error(f"Unrecognized message type: {message_type}")
             raise ValueError(f"Unrecognized message type: {message_type}")
@@ -453,96 +380,88 @@ def decode_message(data, table_info, table_name, target_db, syst_dest):
         logging.error(f"Error in decode_message: {e}")
         return None
 
-def target_db_connection(target_db, syst_dest):
-    try:
-        if syst_dest == 'postgresql':
-            conn_params = {
-                'dbname': target_db,
-                'host': 'localhost',
-                'port': 5555,
-                'user': 'postgres',
-                'password': 'postgres',
-            }
-            conn = psycopg2.connect(**conn_params)
-        elif syst_dest == 'mysql':
-            conn_params = {
-                'database': target_db,
-                'host': 'localhost',
-                'port': 3306,
-                'user': 'nass',
-                'password': 'mysql',
-            }
-            conn = mysql.connector.connect(**conn_params)
-        elif syst_dest == 'redshift':
-            conn_params = {
-                'database': target_db,
-                'host': '',
-                'port': 5439,
-                'user': '',
-                'password': '',
-            }
-            conn = redshift_connector.connect(**conn_params)
-        else:
-            raise ValueError("Unsupported DBMS type")
+def decode_changes(conn, changes, after_lsn=0, relations=None):
+    # Décode une seule fois les lignes du slot ; chaque enregistrement porte le LSN de fin de sa transaction.
+    # Chaque appel SQL au slot est une session pgoutput qui renvoie ses RELATION : une carte neuve suffit ;
+    # un flux de réplication garde la sienne pour toute la session
+    if relations is None:
+        relations = {}
+    stats = {'changes': 0, 'last_commit_ts': None, 'last_lsn': None}
+    decoded_changes = []
+    transaction = []
+    for lsn, xid, data in changes:
+        decoded = decode_message(data, relations)
+        if isinstance(decoded, RelationDescriptor):
+            table_info = fetch_values_type(conn, decoded.name)
+            decoded.column_types = tuple(table_info.get(column_name) for column_name in decoded.column_names)
+        elif isinstance(decoded, ChangeRecord):
+            transaction.append(decoded)
+        elif isinstance(decoded, tuple):
+            transaction.extend(decoded)
+        elif isinstance(decoded, dict) and decoded.get('type') == 'COMMIT':
+            # Les transactions s'entrelacent dans le WAL : seul le LSN de fin de transaction est ordonné
+            if decoded['lsn'] > after_lsn:
+                commit_ts = decoded['commit_ts'].replace(tzinfo=datetime.timezone.utc).timestamp()
+                for record in transaction:
+                    record.commit_ts = commit_ts
+                decoded_changes.extend((decoded['lsn'], record) for record in transaction)
+                stats['last_commit_ts'] = commit_ts
+                stats['last_lsn'] = decoded['lsn']
+            transaction = []
+    stats['changes'] = len(decoded_changes)
+    return decoded_changes, stats
 
-        logging.info(f"Connected to target database: {target_db} using {syst_dest}")
-        return conn
-    except Exception as e:
-        logging.error(f"Error connecting to database {target_db} with system {syst_dest}: {e}")
-        return None
+
+def target_db_connection(target_db, syst_dest):
+    return drivers.target_connection(target_db, syst_dest)
 
 
-def replicate_queries(query, target_db, syst_dest):
-    conn = None
-    try:
-        conn = target_db_connection(target_db, syst_dest)
-        cursor = conn.cursor()
-        cursor.execute(query)
-        conn.commit()
-        logging.info(f"Query executed successfully on {target_db} using {syst_dest}: {query}")
-    except psycopg2.Error as e:
-        logging.error(f"PostgreSQL error occurred: {e}")
-        if conn:
-            conn.rollback()
-    except mysql.connector.Error as e:
-        logging.error(f"MySQL error occurred: {e}")
-        if conn and conn.is_connected():
-            conn.rollback()
-    finally:
-        if conn:
-            cursor.close()
-            if syst_dest == 'mysql' and conn.is_connected():
-                conn.close()
-            elif syst_dest == 'postgresql':
-                conn.close()
-
-def main(source_db, target_db, syst_dest):
+def main(source_db, target_db, syst_dest, batching=None, apply_mode='insert', publication_name=PUBLICATION_NAME):
     try:
         # Paramètres de connexion
-        conn_params = {
-            'host': 'localhost',
-            'port': 5555,
-            'dbname': source_db,
-            'user': 'postgres',
-            'password': 'postgres',
-            'connection_factory': LogicalReplicationConnection
-        }
+        conn_params = dict(drivers.connection_params('postgresql', source_db), connection_factory=LogicalReplicationConnection)
         with psycopg2.connect(**conn_params) as conn:
             slot_name = "user_slot"
-            changes = fetch_changes_from_slot(conn, slot_name)
-
-            table_name = get_table_name_from_changes(changes)
-            if table_name:
-                table_info = fetch_values_type(conn, table_name)
-            else:
-                logging.error("No RELATION message found; unable to determine table name.")
-                raise ValueError("No RELATION message found; unable to determine table name.")
-
-            for lsn, xid, data in changes:
-                decode_message(data, table_info, table_name, target_db, syst_dest)
+            # Lecture bornée par la taille de lot courante : une lecture pleine signale un retard à rattraper
+            fetch_limit = adaptive_batching.batch_rows(batching, None)
+            # Lecture non destructive : le slot n'est avancé qu'une fois les changements appliqués (ou mis en reprise)
+            with profiling.timed('fetch'):
+                changes = peek_changes_from_slot(conn, slot_name, publication_name, fetch_limit)
+
+            with profiling.timed('decode'):
+                decoded_changes, stats = decode_changes(conn, changes)
+            records = [record for _, record in decoded_changes]
+            stats['backlog'] = fetch_limit is not None and len(changes) >= fetch_limit
+
+            # Tout le lot récupéré est converti en lots colonnes puis appliqué en bloc
+            started = time.time()
+            stats['changes'] = change_batches.apply_records(records, target_db, syst_dest, QUERY_BUILDERS, target_db_connection,
+                                                            max_rows=fetch_limit or change_batches.BATCH_MAX_ROWS, apply_mode=apply_mode)
+            if stats['last_lsn'] is not None:
+                advance_slot(conn, slot_name, stats['last_lsn'])
+            lag = time.time() - stats['last_commit_ts'] if stats['last_commit_ts'] is not None else None
+            adaptive_batching.observe(batching, len(records), sum(len(data) for _, _, data in changes),
+                                      time.time() - started, stats['backlog'], lag)
             logging.info("Finished processing changes.")
+            return stats
     except Exception as e:
         logging.error(f"Error in main function: {e}")
+        return None
+
+
+def capture_to_log(source_db, log, slot_name="user_slot", publication_name=PUBLICATION_NAME):
+    # Les changements sont écrits (fsync) dans le journal local avant d'acquitter le slot
+    conn_params = dict(drivers.connection_params('postgresql', source_db), connection_factory=LogicalReplicationConnection)
+    with psycopg2.connect(**conn_params) as conn:
+        with profiling.timed('fetch'):
+            changes = peek_changes_from_slot(conn, slot_name, publication_name)
+        with profiling.timed('decode'):
+            decoded_changes, stats = decode_changes(conn, changes, change_log.last_position(log) or 0)
+        if stats['last_lsn'] is not None:
+            with profiling.timed('log_write'):
+                change_log.append(log, decoded_changes)
+            advance_slot(conn, slot_name, stats['last_lsn'])
+        return stats
 
 
 if __name__ == "__main__":
@@ -0,0 +1,112 @@
+import importlib
+import threading
+import logging
+
+import profiling
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Module du pilote et nom du paramètre de base de données, par système
+SINK_DRIVERS = {
+    'postgresql': ('psycopg2', 'dbname'),
+    'mysql': ('mysql.connector', 'database'),
+    'redshift': ('redshift_connector', 'database'),
+}
+
+# Modules de réplication DML et DDL, par système source
+SOURCE_MODULES = {
+    'postgresql': ('dml_replication_postgresql', 'ddl_replication_postgresql'),
+    'mysql': ('dml_replication_mysql', 'ddl_replication_mysql'),
+}
+
+# Paramètres par défaut ; 'connections' dans la configuration d'un pipeline les surcharge par système
+CONNECTION_DEFAULTS = {
+    'postgresql': {'host': 'localhost', 'port': 5555, 'user': 'postgres', 'password': 'postgres'},
+    'mysql': {'host': 'localhost', 'port': 3306, 'user': 'nass', 'password': 'mysql'},
+    'redshift': {'host': '', 'port': 5439, 'user': '', 'password': ''},
+}
+
+_modules = {}
+_modules_lock = threading.Lock()
+
+_pipeline_connections = {}
+
+
+def load(module_name):
+    # Import au premier usage : un worker ne charge que les pilotes des systèmes qu'il utilise
+    module = _modules.get(module_name)
+    if module is None:
+        with _modules_lock:
+            module = _modules.get(module_name)
+            if module is None:
+                module = importlib.import_module(module_name)
+                _modules[module_name] = module
+                logging.info(f"Loaded module {module_name}")
+    return module
+
+
+def driver(syst):
+    if syst not in SINK_DRIVERS:
+        raise ValueError("Unsupported DBMS type")
+    return load(SINK_DRIVERS[syst][0])
+
+
+def dml_module(syst_source):
+    if syst_source not in SOURCE_MODULES:
+        raise ValueError("Unsupported DBMS type")
+    return load(SOURCE_MODULES[syst_source][0])
+
+
+def ddl_module(syst_source):
+    if syst_source not in SOURCE_MODULES:
+        raise ValueError("Unsupported DBMS type")
+    return load(SOURCE_MODULES[syst_source][1])
+
+
+def configure_pipeline(pipeline_id, connections):
+    # connections : {'postgresql': {'host': ..., 'port': ...}, 'mysql': {...}}
+    if connections:
+        _pipeline_connections[pipeline_id] = connections
+    else:
+        _pipeline_connections.pop(pipeline_id, None)
+
+
+def release_pipeline(pipeline_id):
+    _pipeline_connections.pop(pipeline_id, None)
+
+
+def connection_params(syst, dbname, pipeline_id=None):
+    # Sans pipeline explicite, celui lié au thread courant (profiling.bind_pipeline)
+    if syst not in SINK_DRIVERS:
+        raise ValueError("Unsupported DBMS type")
+    if pipeline_id is None:
+        pipeline_id = profiling.current_pipeline()
+    params = dict(CONNECTION_DEFAULTS[syst])
+    params.update(_pipeline_connections.get(pipeline_id, {}).get(syst, {}))
+    params[SINK_DRIVERS[syst][1]] = dbname
+    return params
+
+
+def connect(syst, dbname, pipeline_id=None, **extra):
+    return driver(syst).connect(**connection_params(syst, dbname, pipeline_id), **extra)
+
+
+def target_connection(target_db, syst_dest):
+    try:
+        conn = connect(syst_dest, target_db)
+        logging.info(f"Connected to target database: {target_db} using {syst_dest}")
+        return conn
+    except Exception as e:
+        logging.error(f"Error connecting to target database {target_db} with system {syst_dest}: {e}")
+        return None
+
+
+def source_connection(source_db, syst_source):
+    try:
+        conn = connect(syst_source, source_db)
+        logging.info(f"Connected to source database: {source_db}")
+        return conn
+    except Exception as e:
+        logging.error(f"Error connecting to source database {source_db}: {e}")
+        return None
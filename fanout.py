@@ -0,0 +1,245 @@
+import json
+import os
+import queue
+import select
+import threading
+import logging
+
+import psycopg2
+from psycopg2.extras import LogicalReplicationConnection
+
+import dml_replication_postgresql
+import drivers
+import change_batches
+import profiling
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SLOT_NAME = "user_slot"
+PROGRESS_FILE = "replication_progress.json"
+APPLIER_QUEUE_SIZE = 16
+FEEDBACK_INTERVAL = 10
+READ_TIMEOUT = 1
+
+_progress_lock = threading.Lock()
+
+
+def load_progress():
+    if not os.path.exists(PROGRESS_FILE):
+        return {}
+    with open(PROGRESS_FILE) as progress_file:
+        return json.load(progress_file)
+
+
+def save_position(slot_name, sink_name, lsn):
+    # Écriture atomique : un arrêt brutal laisse l'ancien fichier intact
+    with _progress_lock:
+        progress = load_progress()
+        progress.setdefault(slot_name, {})[sink_name] = lsn
+        temporary_path = f"{PROGRESS_FILE}.tmp"
+        with open(temporary_path, 'w') as progress_file:
+            json.dump(progress, progress_file)
+        os.replace(temporary_path, PROGRESS_FILE)
+
+
+def load_position(slot_name, sink_name):
+    with _progress_lock:
+        return load_progress().get(slot_name, {}).get(sink_name, 0)
+
+
+def new_applier(slot_name, target_db, syst_dest, pipeline_id=None, apply_mode='insert'):
+    sink_name = f"{syst_dest}:{target_db}"
+    return {
+        'name': sink_name,
+        'slot_name': slot_name,
+        'pipeline': pipeline_id,
+        'target_db': target_db,
+        'syst_dest': syst_dest,
+        'apply_mode': apply_mode,
+        'queue': queue.Queue(maxsize=APPLIER_QUEUE_SIZE),
+        'position': load_position(slot_name, sink_name),
+        'applied': 0,
+        'errors': 0,
+        'replay': False,
+        'thread': None,
+    }
+
+
+def applier_loop(applier):
+    profiling.bind_pipeline(applier['pipeline'])
+    while True:
+        item = applier['queue'].get()
+        if item is None:
+            break
+        after_lsn, last_lsn, decoded_changes = item
+        if last_lsn <= applier['position']:
+            continue
+        if after_lsn > applier['position']:
+            # Trou après un échec : on attend que la capture renvoie les changements depuis notre position
+            applier['replay'] = True
+            continue
+        try:
+            # Un applier en avance (après redémarrage) ignore ce qu'il a déjà appliqué
+            records = [record for lsn, record in decoded_changes if lsn > applier['position']]
+            applier['applied'] += change_batches.apply_records(
+                records, applier['target_db'], applier['syst_dest'],
+                dml_replication_postgresql.QUERY_BUILDERS, dml_replication_postgresql.target_db_connection,
+                apply_mode=applier['apply_mode'])
+            applier['position'] = last_lsn
+            save_position(applier['slot_name'], applier['name'], last_lsn)
+        except Exception as e:
+            # La position ne bouge pas : le slot garde ces changements jusqu'au prochain essai
+            applier['errors'] += 1
+            applier['replay'] = True
+            logging.error(f"Applier {applier['name']} failed on chunk ending at {dml_replication_postgresql.int_to_lsn(last_lsn)}: {e}")
+
+
+def start_fanout(targets, slot_name=SLOT_NAME, pipeline_id=None, apply_mode='insert',
+                 publication_name=dml_replication_postgresql.PUBLICATION_NAME):
+    appliers = []
+    for target_db, syst_dest in targets:
+        applier = new_applier(slot_name, target_db, syst_dest, pipeline_id, apply_mode)
+        applier['thread'] = threading.Thread(target=applier_loop, args=(applier,), name=f"applier-{applier['name']}", daemon=True)
+        applier['thread'].start()
+        appliers.append(applier)
+    # Au redémarrage, la capture reprend à la position de l'applier le plus en retard
+    slowest = min(applier['position'] for applier in appliers)
+    return {'slot_name': slot_name, 'publication_name': publication_name, 'appliers': appliers, 'captured_lsn': slowest, 'acked_lsn': slowest}
+
+
+def stop_fanout(fanout):
+    for applier in fanout['appliers']:
+        applier['queue'].put(None)
+    for applier in fanout['appliers']:
+        applier['thread'].join()
+
+
+def confirmed_lsn(conn, slot_name):
+    with conn.cursor() as cur:
+        cur.execute("SELECT confirmed_flush_lsn - '0/0'::pg_lsn FROM pg_replication_slots WHERE slot_name = %s", (slot_name,))
+        row = cur.fetchone()
+    return int(row[0]) if row and row[0] is not None else None
+
+
+def check_positions(source_db, fanout):
+    # Le slot ne garde rien avant sa position confirmée : une cible en retard ne peut plus être rattrapée par le flux
+    with psycopg2.connect(**drivers.connection_params('postgresql', source_db)) as conn:
+        confirmed = confirmed_lsn(conn, fanout['slot_name'])
+    if confirmed is None:
+        raise ValueError(f"Replication slot {fanout['slot_name']} does not exist")
+    appliers = fanout['appliers']
+    if all(applier['position'] == 0 for applier in appliers):
+        # Première diffusion : toutes les cibles partent ensemble de la position du slot
+        for applier in appliers:
+            applier['position'] = confirmed
+            save_position(applier['slot_name'], applier['name'], confirmed)
+    behind = [applier['name'] for applier in appliers if applier['position'] < confirmed]
+    if behind:
+        raise ValueError(f"Targets {', '.join(behind)} are behind slot {fanout['slot_name']} "
+                         f"(confirmed at {dml_replication_postgresql.int_to_lsn(confirmed)}): "
+                         f"run an initial load of these targets before fanning out to them")
+    fanout['captured_lsn'] = fanout['acked_lsn'] = min(applier['position'] for applier in appliers)
+
+
+def enqueue(cur, applier, item, stop_event):
+    # File bornée : l'applier le plus lent freine la capture ; le flux répond aux keepalives pendant l'attente
+    while not stop_event.is_set():
+        try:
+            applier['queue'].put(item, timeout=READ_TIMEOUT)
+            return
+        except queue.Full:
+            cur.send_feedback()
+
+
+def acknowledge(cur, fanout, idle=False):
+    appliers = fanout['appliers']
+    slowest = min(applier['position'] for applier in appliers)
+    if idle and cur.wal_end and cur.wal_end > slowest >= fanout['captured_lsn'] \
+            and all(applier['queue'].empty() for applier in appliers):
+        # Tout est appliqué : le WAL sans rapport avec la publication peut être libéré, positions comprises
+        for applier in appliers:
+            applier['position'] = cur.wal_end
+            save_position(applier['slot_name'], applier['name'], cur.wal_end)
+        fanout['captured_lsn'] = slowest = cur.wal_end
+    # Le slot n'est acquitté qu'à la position de l'applier le plus en retard
+    if slowest > fanout['acked_lsn']:
+        cur.send_feedback(write_lsn=fanout['captured_lsn'], flush_lsn=slowest)
+        fanout['acked_lsn'] = slowest
+
+
+def capture_stream(source_db, fanout, stop_event, resume_event=None, on_progress=None):
+    # Une seule lecture en flux, décodée une fois et distribuée à tous les appliers ;
+    # le serveur ne relit le WAL qu'à la reconnexion, depuis la position de l'applier le plus en retard
+    appliers = fanout['appliers']
+    if any(applier['replay'] for applier in appliers):
+        fanout['captured_lsn'] = min(fanout['captured_lsn'], min(applier['position'] for applier in appliers))
+        for applier in appliers:
+            applier['replay'] = False
+
+    conn_params = drivers.connection_params('postgresql', source_db)
+    replication_conn = psycopg2.connect(connection_factory=LogicalReplicationConnection, **conn_params)
+    types_conn = psycopg2.connect(**conn_params)
+    types_conn.autocommit = True
+    cur = replication_conn.cursor()
+    transaction, pending, pending_lsn = [], [], None
+    # Le serveur n'envoie chaque RELATION qu'une fois par session : la carte vit aussi longtemps que le flux
+    relations = {}
+    replay = False
+    try:
+        cur.start_replication(slot_name=fanout['slot_name'], decode=False, status_interval=FEEDBACK_INTERVAL,
+                              options={'proto_version': '1', 'publication_names': fanout['publication_name']})
+
+        def distribute():
+            item = (fanout['captured_lsn'], pending_lsn, list(pending))
+            for applier in appliers:
+                enqueue(cur, applier, item, stop_event)
+            fanout['captured_lsn'] = pending_lsn
+            if on_progress:
+                commit_ts = max((record.commit_ts for _, record in pending if record.commit_ts is not None), default=None)
+                on_progress({'changes': len(pending), 'last_commit_ts': commit_ts, 'last_lsn': pending_lsn})
+
+        while not stop_event.is_set() and (resume_event is None or resume_event.is_set()):
+            if any(applier['replay'] for applier in appliers):
+                # Un applier a perdu des changements : reconnexion pour les relire depuis sa position
+                replay = True
+                break
+            with profiling.timed('fetch'):
+                message = cur.read_message()
+            if message is None:
+                if pending:
+                    distribute()
+                    pending = []
+                acknowledge(cur, fanout, idle=not transaction)
+                select.select([cur], [], [], READ_TIMEOUT)
+                continue
+
+            transaction.append((message.data_start, None, message.payload))
+            if message.payload[:1] != b'C':
+                continue
+            with profiling.timed('decode'):
+                decoded_changes, stats = dml_replication_postgresql.decode_changes(types_conn, transaction, fanout['captured_lsn'],
+                                                                                   relations)
+            transaction = []
+            if stats['last_lsn'] is None:
+                continue
+            pending.extend(decoded_changes)
+            pending_lsn = stats['last_lsn']
+            if len(pending) >= change_batches.BATCH_MAX_ROWS:
+                distribute()
+                pending = []
+            acknowledge(cur, fanout)
+
+        if pending and not replay:
+            distribute()
+    finally:
+        cur.close()
+        replication_conn.close()
+        types_conn.close()
+    return replay
+
+
+def fanout_status(fanout):
+    return [{'sink': applier['name'], 'position': dml_replication_postgresql.int_to_lsn(applier['position']),
+             'applied': applier['applied'], 'errors': applier['errors'], 'pending_chunks': applier['queue'].qsize()}
+            for applier in fanout['appliers']]
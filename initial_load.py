@@ -0,0 +1,352 @@
+import io
+import re
+import queue
+import tempfile
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import psycopg2
+from psycopg2.extras import LogicalReplicationConnection
+
+import dml_replication_postgresql
+import drivers
+import profiling
+import replication_lag
+import source_filters
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SLOT_NAME = "user_slot"
+PUBLICATION_NAME = "test_pub"
+
+# Taille au-delà de laquelle un chunk COPY est déversé sur disque
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+INSERT_BATCH_SIZE = 1000
+
+COPY_TEXT_ESCAPES = {'\\\\': '\\', '\\t': '\t', '\\n': '\n', '\\r': '\r', '\\b': '\b', '\\f': '\f', '\\v': '\v'}
+
+
+def postgresql_source_params(source_db):
+    return drivers.connection_params('postgresql', source_db)
+
+
+def mysql_source_params(source_db):
+    return drivers.connection_params('mysql', source_db)
+
+
+def create_slot_with_snapshot(source_db, slot_name):
+    # Le slot doit être recréé pour obtenir un snapshot exporté cohérent avec son LSN
+    conn = psycopg2.connect(**postgresql_source_params(source_db))
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT pg_drop_replication_slot(slot_name) FROM pg_replication_slots WHERE slot_name = %s",
+                (slot_name,))
+    finally:
+        conn.close()
+
+    repl_conn = psycopg2.connect(**postgresql_source_params(source_db), connection_factory=LogicalReplicationConnection)
+    cur = repl_conn.cursor()
+    cur.execute(f"CREATE_REPLICATION_SLOT {slot_name} LOGICAL pgoutput EXPORT_SNAPSHOT")
+    _, consistent_point, snapshot_name, _ = cur.fetchone()
+    logging.info(f"Created slot {slot_name} at consistent LSN {consistent_point} with snapshot {snapshot_name}")
+    # La connexion doit rester ouverte et inactive tant que le snapshot est utilisé
+    return repl_conn, consistent_point, snapshot_name
+
+
+def open_snapshot_connection(source_db, snapshot_name):
+    conn = psycopg2.connect(**postgresql_source_params(source_db))
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    with conn.cursor() as cur:
+        cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot_name,))
+    return conn
+
+
+def get_published_tables(conn, publication_name):
+    with conn.cursor() as cur:
+        cur.execute("SELECT tablename FROM pg_publication_tables WHERE pubname = %s", (publication_name,))
+        return [row[0] for row in cur.fetchall()]
+
+
+def get_integer_key_postgresql(conn, table_name):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT a.attname, pg_catalog.format_type(a.atttypid, a.atttypmod)
+            FROM pg_catalog.pg_index i
+            JOIN pg_catalog.pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+            WHERE i.indrelid = %s::regclass AND i.indisprimary;
+            """, (table_name,))
+        key_columns = cur.fetchall()
+    if len(key_columns) == 1 and key_columns[0][1] in ('integer', 'bigint', 'smallint'):
+        return key_columns[0][0]
+    return None
+
+
+def get_integer_key_mysql(conn, table_name, source_db):
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT column_name, data_type
+            FROM information_schema.columns
+            WHERE table_name = %s AND table_schema = %s AND column_key = 'PRI';
+            """, (table_name, source_db))
+        key_columns = cur.fetchall()
+    finally:
+        cur.close()
+    if len(key_columns) == 1 and key_columns[0][1] in ('int', 'bigint', 'smallint', 'mediumint', 'tinyint'):
+        return key_columns[0][0]
+    return None
+
+
+def get_source_tables_mysql(conn, source_db, table_source=None, filters=None):
+    # Même périmètre que le binlog : table(s) demandée(s), sinon tables filtrées, sinon toute la base
+    if table_source is not None:
+        table_names = [table_source] if isinstance(table_source, str) else list(table_source)
+    elif filters and filters.get('tables'):
+        table_names = list(filters['tables'])
+    else:
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                SELECT table_name
+                FROM information_schema.tables
+                WHERE table_schema = %s AND table_type = 'BASE TABLE';
+                """, (source_db,))
+            table_names = [row[0] for row in cur.fetchall()]
+        finally:
+            cur.close()
+    # La table de heartbeat sert à la mesure de retard, pas répliquée
+    return [table_name for table_name in table_names if table_name != replication_lag.HEARTBEAT_TABLE]
+
+
+def compute_key_ranges(min_key, max_key, chunk_count):
+    # Retourne des intervalles [lower, upper) couvrant [min_key, max_key]
+    if min_key is None or max_key is None:
+        return []
+    span = max_key - min_key + 1
+    step = max(1, -(-span // chunk_count))
+    return [(lower, min(lower + step, max_key + 1)) for lower in range(min_key, max_key + 1, step)]
+
+
+def table_chunks(cur, table_name, key_column, chunk_count):
+    if not key_column:
+        return [None]
+    cur.execute(f"SELECT MIN({key_column}), MAX({key_column}) FROM {table_name}")
+    min_key, max_key = cur.fetchone()
+    return compute_key_ranges(min_key, max_key, chunk_count)
+
+
+def chunk_select(table_name, key_column, key_range, columns=None, row_filter=None):
+    # Mêmes colonnes et mêmes lignes que la publication : rien de ce que les filtres écartent ne quitte la source
+    conditions = [f"({row_filter})"] if row_filter else []
+    if key_range is not None:
+        lower, upper = key_range
+        conditions.append(f"{key_column} >= {int(lower)} AND {key_column} < {int(upper)}")
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"SELECT {', '.join(columns) if columns else '*'} FROM {table_name}{where}"
+
+
+def unescape_copy_text(field):
+    return re.sub(r'\\.', lambda match: COPY_TEXT_ESCAPES.get(match.group(0), match.group(0)[1]), field)
+
+
+def parse_copy_text_line(line):
+    return [None if field == '\\N' else unescape_copy_text(field) for field in line.rstrip('\n').split('\t')]
+
+
+def format_copy_text_value(value):
+    if value is None:
+        return '\\N'
+    text = str(value)
+    return text.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def insert_rows(target_conn, table_name, columns, rows):
+    placeholders = ', '.join(['%s'] * len(columns))
+    insert_template = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
+    cur = target_conn.cursor()
+    try:
+        for start in range(0, len(rows), INSERT_BATCH_SIZE):
+            cur.executemany(insert_template, rows[start:start + INSERT_BATCH_SIZE])
+        target_conn.commit()
+    finally:
+        cur.close()
+
+
+def load_rows_into_target(target_conn, syst_dest, table_name, columns, rows):
+    if not rows:
+        return 0
+    if syst_dest == 'postgresql':
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write('\t'.join(format_copy_text_value(value) for value in row) + '\n')
+        buffer.seek(0)
+        with target_conn.cursor() as cur:
+            cur.copy_expert(f"COPY {table_name} ({', '.join(columns)}) FROM STDIN", buffer)
+        target_conn.commit()
+    else:
+        insert_rows(target_conn, table_name, columns, rows)
+    return len(rows)
+
+
+def truncate_target_table(target_db, syst_dest, table_name):
+    target_conn = dml_replication_postgresql.target_db_connection(target_db, syst_dest)
+    cur = target_conn.cursor()
+    try:
+        cur.execute(f"TRUNCATE TABLE {table_name}")
+        target_conn.commit()
+    finally:
+        cur.close()
+        target_conn.close()
+
+
+def copy_postgresql_chunk(source_db, target_db, syst_dest, snapshot_name, table_name, key_column, key_range, filters=None):
+    source_conn = open_snapshot_connection(source_db, snapshot_name)
+    target_conn = dml_replication_postgresql.target_db_connection(target_db, syst_dest)
+    try:
+        select_query = chunk_select(table_name, key_column, key_range, source_filters.table_columns(filters, table_name),
+                                    source_filters.table_row_filter(filters, table_name))
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode='w+') as spool:
+            with source_conn.cursor() as cur:
+                cur.copy_expert(f"COPY ({select_query}) TO STDOUT", spool)
+                cur.execute(f"{select_query} LIMIT 0")
+                columns = [desc[0] for desc in cur.description]
+            spool.seek(0)
+
+            if syst_dest == 'postgresql':
+                with target_conn.cursor() as cur:
+                    cur.copy_expert(f"COPY {table_name} ({', '.join(columns)}) FROM STDIN", spool)
+                    row_count = cur.rowcount
+                target_conn.commit()
+            else:
+                row_count = 0
+                rows = []
+                for line in spool:
+                    rows.append(parse_copy_text_line(line))
+                    if len(rows) >= INSERT_BATCH_SIZE:
+                        row_count += load_rows_into_target(target_conn, syst_dest, table_name, columns, rows)
+                        rows = []
+                row_count += load_rows_into_target(target_conn, syst_dest, table_name, columns, rows)
+
+        logging.info(f"Copied chunk {key_range} of {table_name}: {row_count} rows")
+        return row_count
+    finally:
+        source_conn.close()
+        target_conn.close()
+
+
+def initial_load_postgresql(source_db, target_db, syst_dest, slot_name=SLOT_NAME,
+                            publication_name=PUBLICATION_NAME, workers=4, chunk_count=4, filters=None):
+    repl_conn, consistent_point, snapshot_name = create_slot_with_snapshot(source_db, slot_name)
+    try:
+        planning_conn = open_snapshot_connection(source_db, snapshot_name)
+        tasks = []
+        try:
+            with planning_conn.cursor() as cur:
+                for table_name in get_published_tables(planning_conn, publication_name):
+                    # La table de heartbeat est publiée pour la mesure de retard, pas répliquée
+                    if table_name == replication_lag.HEARTBEAT_TABLE:
+                        continue
+                    key_column = get_integer_key_postgresql(planning_conn, table_name)
+                    for key_range in table_chunks(cur, table_name, key_column, chunk_count):
+                        tasks.append((table_name, key_column, key_range))
+        finally:
+            planning_conn.close()
+
+        for table_name in {task[0] for task in tasks}:
+            truncate_target_table(target_db, syst_dest, table_name)
+
+        total_rows = 0
+        # Les threads de copie héritent du pipeline : mêmes paramètres de connexion que le slot et le snapshot
+        with ThreadPoolExecutor(max_workers=workers, initializer=profiling.bind_pipeline,
+                                initargs=(profiling.current_pipeline(),)) as executor:
+            futures = [executor.submit(copy_postgresql_chunk, source_db, target_db, syst_dest, snapshot_name, *task, filters)
+                       for task in tasks]
+            for future in as_completed(futures):
+                total_rows += future.result()
+
+        logging.info(f"Initial load finished: {total_rows} rows copied, CDC starts at LSN {consistent_point}")
+        return consistent_point
+    finally:
+        repl_conn.close()
+
+
+def copy_mysql_chunk(connections, source_db, target_db, syst_dest, table_source, table_dest, key_column, key_range, filters=None):
+    # Chaque connexion porte sa propre transaction ouverte sur le même point du binlog
+    source_conn = connections.get()
+    target_conn = dml_replication_postgresql.target_db_connection(target_db, syst_dest)
+    try:
+        cur = source_conn.cursor()
+        row_count = 0
+        try:
+            # Le binlog ne filtre que les colonnes : le prédicat de lignes, propre aux publications, ne s'applique pas ici
+            cur.execute(chunk_select(table_source, key_column, key_range, source_filters.table_columns(filters, table_source)))
+            columns = [desc[0] for desc in cur.description]
+            while True:
+                rows = cur.fetchmany(INSERT_BATCH_SIZE)
+                if not rows:
+                    break
+                row_count += load_rows_into_target(target_conn, syst_dest, table_dest, columns, rows)
+        finally:
+            cur.close()
+        logging.info(f"Copied chunk {key_range} of {table_source}: {row_count} rows")
+        return row_count
+    finally:
+        target_conn.close()
+        connections.put(source_conn)
+
+
+def initial_load_mysql(source_db, target_db, syst_dest, table_source, table_dest, workers=4, chunk_count=4, filters=None):
+    coordinator = drivers.driver('mysql').connect(**mysql_source_params(source_db))
+    snapshot_connections = []
+    try:
+        cur = coordinator.cursor()
+        cur.execute("FLUSH TABLES WITH READ LOCK")
+        try:
+            for _ in range(workers):
+                conn = drivers.driver('mysql').connect(**mysql_source_params(source_db))
+                conn.start_transaction(consistent_snapshot=True, isolation_level='REPEATABLE READ', readonly=True)
+                snapshot_connections.append(conn)
+            log_file, log_pos = drivers.dml_module('mysql').binlog_position(coordinator)
+        finally:
+            cur.execute("UNLOCK TABLES")
+            cur.close()
+        logging.info(f"MySQL snapshot taken at binlog position {log_file}:{log_pos}")
+
+        planning_conn = snapshot_connections[0]
+        tasks = []
+        planning_cur = planning_conn.cursor()
+        try:
+            for table_name in get_source_tables_mysql(planning_conn, source_db, table_source, filters):
+                key_column = get_integer_key_mysql(planning_conn, table_name, source_db)
+                # Sans table cible explicite, chaque table garde son nom, comme dans le flux du binlog
+                table_target = table_dest if table_dest and table_name == table_source else table_name
+                for key_range in table_chunks(planning_cur, table_name, key_column, chunk_count):
+                    tasks.append((table_name, table_target, key_column, key_range))
+        finally:
+            planning_cur.close()
+
+        for table_target in {task[1] for task in tasks}:
+            truncate_target_table(target_db, syst_dest, table_target)
+
+        connections = queue.Queue()
+        for conn in snapshot_connections:
+            connections.put(conn)
+
+        total_rows = 0
+        with ThreadPoolExecutor(max_workers=workers, initializer=profiling.bind_pipeline,
+                                initargs=(profiling.current_pipeline(),)) as executor:
+            futures = [executor.submit(copy_mysql_chunk, connections, source_db, target_db, syst_dest, *task, filters)
+                       for task in tasks]
+            for future in as_completed(futures):
+                total_rows += future.result()
+
+        logging.info(f"Initial load finished: {total_rows} rows copied, CDC starts at {log_file}:{log_pos}")
+        return log_file, log_pos
+    finally:
+        for conn in snapshot_connections:
+            conn.rollback()
+            conn.close()
+        coordinator.close()
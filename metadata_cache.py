@@ -0,0 +1,150 @@
+import hashlib
+import re
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+import drivers
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+METADATA_TTL = 30
+POOL_MAX_SIZE = 5
+# Attente maximale d'une connexion libre avant de répondre « occupé » plutôt que d'échouer
+POOL_WAIT_TIMEOUT = 5
+
+_pools = {}
+_pool_slots = {}
+_pools_lock = threading.Lock()
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+# Ordres DDL qui changent la liste des tables ou des bases (balises du déclencheur d'événement, requêtes du binlog)
+CATALOG_DDL_PREFIXES = ('CREATE', 'DROP', 'RENAME', 'ALTER TABLE')
+# Noms de pool acceptés par mysql.connector : 64 caractères parmi [a-zA-Z0-9._:$#*-]
+POOL_NAME_MAX_SIZE = 64
+
+
+def pool_name(dbname):
+    # Nom de base quelconque : caractères interdits remplacés, empreinte pour garder deux bases distinctes
+    readable = re.sub(r'[^a-zA-Z0-9._:$#*-]', '_', dbname)
+    digest = hashlib.sha1(dbname.encode('utf-8')).hexdigest()[:12]
+    return f"metadata_{readable}"[:POOL_NAME_MAX_SIZE - len(digest) - 1] + f"_{digest}"
+
+
+def create_pool(db_type, dbname):
+    if db_type == 'mysql':
+        return drivers.load('mysql.connector.pooling').MySQLConnectionPool(
+            pool_name=pool_name(dbname),
+            pool_size=POOL_MAX_SIZE,
+            **drivers.connection_params('mysql', dbname)
+        )
+    elif db_type == 'postgresql':
+        return drivers.load('psycopg2.pool').ThreadedConnectionPool(
+            1, POOL_MAX_SIZE,
+            **drivers.connection_params('postgresql', dbname)
+        )
+    else:
+        raise ValueError("Type de base de données non supporté")
+
+
+def get_pool(db_type, dbname):
+    key = (db_type, dbname)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = create_pool(db_type, dbname)
+            # Les pools lèvent PoolError dès qu'ils sont épuisés : les requêtes en trop attendent leur tour
+            _pool_slots[key] = threading.BoundedSemaphore(POOL_MAX_SIZE)
+            logging.info(f"Created {db_type} connection pool for {dbname}")
+        return _pools[key], _pool_slots[key]
+
+
+@contextmanager
+def pooled_connection(db_type, dbname):
+    pool, slots = get_pool(db_type, dbname)
+    if not slots.acquire(timeout=POOL_WAIT_TIMEOUT):
+        raise TimeoutError(f"No free {db_type} connection for {dbname} after {POOL_WAIT_TIMEOUT}s")
+    try:
+        if db_type == 'mysql':
+            conn = pool.get_connection()
+            try:
+                yield conn
+            finally:
+                # close() rend la connexion au pool
+                conn.close()
+        else:
+            conn = pool.getconn()
+            conn.autocommit = True
+            try:
+                yield conn
+            finally:
+                pool.putconn(conn)
+    finally:
+        slots.release()
+
+
+def get_cached(key, loader, ttl=METADATA_TTL):
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry and entry[0] > now:
+            return entry[1]
+
+    value = loader()
+    with _cache_lock:
+        _cache[key] = (time.monotonic() + ttl, value)
+    return value
+
+
+def changes_catalog(statement):
+    return statement.lstrip().upper().startswith(CATALOG_DDL_PREFIXES)
+
+
+def invalidate(db_type=None, dbname=None):
+    with _cache_lock:
+        for key in list(_cache):
+            _, key_type, key_dbname = key
+            if (db_type is None or key_type == db_type) and (dbname is None or key_dbname in (dbname, None)):
+                del _cache[key]
+    logging.info(f"Invalidated metadata cache for type={db_type}, database={dbname}")
+
+
+def list_databases(db_type):
+    def load():
+        if db_type == 'mysql':
+            dbname, query = "receive_replication", "SHOW DATABASES"
+        else:
+            dbname, query = 'postgres', "SELECT datname FROM pg_database"
+        with pooled_connection(db_type, dbname) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(query)
+                return [row[0] for row in cur.fetchall()]
+            finally:
+                cur.close()
+
+    return get_cached(('databases', db_type, None), load)
+
+
+def list_tables(db_type, dbname):
+    def load():
+        if db_type == 'mysql':
+            pool_dbname = "receive_replication"
+            query = "SELECT table_name FROM information_schema.tables WHERE table_schema = %s;"
+            params = (dbname,)
+        else:
+            pool_dbname = dbname
+            query = "SELECT table_name FROM information_schema.tables WHERE table_schema = 'public';"
+            params = None
+        with pooled_connection(db_type, pool_dbname) as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(query, params)
+                return [row[0] for row in cur.fetchall()]
+            finally:
+                cur.close()
+
+    return get_cached(('tables', db_type, dbname), load)
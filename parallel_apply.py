@@ -0,0 +1,110 @@
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import change_batches
+import dead_letter
+import profiling
+import replication_lag
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+MAX_WORKERS = 16
+
+
+# Une transaction : (last_committed, sequence_number, records). Les horloges logiques du group commit
+# viennent du GtidEvent ; sans elles (GTID anonyme), seuls les jeux de clés écrites décident du parallélisme
+# Ces horloges repartent de zéro à chaque fichier binlog : l'appelant ne planifie jamais ensemble deux fichiers
+
+def transaction_keys(records):
+    # Clés touchées (ancienne et nouvelle pour un UPDATE) ; None si une ligne n'a pas de clé
+    keys = set()
+    for record in records:
+        relation = record.relation
+        if not relation.key_positions:
+            return None
+        keys.add((relation.name, record.key_values()))
+        if record.old_values is not None and record.values is not None:
+            keys.add((relation.name, tuple(record.values[position] for position in relation.key_positions)))
+    return keys
+
+
+def plan_waves(transactions):
+    # Vague : transactions consécutives sans dépendance entre elles, appliquées en parallèle.
+    # La vague suivante ne démarre qu'une fois la précédente validée, ce qui garde l'ordre des dépendances
+    waves = []
+    wave, wave_keys, wave_start = [], set(), None
+    for last_committed, sequence_number, records in transactions:
+        keys = transaction_keys(records)
+        if not wave:
+            independent = False
+        elif last_committed is not None and wave_start is not None:
+            # Sur la source, la transaction attendait toutes celles de séquence <= last_committed
+            independent = last_committed < wave_start
+        else:
+            independent = keys is not None and wave_keys is not None and not keys & wave_keys
+        if not independent and wave:
+            waves.append(wave)
+            wave, wave_keys, wave_start = [], set(), None
+        if not wave:
+            wave_start = sequence_number
+        wave.append(records)
+        wave_keys = wave_keys | keys if keys is not None and wave_keys is not None else None
+    if wave:
+        waves.append(wave)
+    return waves
+
+
+def apply_share(pipeline_id, conn, records, syst_dest, query_builders, max_rows, apply_mode, reject, parked_rows):
+    # La part d'une connexion ne contient que des transactions complètes, validées en une seule fois
+    profiling.bind_pipeline(pipeline_id)
+    return change_batches.apply_in_transaction(conn, records, syst_dest, query_builders, max_rows, apply_mode, reject, parked_rows)
+
+
+def apply_transactions(transactions, target_db, syst_dest, query_builders, connect, workers,
+                       max_rows=change_batches.BATCH_MAX_ROWS, apply_mode='insert'):
+    heartbeats = []
+    change_transactions = []
+    for last_committed, sequence_number, records in transactions:
+        records, transaction_heartbeats = replication_lag.split_heartbeats(records)
+        heartbeats.extend(transaction_heartbeats)
+        if records:
+            change_transactions.append((last_committed, sequence_number, records))
+    try:
+        if not change_transactions:
+            return 0
+        waves = plan_waves(change_transactions)
+        widest = max(len(wave) for wave in waves)
+        pipeline_id = profiling.current_pipeline()
+        reject = change_batches.dead_letter_reject(target_db, syst_dest, connect, apply_mode)
+        # Partagé entre les vagues : une ligne rejetée dans l'une est mise en attente dans les suivantes
+        parked_rows = dead_letter.pending_rows(target_db, syst_dest)
+        connections = []
+        applied = 0
+        try:
+            with profiling.timed('connect'):
+                for _ in range(max(1, min(workers, widest, MAX_WORKERS))):
+                    connections.append(change_batches.open_target(connect, target_db, syst_dest))
+            if len(connections) == 1:
+                # Rien à paralléliser : les transactions sont validées ensemble sur une seule connexion
+                records = [record for wave in waves for transaction in wave for record in transaction]
+                return change_batches.apply_in_transaction(connections[0], records, syst_dest, query_builders, max_rows,
+                                                           apply_mode, reject, parked_rows)
+            with ThreadPoolExecutor(max_workers=len(connections)) as executor:
+                for wave in waves:
+                    shares = [[] for _ in connections]
+                    for index, records in enumerate(wave):
+                        shares[index % len(connections)].extend(records)
+                    futures = [executor.submit(apply_share, pipeline_id, conn, share, syst_dest, query_builders, max_rows, apply_mode, reject,
+                                               parked_rows)
+                               for conn, share in zip(connections, shares) if share]
+                    applied += sum(future.result() for future in futures)
+        finally:
+            for conn in connections:
+                conn.close()
+        logging.info(f"Applied {applied} changes of {len(change_transactions)} transactions in {len(waves)} waves "
+                     f"on {len(connections)} connections to {target_db}")
+        return applied
+    finally:
+        replication_lag.observe_records(replication_lag.HEARTBEAT_TABLE, heartbeats, time.time())
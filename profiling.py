@@ -0,0 +1,125 @@
+import collections
+import contextlib
+import sys
+import threading
+import time
+import uuid
+import logging
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SAMPLE_INTERVAL = 0.01
+MAX_PROFILE_SECONDS = 300
+
+# Pipeline du thread courant : les durées d'étapes sont agrégées par pipeline
+_local = threading.local()
+
+# (pipeline, étape) -> [nombre, durée totale, durée max]
+_stage_totals = {}
+_stage_lock = threading.Lock()
+
+_profiles = {}
+_profiles_lock = threading.Lock()
+
+
+def bind_pipeline(pipeline_id):
+    _local.pipeline = pipeline_id
+
+
+def current_pipeline():
+    return getattr(_local, 'pipeline', None)
+
+
+def record_stage(stage, elapsed):
+    key = (current_pipeline(), stage)
+    with _stage_lock:
+        totals = _stage_totals.setdefault(key, [0, 0.0, 0.0])
+        totals[0] += 1
+        totals[1] += elapsed
+        totals[2] = max(totals[2], elapsed)
+
+
+@contextlib.contextmanager
+def timed(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+def timed_iter(iterable, stage):
+    # Chronomètre l'attente de chaque élément (lecture du flux source) sans compter son traitement
+    iterator = iter(iterable)
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            record_stage(stage, time.perf_counter() - started)
+            return
+        record_stage(stage, time.perf_counter() - started)
+        yield item
+
+
+def stage_timings(pipeline_id):
+    with _stage_lock:
+        return {stage: {'count': count, 'total_seconds': round(total, 3),
+                        'avg_ms': round(total / count * 1000, 3) if count else 0, 'max_ms': round(longest * 1000, 3)}
+                for (pipeline, stage), (count, total, longest) in _stage_totals.items() if pipeline == pipeline_id}
+
+
+def reset_stage_timings(pipeline_id):
+    with _stage_lock:
+        for key in [key for key in _stage_totals if key[0] == pipeline_id]:
+            del _stage_totals[key]
+
+
+def folded_stack(frame):
+    stack = []
+    while frame is not None:
+        stack.append(f"{frame.f_code.co_filename.rsplit('/', 1)[-1]}:{frame.f_code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+def sample_threads(profile):
+    deadline = profile['started_at'] + profile['seconds']
+    while time.time() < deadline and not profile['stop_event'].is_set():
+        frames = sys._current_frames()
+        for thread_id in profile['thread_ids']:
+            frame = frames.get(thread_id)
+            if frame is not None:
+                profile['samples'][folded_stack(frame)] += 1
+        profile['stop_event'].wait(profile['interval'])
+    profile['state'] = 'finished'
+    logging.info(f"Profile {profile['id']} finished with {sum(profile['samples'].values())} samples")
+
+
+def start_profile(threads, seconds, interval=SAMPLE_INTERVAL):
+    # Échantillonnage des piles des threads du pipeline, sans redémarrage ni débogueur
+    profile = {
+        'id': uuid.uuid4().hex,
+        'thread_ids': [thread.ident for thread in threads if thread.ident is not None],
+        'seconds': min(seconds, MAX_PROFILE_SECONDS),
+        'interval': interval,
+        'started_at': time.time(),
+        'state': 'running',
+        'samples': collections.Counter(),
+        'stop_event': threading.Event(),
+    }
+    with _profiles_lock:
+        _profiles[profile['id']] = profile
+    threading.Thread(target=sample_threads, args=(profile,), name=f"profiler-{profile['id'][:8]}", daemon=True).start()
+    return profile
+
+
+def get_profile(profile_id):
+    with _profiles_lock:
+        return _profiles.get(profile_id)
+
+
+def profile_output(profile):
+    # Format « folded » : une pile par ligne suivie de son nombre d'échantillons (flamegraph.pl, speedscope)
+    return ''.join(f"{stack} {count}\n" for stack, count in profile['samples'].most_common())
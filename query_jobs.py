@@ -0,0 +1,140 @@
+import collections
+import threading
+import time
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import metadata_cache
+import replication_jobs
+import drivers
+import profiling
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+QUERY_WORKERS = 4
+# Historique borné : les jobs les plus anciens sont oubliés
+MAX_QUERY_JOBS = 1000
+DDL_KEYWORDS = ('CREATE', 'DROP', 'ALTER', 'TRUNCATE', 'COMMENT')
+
+_executor = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix='query')
+_jobs = collections.OrderedDict()
+_jobs_lock = threading.Lock()
+
+
+def submit(source_db, target_db, statements, syst_source='postgresql', syst_dest='postgresql', pipeline_id=None):
+    job = {
+        'id': uuid.uuid4().hex,
+        'source_db': source_db,
+        'target_db': target_db,
+        'syst_source': syst_source,
+        'syst_dest': syst_dest,
+        # Pipeline dont les paramètres de connexion s'appliquent (drivers.configure_pipeline)
+        'pipeline': pipeline_id,
+        'state': 'queued',
+        'submitted_at': time.time(),
+        'started_at': None,
+        'finished_at': None,
+        'results': [{'statement': statement, 'state': 'queued'} for statement in statements],
+        'woken_jobs': [],
+    }
+    with _jobs_lock:
+        _jobs[job['id']] = job
+        while len(_jobs) > MAX_QUERY_JOBS:
+            _jobs.popitem(last=False)
+    _executor.submit(run_query_job, job)
+    return job
+
+
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def job_status(job):
+    with _jobs_lock:
+        return {key: ([dict(result) for result in value] if key == 'results' else value) for key, value in job.items()}
+
+
+def update(entry, **changes):
+    # job_status copie le job sous le même verrou : jamais d'état à moitié écrit
+    with _jobs_lock:
+        entry.update(changes)
+
+
+def replicate_alter(job, sql_query):
+    # ALTER déjà validé sur la source, reporté sur la cible par le module DDL du moteur source
+    ddl = drivers.ddl_module(job['syst_source'])
+    source_db, target_db, syst_dest = job['source_db'], job['target_db'], job['syst_dest']
+    source_conn = ddl.source_db_connection(source_db)
+    target_conn = ddl.target_db_connection(target_db, syst_dest)
+    try:
+        if source_conn is None or target_conn is None:
+            raise ValueError(f"Cannot connect to {source_db} and {target_db} to replicate the ALTER")
+        table_name = sql_query.split(' ')[2]
+        if 'ADD' in sql_query.upper():
+            action = 'add'
+        elif 'DROP' in sql_query.upper():
+            action = 'drop'
+        elif 'ALTER COLUMN' in sql_query.upper() or 'MODIFY' in sql_query.upper():
+            action = 'modify'
+        else:
+            raise ValueError("Commande ALTER non prise en charge.")
+        replicate = getattr(ddl, f"replicate_alter_table_{action}")
+        if job['syst_source'] == 'mysql' and action == 'modify':
+            replicate(source_conn, target_conn, table_name, target_db, syst_dest, source_db)
+        elif job['syst_source'] == 'mysql':
+            replicate(source_conn, target_conn, table_name, target_db, source_db, syst_dest)
+        elif action == 'modify':
+            replicate(source_conn, target_conn, table_name, syst_dest)
+        else:
+            replicate(source_conn, target_conn, table_name)
+    finally:
+        for conn in (source_conn, target_conn):
+            if conn is not None:
+                conn.close()
+    metadata_cache.invalidate(syst_dest, target_db)
+
+
+def run_query_job(job):
+    # Les threads de l'exécuteur ne sont liés à aucun pipeline : on lie celui du job pour ses connexions
+    profiling.bind_pipeline(job['pipeline'])
+    update(job, state='running', started_at=time.time())
+    conn = None
+    try:
+        for result in job['results']:
+            sql_query = result['statement']
+            update(result, state='running')
+            try:
+                # Une connexion source pour tout le lot ; chaque instruction est validée séparément
+                if conn is None:
+                    conn = drivers.connect(job['syst_source'], job['source_db'])
+                cur = conn.cursor()
+                try:
+                    cur.execute(sql_query)
+                    rowcount = cur.rowcount
+                finally:
+                    cur.close()
+                conn.commit()
+                keyword = sql_query.split(' ')[0].upper()
+                if keyword in DDL_KEYWORDS:
+                    # Tables ou bases créées, supprimées ou renommées : les listes en cache sont périmées
+                    metadata_cache.invalidate(job['syst_source'], job['source_db'])
+                if keyword == 'ALTER':
+                    replicate_alter(job, sql_query)
+                update(result, state='succeeded', rowcount=rowcount)
+            except Exception as e:
+                if conn is not None:
+                    conn.rollback()
+                update(result, state='failed', error=str(e))
+                logging.error(f"Error executing query on {job['source_db']}: {e}")
+    finally:
+        if conn is not None:
+            conn.close()
+    # L'application sur la cible reste faite par les pipelines de la source, réveillés sans attendre leur délai
+    woken_jobs = replication_jobs.wake_jobs(job['source_db'])
+    with _jobs_lock:
+        state = 'failed' if any(result['state'] == 'failed' for result in job['results']) else 'succeeded'
+    update(job, woken_jobs=woken_jobs, state=state, finished_at=time.time())
+    logging.info(f"Query job {job['id']} {state}, woke {len(woken_jobs)} pipelines")
@@ -0,0 +1,200 @@
+import argparse
+import json
+import pickle
+import time
+import types
+import logging
+
+import psycopg2
+from psycopg2.extras import LogicalReplicationConnection
+from pymysqlreplication import BinLogStreamReader
+from pymysqlreplication.row_event import (
+    DeleteRowsEvent,
+    UpdateRowsEvent,
+    WriteRowsEvent,
+)
+
+import dml_replication_postgresql
+import dml_replication_mysql
+import change_batches
+import drivers
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Slot dédié : l'enregistrement ne consomme pas le slot du pipeline
+RECORD_SLOT_NAME = "record_slot"
+RECORD_POLL_INTERVAL = 0.5
+
+
+# Un enregistrement est une suite d'objets pickle : un en-tête puis un objet par lecture de la source,
+# pour rejouer les lots avec la même forme qu'en production
+
+def record_postgresql(source_db, output, duration):
+    conn_params = dict(drivers.connection_params('postgresql', source_db), connection_factory=LogicalReplicationConnection)
+    conn = psycopg2.connect(**conn_params)
+    conn.autocommit = True
+    chunks = 0
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_create_logical_replication_slot(%s, 'pgoutput')", (RECORD_SLOT_NAME,))
+        with open(output, 'wb') as record_file:
+            pickle.dump({'source': 'postgresql', 'source_db': source_db, 'started_at': time.time()}, record_file)
+            deadline = time.time() + duration
+            while time.time() < deadline:
+                changes = dml_replication_postgresql.fetch_changes_from_slot(conn, RECORD_SLOT_NAME)
+                if changes:
+                    rows = [(lsn, xid, bytes(data)) for lsn, xid, data in changes]
+                    pickle.dump({'recorded_at': time.time(), 'rows': rows}, record_file)
+                    chunks += 1
+                time.sleep(RECORD_POLL_INTERVAL)
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_drop_replication_slot(%s)", (RECORD_SLOT_NAME,))
+        conn.close()
+    logging.info(f"Recorded {chunks} slot reads from {source_db} into {output}")
+    return chunks
+
+
+def record_mysql(source_db, output, duration):
+    mysql_settings = drivers.connection_params('mysql', source_db)
+    log_file, log_pos = None, None
+    chunks = 0
+    with open(output, 'wb') as record_file:
+        pickle.dump({'source': 'mysql', 'source_db': source_db, 'started_at': time.time()}, record_file)
+        deadline = time.time() + duration
+        while time.time() < deadline:
+            stream = BinLogStreamReader(
+                connection_settings=mysql_settings,
+                server_id=2,
+                only_events=[DeleteRowsEvent, UpdateRowsEvent, WriteRowsEvent],
+                blocking=False,
+                resume_stream=True,
+                log_file=log_file,
+                log_pos=log_pos
+            )
+            try:
+                events = [{'op': dml_replication_mysql.event_op(binlogevent), 'schema': binlogevent.schema,
+                           'table': binlogevent.table, 'columns': [column.name for column in binlogevent.columns],
+                           'primary_key': binlogevent.primary_key, 'rows': binlogevent.rows}
+                          for binlogevent in stream]
+                log_file, log_pos = stream.log_file, stream.log_pos
+            finally:
+                stream.close()
+            if events:
+                pickle.dump({'recorded_at': time.time(), 'events': events}, record_file)
+                chunks += 1
+            time.sleep(RECORD_POLL_INTERVAL)
+    logging.info(f"Recorded {chunks} binlog reads from {source_db} into {output}")
+    return chunks
+
+
+def load_recording(path):
+    chunks = []
+    with open(path, 'rb') as record_file:
+        header = pickle.load(record_file)
+        while True:
+            try:
+                chunks.append(pickle.load(record_file))
+            except EOFError:
+                break
+    return header, chunks
+
+
+def postgresql_chunk_records(chunk, target_db):
+    # Les types de colonnes sont lus dans le catalogue de la cible locale, qui porte les mêmes tables
+    conn = dml_replication_postgresql.target_db_connection(target_db, 'postgresql')
+    try:
+        decoded_changes, stats = dml_replication_postgresql.decode_changes(conn, chunk['rows'])
+    finally:
+        conn.close()
+    return [record for _, record in decoded_changes]
+
+
+def mysql_chunk_records(chunk, table_dest):
+    records = []
+    for event in chunk['events']:
+        binlogevent = types.SimpleNamespace(schema=event['schema'], table=event['table'], primary_key=event['primary_key'],
+                                            columns=[types.SimpleNamespace(name=name) for name in event['columns']])
+        relation = dml_replication_mysql.get_relation(binlogevent, table_dest or event['table'])
+        records.extend(dml_replication_mysql.event_records(event['op'], relation, event['rows']))
+    return records
+
+
+def replay(path, target_db, syst_dest, speed=0, table_dest=None, apply_mode='insert'):
+    # speed=0 : vitesse maximale ; sinon respecte les écarts enregistrés, accélérés d'un facteur speed
+    header, chunks = load_recording(path)
+    dml_module = dml_replication_postgresql if header['source'] == 'postgresql' else dml_replication_mysql
+    report = {'source': header['source'], 'chunks': len(chunks), 'rows': 0, 'apply_latencies': [], 'lag_curve': []}
+    if not chunks:
+        return report
+
+    first_recorded_at = chunks[0]['recorded_at']
+    started = time.time()
+    for chunk in chunks:
+        scheduled = started + (chunk['recorded_at'] - first_recorded_at) / speed if speed else time.time()
+        if scheduled > time.time():
+            time.sleep(scheduled - time.time())
+
+        if header['source'] == 'postgresql':
+            records = postgresql_chunk_records(chunk, target_db)
+        else:
+            records = mysql_chunk_records(chunk, table_dest)
+        apply_started = time.time()
+        report['rows'] += change_batches.apply_records(records, target_db, syst_dest, dml_module.QUERY_BUILDERS,
+                                                       dml_module.target_db_connection, apply_mode=apply_mode)
+        applied_at = time.time()
+        report['apply_latencies'].append(applied_at - apply_started)
+        # Retard sur le calendrier d'origine : croît tant que l'application ne suit pas le débit enregistré
+        report['lag_curve'].append((round(applied_at - started, 3), round(applied_at - scheduled, 3)))
+
+    elapsed = time.time() - started
+    latencies = sorted(report['apply_latencies'])
+    report.update({
+        'elapsed_seconds': round(elapsed, 3),
+        'rows_per_second': round(report['rows'] / elapsed, 1) if elapsed else None,
+        'apply_latency_p50': round(latencies[len(latencies) // 2], 4),
+        'apply_latency_p99': round(latencies[max(0, int(len(latencies) * 0.99) - 1)], 4),
+        'max_lag_seconds': max(lag for _, lag in report['lag_curve']),
+    })
+    del report['apply_latencies']
+    logging.info(f"Replayed {report['rows']} rows from {path} into {target_db} using {syst_dest} "
+                 f"at {report['rows_per_second']} rows/s")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record a source change stream and replay it through the apply path")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = subparsers.add_parser('record', help="Record slot rows or binlog events to a file")
+    record_parser.add_argument('--syst-source', choices=['postgresql', 'mysql'], required=True)
+    record_parser.add_argument('--source-db', required=True)
+    record_parser.add_argument('--output', required=True)
+    record_parser.add_argument('--duration', type=float, default=60, help="Recording duration in seconds")
+
+    replay_parser = subparsers.add_parser('replay', help="Replay a recording into a target database")
+    replay_parser.add_argument('--input', required=True)
+    replay_parser.add_argument('--target-db', required=True)
+    replay_parser.add_argument('--syst-dest', choices=['postgresql', 'mysql', 'redshift'], required=True)
+    replay_parser.add_argument('--table-dest', help="Target table for binlog recordings (defaults to the source table)")
+    replay_parser.add_argument('--speed', type=float, default=0, help="0 for maximum speed, 1 for original timing, 2 for twice as fast")
+    replay_parser.add_argument('--apply-mode', choices=change_batches.APPLY_MODES, default='insert',
+                               help="upsert makes the replay idempotent on a target that already holds the rows")
+    replay_parser.add_argument('--report', help="Write the JSON report, including the lag curve, to this file")
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        recorder = record_postgresql if args.syst_source == 'postgresql' else record_mysql
+        recorder(args.source_db, args.output, args.duration)
+        return
+
+    report = replay(args.input, args.target_db, args.syst_dest, args.speed, args.table_dest, args.apply_mode)
+    if args.report:
+        with open(args.report, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+    print(json.dumps({key: value for key, value in report.items() if key != 'lag_curve'}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
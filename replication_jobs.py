@@ -0,0 +1,714 @@
+import atexit
+import collections
+import threading
+import time
+import uuid
+import logging
+
+import dml_replication_postgresql, ddl_replication_postgresql
+import initial_load
+import metadata_cache
+import adaptive_wait
+import adaptive_batching
+import profiling
+import replication_lag
+import streaming_replication
+import fanout
+import change_log
+import change_batches
+import dead_letter
+import source_filters
+import drivers
+import change_feed
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+LOOP_INTERVAL = 1
+DDL_MIN_DELAY = 1
+DDL_MAX_DELAY = 30
+STOP_TIMEOUT = 30
+THROUGHPUT_WINDOW = 60
+SLOT_MONITOR_INTERVAL = 30
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+# Pipelines en cours dans ce processus, en threads comme dans un processus du runner :
+# un pipeline n'a jamais deux workers qui consomment le même slot ou le même binlog
+_pipelines = {}
+
+
+def pipeline_targets(config):
+    # Une liste 'targets' diffuse le même flux vers plusieurs cibles ; sinon cible unique
+    if config.get('targets'):
+        return [(target['target_db'], target['syst_dest']) for target in config['targets']]
+    return [(config['target_db'], config['syst_dest'])]
+
+
+def validate_modes(config, with_initial_load=False):
+    # Le fan-out a sa propre capture : les autres modes ne serviraient que la première cible
+    if len(pipeline_targets(config)) <= 1:
+        return
+    if config['syst_source'] != 'postgresql':
+        raise ValueError("Fan-out to several targets is only supported from PostgreSQL")
+    if config.get('change_log') or config.get('streaming'):
+        raise ValueError("change_log and streaming modes support a single target, not a fan-out to several targets")
+    if with_initial_load:
+        raise ValueError("Initial load is not supported when fanning out to several targets")
+
+
+def pipeline_key(config):
+    return (config['syst_source'], config['source_db'], str(pipeline_targets(config)),
+            str(config.get('table_source')), str(config.get('table_dest')))
+
+
+def new_job(config):
+    resume_event = threading.Event()
+    resume_event.set()
+    return {
+        'id': uuid.uuid4().hex,
+        'key': pipeline_key(config),
+        'config': config,
+        'state': 'running',
+        'stop_event': threading.Event(),
+        'resume_event': resume_event,
+        'wakeup_event': threading.Event(),
+        'threads': [],
+        'started_at': time.time(),
+        'changes_applied': 0,
+        'errors': 0,
+        'last_commit_ts': None,
+        'last_applied_at': None,
+        'recent_batches': collections.deque(),
+        'fanout': None,
+        'slot': None,
+        # Taille de lot auto-ajustée ; bornes surchargeables par 'batching' dans la configuration
+        'batching': adaptive_batching.new_controller(**config.get('batching', {})),
+        # 'upsert' : application rejouable (reprise après crash, rechargement) sans doublon
+        'apply_mode': config.get('apply_mode', 'insert'),
+        # Publication lue par le pipeline : filtres de colonnes et de lignes appliqués par la source
+        'publication': source_filters.publication_name(config.get('filters')),
+        'log_appended': threading.Event(),
+        'lock': threading.Lock(),
+    }
+
+
+def is_alive(job):
+    return any(thread.is_alive() for thread in job['threads'])
+
+
+def pipeline_slot(key):
+    # Tous les modes PostgreSQL lisent le même slot de la base source : deux pipelines ne peuvent pas s'y partager
+    syst_source, source_db = key[0], key[1]
+    if syst_source != 'postgresql':
+        return None
+    return source_db, streaming_replication.SLOT_NAME
+
+
+def claim_pipeline(key, create, alive):
+    # La place est réservée sous le verrou ; create construit et démarre le worker hors verrou (connexions, publication).
+    # alive(job) dit si le pipeline tourne encore
+    slot = pipeline_slot(key)
+    while True:
+        with _jobs_lock:
+            entry = _pipelines.get(key)
+            if entry is None or (entry['job'] is not None and not entry['alive'](entry['job'])):
+                for other_key, other in _pipelines.items():
+                    if other_key != key and slot is not None and other['slot'] == slot \
+                            and (other['job'] is None or other['alive'](other['job'])):
+                        raise ValueError(f"Replication slot {slot[1]} of {slot[0]} is already consumed by pipeline {other_key}")
+                entry = {'job': None, 'alive': alive, 'slot': slot, 'ready': threading.Event()}
+                _pipelines[key] = entry
+                break
+            if entry['job'] is not None:
+                return entry['job'], False
+            ready = entry['ready']
+        # Création en cours par un autre appelant : on attend son résultat
+        ready.wait()
+    try:
+        entry['job'] = create()
+    except Exception:
+        with _jobs_lock:
+            _pipelines.pop(key, None)
+        raise
+    finally:
+        entry['ready'].set()
+    return entry['job'], True
+
+
+def start_job(config, with_initial_load=False):
+    key = pipeline_key(config)
+    job, created = claim_pipeline(key, lambda: create_job(config, with_initial_load), is_alive)
+    if not created:
+        logging.info(f"Job {job['id']} already running for pipeline {key}")
+        return job, False
+    logging.info(f"Started replication job {job['id']} for pipeline {key}")
+    return job, True
+
+
+def create_job(config, with_initial_load=False):
+    key = pipeline_key(config)
+    source_filters.validate_filters(config.get('filters'))
+    validate_modes(config, with_initial_load)
+    job = new_job(config)
+    # Paramètres de connexion propres au pipeline, lus par drivers depuis les threads du job
+    drivers.configure_pipeline(job['id'], config.get('connections'))
+    source_db, table_dest = config['source_db'], config.get('table_dest')
+    pipeline_sinks = pipeline_targets(config)
+    target_db, syst_dest = pipeline_sinks[0]
+
+    if config['syst_source'] == 'postgresql' and config.get('filters'):
+        conn = drivers.connect('postgresql', source_db, job['id'])
+        try:
+            source_filters.ensure_publication(conn, config['filters'])
+        finally:
+            conn.close()
+    if config['syst_source'] == 'postgresql' and len(pipeline_sinks) > 1:
+        targets = [(continuous_fanout_replication_postgresql, (job, source_db, pipeline_sinks))]
+        targets += [(continuous_ddl_replication_postgresql, (job, source_db, sink_db, sink_syst, table_dest))
+                    for sink_db, sink_syst in pipeline_sinks]
+    elif config.get('change_log') and config['syst_source'] in ('postgresql', 'mysql'):
+        # Capture et application découplées par le journal local
+        log = change_log.open_log(f"{config['syst_source']}_{source_db}")
+        if config['syst_source'] == 'postgresql':
+            targets = [
+                (continuous_capture_postgresql, (job, source_db, target_db, syst_dest, log, with_initial_load)),
+                (continuous_log_apply, (job, log, target_db, syst_dest, dml_replication_postgresql)),
+                (continuous_ddl_replication_postgresql, (job, source_db, target_db, syst_dest, table_dest)),
+            ]
+        else:
+            # Les modules MySQL (et pymysqlreplication) ne sont chargés que par les pipelines qui en ont besoin
+            dml_replication_mysql = drivers.dml_module('mysql')
+            table_source = config.get('table_source')
+            targets = [
+                (continuous_capture_mysql, (job, source_db, target_db, syst_dest, table_source, table_dest, log, with_initial_load)),
+                (continuous_log_apply, (job, log, target_db, syst_dest, dml_replication_mysql)),
+                (continuous_ddl_replication_mysql, (job, source_db, target_db, syst_dest, table_dest)),
+            ]
+    elif config['syst_source'] == 'postgresql' and config.get('streaming'):
+        targets = [
+            (continuous_streaming_replication_postgresql, (job, source_db, target_db, syst_dest, with_initial_load)),
+            (continuous_ddl_replication_postgresql, (job, source_db, target_db, syst_dest, table_dest)),
+        ]
+    elif config['syst_source'] == 'postgresql':
+        targets = [
+            (continuous_dml_replication_postgresql, (job, source_db, target_db, syst_dest, with_initial_load)),
+            (continuous_ddl_replication_postgresql, (job, source_db, target_db, syst_dest, table_dest)),
+        ]
+    elif config['syst_source'] == 'mysql':
+        table_source = config.get('table_source')
+        targets = [
+            (continuous_dml_replication_mysql, (job, source_db, target_db, syst_dest, table_source, table_dest, with_initial_load)),
+            (continuous_ddl_replication_mysql, (job, source_db, target_db, syst_dest, table_dest)),
+        ]
+    else:
+        raise ValueError("Unsupported DBMS type")
+    if config.get('heartbeat'):
+        targets.append((continuous_heartbeat, (job, config['syst_source'], source_db)))
+    if config['syst_source'] == 'postgresql':
+        targets.append((continuous_slot_monitor, (job, source_db)))
+    targets.append((continuous_dead_letter_retry, (job, pipeline_sinks)))
+
+    for target, args in targets:
+        thread = threading.Thread(target=run_job_thread, args=(job, target, args), name=f"{target.__name__}-{job['id'][:8]}", daemon=True)
+        job['threads'].append(thread)
+    with _jobs_lock:
+        _jobs[key] = job
+
+    for thread in job['threads']:
+        thread.start()
+    return job
+
+
+def run_job_thread(job, target, args):
+    # Les durées d'étapes mesurées dans ce thread sont rattachées au job
+    profiling.bind_pipeline(job['id'])
+    target(*args)
+
+
+def get_job(job_id):
+    with _jobs_lock:
+        for job in _jobs.values():
+            if job['id'] == job_id:
+                return job
+    return None
+
+
+def list_jobs():
+    with _jobs_lock:
+        return list(_jobs.values())
+
+
+def stop_job(job, timeout=STOP_TIMEOUT):
+    job['state'] = 'stopping'
+    job['stop_event'].set()
+    job['resume_event'].set()
+    job['wakeup_event'].set()
+    for thread in job['threads']:
+        thread.join(timeout)
+    job['state'] = 'running' if is_alive(job) else 'stopped'
+    if job['state'] == 'stopped':
+        drivers.release_pipeline(job['id'])
+    logging.info(f"Replication job {job['id']} {job['state']}")
+    return job
+
+
+def pause_job(job):
+    if job['state'] == 'running':
+        job['resume_event'].clear()
+        job['state'] = 'paused'
+    return job
+
+
+def resume_job(job):
+    if job['state'] == 'paused':
+        job['state'] = 'running'
+        job['resume_event'].set()
+    return job
+
+
+def stop_all_jobs():
+    for job in list_jobs():
+        if is_alive(job):
+            stop_job(job)
+
+
+atexit.register(stop_all_jobs)
+
+
+def wake_jobs(source_db):
+    # Les pipelines de la source reprennent immédiatement au lieu d'attendre la fin de leur délai
+    woken = []
+    for job in list_jobs():
+        if job['config'].get('source_db') == source_db and is_alive(job):
+            job['wakeup_event'].set()
+            woken.append(job['id'])
+    return woken
+
+
+def wait_if_paused(job):
+    while not job['resume_event'].wait(LOOP_INTERVAL):
+        if job['stop_event'].is_set():
+            return
+
+
+def record_progress(job, stats):
+    if not stats:
+        return
+    now = time.time()
+    with job['lock']:
+        job['changes_applied'] += stats['changes']
+        if stats['changes']:
+            job['last_applied_at'] = now
+            job['recent_batches'].append((now, stats['changes']))
+        if stats.get('last_commit_ts') is not None:
+            job['last_commit_ts'] = stats['last_commit_ts']
+        while job['recent_batches'] and job['recent_batches'][0][0] < now - THROUGHPUT_WINDOW:
+            job['recent_batches'].popleft()
+        changes_applied = job['changes_applied']
+    if stats['changes']:
+        # Résumé poussé aux clients du flux de changements, sans relire les tables
+        change_feed.publish('changes', {'pipeline': job['id'], 'changes': stats['changes'], 'changes_applied': changes_applied,
+                                        'last_commit_ts': stats.get('last_commit_ts'), 'applied_at': now}, job['id'])
+
+
+def record_error(job):
+    with job['lock']:
+        job['errors'] += 1
+
+
+def job_summary(job):
+    # État tenu en mémoire uniquement : assez léger pour être publié en continu
+    now = time.time()
+    with job['lock']:
+        recent_changes = sum(count for batch_time, count in job['recent_batches'] if batch_time >= now - THROUGHPUT_WINDOW)
+        uptime = now - job['started_at']
+        lag = None
+        if job['last_commit_ts'] is not None:
+            lag = max(0.0, (job['last_applied_at'] or now) - job['last_commit_ts'])
+        status = {
+            'id': job['id'],
+            # Les paramètres de connexion (mots de passe) ne sont pas exposés
+            'pipeline': {key: value for key, value in job['config'].items() if key != 'connections'},
+            'state': job['state'] if is_alive(job) or job['state'] == 'stopped' else 'failed',
+            'uptime_seconds': round(uptime, 1),
+            'changes_applied': job['changes_applied'],
+            'errors': job['errors'],
+            'throughput_per_second': round(recent_changes / min(THROUGHPUT_WINDOW, max(uptime, 1)), 2),
+            'lag_seconds': round(lag, 3) if lag is not None else None,
+            'last_applied_at': job['last_applied_at'],
+            'last_commit_ts': job['last_commit_ts'],
+        }
+    # Retard mesuré par transaction appliquée (heartbeat compris) quand il est disponible
+    status['lag'] = replication_lag.lag_snapshot(job['id'])
+    if status['lag']['max_lag_seconds'] is not None:
+        status['lag_seconds'] = status['lag']['max_lag_seconds']
+    return status
+
+
+def job_status(job):
+    status = job_summary(job)
+    status['stages'] = profiling.stage_timings(job['id'])
+    status['batching'] = adaptive_batching.controller_status(job['batching'])
+    status['dead_letters'] = {f"{syst_dest}:{target_db}": dead_letter.counts(target_db, syst_dest)
+                              for target_db, syst_dest in pipeline_targets(job['config'])}
+    if job['slot'] is not None:
+        status['slot'] = job['slot']
+    if job['fanout'] is not None:
+        status['sinks'] = fanout.fanout_status(job['fanout'])
+    return status
+
+
+def setup_postgresql_wakeup(source_db, channel, publication_name=initial_load.PUBLICATION_NAME):
+    listen_conn = adaptive_wait.listen_connection(source_db, channel)
+    if listen_conn is not None and channel == adaptive_wait.DML_CHANNEL:
+        try:
+            table_names = initial_load.get_published_tables(listen_conn, publication_name)
+            adaptive_wait.install_wakeup_triggers(listen_conn, table_names)
+        except Exception as e:
+            logging.error(f"Error installing wakeup triggers, relying on backoff polling: {e}")
+    return listen_conn
+
+
+def close_quietly(conn):
+    if conn is not None:
+        try:
+            conn.close()
+        except Exception as e:
+            logging.error(f"Error closing connection: {e}")
+
+
+def continuous_dml_replication_postgresql(job, source_db, target_db, syst_dest, with_initial_load=False):
+    if with_initial_load:
+        # Le slot est recréé au LSN du snapshot : la CDC reprend exactement après la copie
+        initial_load.initial_load_postgresql(source_db, target_db, syst_dest, publication_name=job['publication'],
+                                             filters=job['config'].get('filters'))
+
+    listen_conn = setup_postgresql_wakeup(source_db, adaptive_wait.DML_CHANNEL, job['publication'])
+    delay = 0
+    try:
+        while not job['stop_event'].is_set():
+            wait_if_paused(job)
+            try:
+                stats = dml_replication_postgresql.main(source_db, target_db, syst_dest, job['batching'], job['apply_mode'],
+                                                        job['publication'])
+                record_progress(job, stats)
+                delay = adaptive_wait.next_delay(delay, busy=bool(stats and (stats['changes'] or stats['backlog'])), error=stats is None)
+            except Exception as e:
+                record_error(job)
+                logging.error(f"Waiting for DML modifications to replicate: {e}")
+                delay = adaptive_wait.next_delay(delay, error=True)
+            adaptive_wait.wait_for_wakeup(job['stop_event'], delay, listen_conn, job['wakeup_event'])
+    finally:
+        close_quietly(listen_conn)
+
+    # Dernier passage pour appliquer ce qui a été validé avant l'arrêt
+    record_progress(job, dml_replication_postgresql.main(source_db, target_db, syst_dest, apply_mode=job['apply_mode'],
+                                                         publication_name=job['publication']))
+
+
+def binlog_tables(job, table_source):
+    # Avec heartbeat, la table de heartbeat est lue dans le binlog en plus des tables répliquées
+    if table_source is None and job['config'].get('filters', {}).get('tables'):
+        table_source = list(job['config']['filters']['tables'])
+    if not job['config'].get('heartbeat') or table_source is None:
+        return table_source
+    tables = [table_source] if isinstance(table_source, str) else list(table_source)
+    return tables + [replication_lag.HEARTBEAT_TABLE]
+
+
+def continuous_heartbeat(job, syst_source, source_db):
+    conn = None
+    while not job['stop_event'].is_set():
+        try:
+            if conn is None:
+                if syst_source == 'postgresql':
+                    conn = ddl_replication_postgresql.source_db_connection(source_db)
+                    replication_lag.ensure_heartbeat_postgresql(conn, job['publication'])
+                else:
+                    conn = drivers.ddl_module('mysql').source_db_connection(source_db)
+                    replication_lag.ensure_heartbeat_mysql(conn)
+            replication_lag.write_heartbeat(conn, syst_source)
+        except Exception as e:
+            logging.error(f"Error writing replication heartbeat: {e}")
+            close_quietly(conn)
+            conn = None
+        job['stop_event'].wait(replication_lag.HEARTBEAT_INTERVAL)
+    close_quietly(conn)
+
+
+def continuous_slot_monitor(job, source_db):
+    # Surveille le WAL retenu par le slot : alerte, puis rattrapage forcé avant que le disque source ne sature
+    conn = None
+    while not job['stop_event'].is_set():
+        try:
+            if conn is None:
+                conn = ddl_replication_postgresql.source_db_connection(source_db)
+                conn.autocommit = True
+            retention = streaming_replication.slot_retention(conn)
+            level = streaming_replication.retention_level(retention)
+            job['slot'] = dict(retention or {}, level=level)
+            if level == 'warning':
+                logging.warning(f"Slot retains {retention['retained_wal_bytes']} bytes of WAL on {source_db}")
+            elif level == 'critical':
+                logging.error(f"Slot retains {retention['retained_wal_bytes']} bytes of WAL on {source_db} "
+                              f"(wal_status={retention['wal_status']}), forcing catch-up batching")
+                adaptive_batching.catch_up(job['batching'])
+                job['wakeup_event'].set()
+        except Exception as e:
+            logging.error(f"Error checking replication slot retention: {e}")
+            close_quietly(conn)
+            conn = None
+        job['stop_event'].wait(SLOT_MONITOR_INTERVAL)
+    close_quietly(conn)
+
+
+def continuous_dead_letter_retry(job, targets):
+    # Reprise en arrière-plan des changements en échec, sans bloquer le flux principal
+    while not job['stop_event'].is_set():
+        wait_if_paused(job)
+        for target_db, syst_dest in targets:
+            try:
+                applied, failed = dead_letter.retry_due(target_db, syst_dest)
+                if applied:
+                    record_progress(job, {'changes': applied})
+            except Exception as e:
+                logging.error(f"Error retrying dead-lettered changes for {target_db}: {e}")
+        job['stop_event'].wait(dead_letter.RETRY_POLL_INTERVAL)
+
+
+def continuous_streaming_replication_postgresql(job, source_db, target_db, syst_dest, with_initial_load=False):
+    if with_initial_load:
+        initial_load.initial_load_postgresql(source_db, target_db, syst_dest, publication_name=job['publication'],
+                                             filters=job['config'].get('filters'))
+
+    delay = 0
+    while not job['stop_event'].is_set():
+        wait_if_paused(job)
+        try:
+            streaming_replication.stream_changes(source_db, target_db, syst_dest, job['stop_event'], job['batching'],
+                                                 lambda stats: record_progress(job, stats), job['resume_event'],
+                                                 apply_mode=job['apply_mode'], publication_name=job['publication'])
+            delay = 0
+        except Exception as e:
+            # Reconnexion : le serveur renvoie tout ce qui suit le dernier LSN confirmé
+            record_error(job)
+            logging.error(f"Replication stream interrupted: {e}")
+            delay = adaptive_wait.next_delay(delay, error=True)
+            adaptive_wait.wait_for_wakeup(job['stop_event'], delay)
+
+
+def continuous_fanout_replication_postgresql(job, source_db, targets):
+    job['fanout'] = fanout.start_fanout(targets, pipeline_id=job['id'], apply_mode=job['apply_mode'],
+                                        publication_name=job['publication'])
+    delay = 0
+    try:
+        try:
+            fanout.check_positions(source_db, job['fanout'])
+        except ValueError as e:
+            # Une cible en retard sur le slot ne recevrait jamais les changements déjà libérés
+            record_error(job)
+            logging.error(f"Refusing to start fan-out: {e}")
+            job['stop_event'].set()
+            return
+        while not job['stop_event'].is_set():
+            wait_if_paused(job)
+            try:
+                replay = fanout.capture_stream(source_db, job['fanout'], job['stop_event'], job['resume_event'],
+                                               lambda stats: record_progress(job, stats))
+                # Un applier en échec fait relire le slot : on espace les reconnexions tant qu'il échoue
+                delay = adaptive_wait.next_delay(delay, error=True) if replay else 0
+            except Exception as e:
+                record_error(job)
+                logging.error(f"Fan-out stream interrupted: {e}")
+                delay = adaptive_wait.next_delay(delay, error=True)
+            adaptive_wait.wait_for_wakeup(job['stop_event'], delay)
+    finally:
+        # Les appliers vident leur file avant l'arrêt ; le slot reste à la position du plus lent
+        fanout.stop_fanout(job['fanout'])
+
+
+def continuous_capture_postgresql(job, source_db, target_db, syst_dest, log, with_initial_load=False):
+    if with_initial_load:
+        initial_load.initial_load_postgresql(source_db, target_db, syst_dest, publication_name=job['publication'],
+                                             filters=job['config'].get('filters'))
+
+    listen_conn = setup_postgresql_wakeup(source_db, adaptive_wait.DML_CHANNEL, job['publication'])
+    delay = 0
+    try:
+        while not job['stop_event'].is_set():
+            wait_if_paused(job)
+            try:
+                # Le slot est acquitté dès l'écriture dans le journal : la rétention WAL ne dépend plus de la cible
+                stats = dml_replication_postgresql.capture_to_log(source_db, log, publication_name=job['publication'])
+                record_progress(job, {'changes': 0, 'last_commit_ts': stats['last_commit_ts']})
+                if stats['changes']:
+                    job['log_appended'].set()
+                delay = adaptive_wait.next_delay(delay, busy=bool(stats['changes']))
+            except Exception as e:
+                record_error(job)
+                logging.error(f"Waiting for DML modifications to capture: {e}")
+                delay = adaptive_wait.next_delay(delay, error=True)
+            adaptive_wait.wait_for_wakeup(job['stop_event'], delay, listen_conn, job['wakeup_event'])
+    finally:
+        close_quietly(listen_conn)
+        job['log_appended'].set()
+        change_log.close_log(log)
+
+
+def continuous_capture_mysql(job, source_db, target_db, syst_dest, table_source, table_dest, log, with_initial_load=False):
+    dml_replication_mysql = drivers.dml_module('mysql')
+    position = {'log_file': None, 'log_pos': None}
+    if with_initial_load:
+        position['log_file'], position['log_pos'] = initial_load.initial_load_mysql(source_db, target_db, syst_dest, table_source, table_dest,
+                                                                                    filters=job['config'].get('filters'))
+
+    def on_progress(stats):
+        position.update(log_file=stats['log_file'], log_pos=stats['log_pos'])
+        record_progress(job, {'changes': 0, 'last_commit_ts': stats['last_commit_ts']})
+        if stats['changes']:
+            job['log_appended'].set()
+
+    delay = 0
+    try:
+        while not job['stop_event'].is_set():
+            wait_if_paused(job)
+            try:
+                if position['log_file'] is None:
+                    # Fixée une fois pour toutes : une reconnexion après erreur reprend au même point
+                    position['log_file'], position['log_pos'] = (change_log.last_position(log)
+                                                                 or dml_replication_mysql.current_binlog_position(source_db))
+                # Flux bloquant unique : ne rend la main qu'à l'arrêt, à la pause ou sur erreur
+                dml_replication_mysql.capture_to_log(source_db, binlog_tables(job, table_source), table_dest, log,
+                                                     position['log_file'], position['log_pos'], job['stop_event'],
+                                                     job['config'].get('filters'), blocking=True, on_progress=on_progress,
+                                                     resume_event=job['resume_event'])
+                delay = 0
+            except Exception as e:
+                record_error(job)
+                logging.error(f"Binlog capture interrupted: {e}")
+                delay = adaptive_wait.next_delay(delay, error=True)
+                adaptive_wait.wait_for_wakeup(job['stop_event'], delay)
+    finally:
+        job['log_appended'].set()
+        change_log.close_log(log)
+
+
+def continuous_log_apply(job, log, target_db, syst_dest, dml_module):
+    # Suit le journal depuis le curseur de la cible : un redémarrage ne relit pas la source
+    consumer = f"{syst_dest}_{target_db}"
+    offset = change_log.load_cursor(log, consumer)
+    delay = 0
+    while not job['stop_event'].is_set():
+        wait_if_paused(job)
+        try:
+            entries, next_offset = change_log.read(log, offset)
+            if entries:
+                applied = change_batches.apply_records([record for _, record in entries], target_db, syst_dest,
+                                                       dml_module.QUERY_BUILDERS, dml_module.target_db_connection,
+                                                       apply_mode=job['apply_mode'])
+                change_log.save_cursor(log, consumer, next_offset)
+                change_log.purge(log, next_offset)
+                record_progress(job, {'changes': applied})
+            offset = next_offset
+            delay = adaptive_wait.next_delay(delay, busy=bool(entries))
+        except Exception as e:
+            record_error(job)
+            logging.error(f"Waiting for logged changes to apply: {e}")
+            delay = adaptive_wait.next_delay(delay, error=True)
+        adaptive_wait.wait_for_wakeup(job['stop_event'], delay, wakeup_event=job['log_appended'])
+
+
+def continuous_ddl_replication_postgresql(job, source_db, target_db, syst_dest, table_dest):
+    listen_conn = setup_postgresql_wakeup(source_db, adaptive_wait.DDL_CHANNEL)
+    delay = 0
+    ddl_tags = []
+    try:
+        while not job['stop_event'].is_set():
+            wait_if_paused(job)
+            if any(metadata_cache.changes_catalog(tag) for tag in ddl_tags):
+                # Tables créées, supprimées ou renommées sur la source : ses listes en cache sont périmées
+                metadata_cache.invalidate('postgresql', source_db)
+            ddl_tags.clear()
+            try:
+                with profiling.timed('ddl_connect'):
+                    source_conn = ddl_replication_postgresql.source_db_connection(source_db)
+                    target_conn = ddl_replication_postgresql.target_db_connection(target_db, syst_dest)
+
+                with profiling.timed('ddl_apply'):
+                    applied = ddl_replication_postgresql.replicate_alter_table_add(source_conn, target_conn, table_dest)
+                    applied += ddl_replication_postgresql.replicate_alter_table_drop(source_conn, target_conn, table_dest)
+                    applied += ddl_replication_postgresql.replicate_alter_table_modify(source_conn, target_conn, table_dest, syst_dest)
+                if applied:
+                    metadata_cache.invalidate(syst_dest, target_db)
+
+                source_conn.close()
+                target_conn.close()
+                delay = adaptive_wait.next_delay(delay, busy=bool(applied), min_delay=DDL_MIN_DELAY, max_delay=DDL_MAX_DELAY)
+            except Exception as e:
+                record_error(job)
+                logging.error(f"Waiting for DDL modifications to replicate: {e}")
+                delay = adaptive_wait.next_delay(delay, error=True)
+            adaptive_wait.wait_for_wakeup(job['stop_event'], delay, listen_conn, notifications=ddl_tags)
+    finally:
+        close_quietly(listen_conn)
+
+
+def continuous_dml_replication_mysql(job, source_db, target_db, syst_dest, table_source, table_dest, with_initial_load=False):
+    dml_replication_mysql = drivers.dml_module('mysql')
+    position = {'log_file': None, 'log_pos': None}
+    if with_initial_load:
+        position['log_file'], position['log_pos'] = initial_load.initial_load_mysql(source_db, target_db, syst_dest, table_source, table_dest,
+                                                                                    filters=job['config'].get('filters'))
+
+    def on_progress(stats):
+        position.update(log_file=stats['log_file'], log_pos=stats['log_pos'])
+        record_progress(job, stats)
+
+    delay = 0
+    while not job['stop_event'].is_set():
+        wait_if_paused(job)
+        try:
+            if position['log_file'] is None:
+                # Fixée une fois pour toutes : une reconnexion après erreur reprend au même point
+                position['log_file'], position['log_pos'] = dml_replication_mysql.current_binlog_position(source_db)
+            # Flux bloquant unique : les changements sont appliqués dès leur arrivée,
+            # main ne rend la main qu'à l'arrêt, à la pause ou sur erreur
+            dml_replication_mysql.main(source_db, target_db, syst_dest, binlog_tables(job, table_source), table_dest,
+                                       position['log_file'], position['log_pos'], job['stop_event'], batching=job['batching'],
+                                       apply_mode=job['apply_mode'], filters=job['config'].get('filters'),
+                                       parallel=job['config'].get('parallel_apply'), blocking=True, on_progress=on_progress,
+                                       resume_event=job['resume_event'])
+            delay = 0
+        except Exception as e:
+            record_error(job)
+            logging.error(f"Binlog stream interrupted: {e}")
+            delay = adaptive_wait.next_delay(delay, error=True)
+            adaptive_wait.wait_for_wakeup(job['stop_event'], delay)
+
+
+def continuous_ddl_replication_mysql(job, source_db, target_db, syst_dest, table_dest):
+    ddl_replication_mysql = drivers.ddl_module('mysql')
+    delay = 0
+    while not job['stop_event'].is_set():
+        wait_if_paused(job)
+        try:
+            with profiling.timed('ddl_connect'):
+                source_conn = ddl_replication_mysql.source_db_connection(source_db)
+                target_conn = ddl_replication_mysql.target_db_connection(target_db, syst_dest)
+
+            with profiling.timed('ddl_apply'):
+                applied = ddl_replication_mysql.replicate_alter_table_add(source_conn, target_conn, table_dest, target_db, source_db, syst_dest)
+                applied += ddl_replication_mysql.replicate_alter_table_drop(source_conn, target_conn, table_dest, target_db, source_db, syst_dest)
+                applied += ddl_replication_mysql.replicate_alter_table_modify(source_conn, target_conn, table_dest, target_db, syst_dest, source_db)
+            if applied:
+                metadata_cache.invalidate(syst_dest, target_db)
+
+            source_conn.close()
+            target_conn.close()
+            delay = adaptive_wait.next_delay(delay, busy=bool(applied), min_delay=DDL_MIN_DELAY, max_delay=DDL_MAX_DELAY)
+        except Exception as e:
+            record_error(job)
+            logging.error(f"Waiting for DDL modifications to replicate: {e}")
+            delay = adaptive_wait.next_delay(delay, error=True)
+        adaptive_wait.wait_for_wakeup(job['stop_event'], delay)
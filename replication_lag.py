@@ -0,0 +1,119 @@
+import bisect
+import collections
+import threading
+import logging
+
+import profiling
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Table écrite périodiquement sur la source : le retard reste mesurable sans trafic
+HEARTBEAT_TABLE = "replication_heartbeat"
+HEARTBEAT_INTERVAL = 5
+
+# Bornes supérieures (secondes) des classes de l'histogramme de retard par transaction
+LAG_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 300)
+LAG_HISTORY_SIZE = 3600
+
+_pipelines = {}
+_lock = threading.Lock()
+
+
+def pipeline_state(pipeline_id):
+    state = _pipelines.get(pipeline_id)
+    if state is None:
+        state = {'tables': {}, 'history': collections.deque(maxlen=LAG_HISTORY_SIZE)}
+        _pipelines[pipeline_id] = state
+    return state
+
+
+def observe(table, commit_times, applied_at, pipeline_id=None):
+    # Une observation par transaction : commit source -> application sur la cible
+    if not commit_times:
+        return
+    pipeline_id = pipeline_id if pipeline_id is not None else profiling.current_pipeline()
+    with _lock:
+        state = pipeline_state(pipeline_id)
+        table_lag = state['tables'].setdefault(table, {'lag_seconds': None, 'last_commit_ts': None, 'last_applied_at': None,
+                                                       'transactions': 0, 'buckets': [0] * (len(LAG_BUCKETS) + 1)})
+        for commit_ts in commit_times:
+            lag = max(0.0, applied_at - commit_ts)
+            table_lag['buckets'][bisect.bisect_left(LAG_BUCKETS, lag)] += 1
+            table_lag['transactions'] += 1
+        latest = max(commit_times)
+        table_lag['lag_seconds'] = max(0.0, applied_at - latest)
+        table_lag['last_commit_ts'] = latest
+        table_lag['last_applied_at'] = applied_at
+        state['history'].append((applied_at, table, table_lag['lag_seconds']))
+
+
+def observe_records(table, records, applied_at):
+    # Les enregistrements d'une même transaction partagent le même commit_ts
+    observe(table, {record.commit_ts for record in records if record.commit_ts is not None}, applied_at)
+
+
+def split_heartbeats(records):
+    heartbeats = [record for record in records if record.relation.name == HEARTBEAT_TABLE]
+    if not heartbeats:
+        return records, []
+    return [record for record in records if record.relation.name != HEARTBEAT_TABLE], heartbeats
+
+
+def lag_snapshot(pipeline_id):
+    with _lock:
+        state = _pipelines.get(pipeline_id)
+        if state is None:
+            return {'max_lag_seconds': None, 'tables': {}}
+        tables = {}
+        for table, table_lag in state['tables'].items():
+            labels = [f"le_{bound}" for bound in LAG_BUCKETS] + ['le_inf']
+            tables[table] = {
+                'lag_seconds': round(table_lag['lag_seconds'], 3),
+                'last_commit_ts': table_lag['last_commit_ts'],
+                'last_applied_at': table_lag['last_applied_at'],
+                'transactions': table_lag['transactions'],
+                'histogram': dict(zip(labels, table_lag['buckets'])),
+            }
+    lags = [table_lag['lag_seconds'] for table_lag in tables.values()]
+    return {'max_lag_seconds': max(lags) if lags else None, 'tables': tables}
+
+
+def lag_history(pipeline_id, since=None):
+    with _lock:
+        state = _pipelines.get(pipeline_id)
+        history = list(state['history']) if state else []
+    return [{'applied_at': applied_at, 'table': table, 'lag_seconds': round(lag, 3)}
+            for applied_at, table, lag in history if since is None or applied_at >= since]
+
+
+def ensure_heartbeat_postgresql(conn, publication_name):
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {HEARTBEAT_TABLE} (id integer PRIMARY KEY, ts timestamptz NOT NULL)")
+        cur.execute("SELECT puballtables FROM pg_publication WHERE pubname = %s", (publication_name,))
+        row = cur.fetchone()
+        cur.execute("SELECT 1 FROM pg_publication_tables WHERE pubname = %s AND tablename = %s", (publication_name, HEARTBEAT_TABLE))
+        if row and not row[0] and not cur.fetchone():
+            cur.execute(f"ALTER PUBLICATION {publication_name} ADD TABLE {HEARTBEAT_TABLE}")
+    conn.commit()
+
+
+def ensure_heartbeat_mysql(conn):
+    cur = conn.cursor()
+    try:
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {HEARTBEAT_TABLE} (id INT PRIMARY KEY, ts DATETIME(6) NOT NULL)")
+    finally:
+        cur.close()
+    conn.commit()
+
+
+def write_heartbeat(conn, syst_source):
+    cur = conn.cursor()
+    try:
+        if syst_source == 'postgresql':
+            cur.execute(f"INSERT INTO {HEARTBEAT_TABLE} (id, ts) VALUES (1, now()) ON CONFLICT (id) DO UPDATE SET ts = EXCLUDED.ts")
+        else:
+            cur.execute(f"INSERT INTO {HEARTBEAT_TABLE} (id, ts) VALUES (1, NOW(6)) ON DUPLICATE KEY UPDATE ts = VALUES(ts)")
+    finally:
+        cur.close()
+    conn.commit()
@@ -0,0 +1,194 @@
+import argparse
+import atexit
+import json
+import multiprocessing
+import queue
+import signal
+import threading
+import uuid
+import logging
+
+import replication_jobs
+import drivers
+import change_feed
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+STATUS_INTERVAL = 1
+STOP_TIMEOUT = 60
+
+# spawn : le processus Flask a déjà des threads, un fork n'est pas sûr
+_context = multiprocessing.get_context('spawn')
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def run_pipeline(config, with_initial_load, stop_event, pause_event, status_queue):
+    # Point d'entrée du processus fils : chaque pipeline a son propre GIL.
+    # Ctrl-C atteint tout le groupe de processus : seul le parent l'interprète, puis arrête les fils par stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    job, _ = replication_jobs.start_job(config, with_initial_load)
+    while not stop_event.wait(STATUS_INTERVAL):
+        if pause_event.is_set():
+            replication_jobs.pause_job(job)
+        else:
+            replication_jobs.resume_job(job)
+        status_queue.put(replication_jobs.job_status(job))
+        if not replication_jobs.is_alive(job):
+            break
+    replication_jobs.stop_job(job)
+    status_queue.put(replication_jobs.job_status(job))
+
+
+def collect_status(job):
+    # Vide la file en continu pour que le fils ne bufferise pas indéfiniment
+    while job['process'].is_alive() or not job['status_queue'].empty():
+        try:
+            status = job['status_queue'].get(timeout=STATUS_INTERVAL)
+        except queue.Empty:
+            continue
+        previous, job['last_status'] = job['last_status'], status
+        forward_progress(job, previous, status)
+
+
+def forward_progress(job, previous, status):
+    # Le fils publie dans son propre processus, sans abonné : ses changements appliqués sont republiés ici,
+    # regroupés par intervalle de statut
+    changes_applied = status.get('changes_applied') or 0
+    changes = changes_applied - ((previous or {}).get('changes_applied') or 0)
+    if changes > 0:
+        change_feed.publish('changes', {'pipeline': job['id'], 'changes': changes, 'changes_applied': changes_applied,
+                                        'last_commit_ts': status.get('last_commit_ts'), 'applied_at': status.get('last_applied_at')},
+                            job['id'])
+
+
+def process_alive(job):
+    # exitcode reste None tant que le processus n'est pas terminé
+    return job['process'].exitcode is None
+
+
+def start_job(config, with_initial_load=False):
+    # Même registre que les jobs en threads : un pipeline ne tourne jamais dans les deux modes à la fois
+    key = replication_jobs.pipeline_key(config)
+    job, created = replication_jobs.claim_pipeline(key, lambda: create_job(key, config, with_initial_load), process_alive)
+    if not created:
+        logging.info(f"Job {job['id']} already running for pipeline {key}")
+        return job, False
+    threading.Thread(target=collect_status, args=(job,), daemon=True).start()
+    logging.info(f"Started pipeline process {job['process'].pid} for pipeline {key}")
+    return job, True
+
+
+def create_job(key, config, with_initial_load=False):
+    with _jobs_lock:
+        job = {
+            'id': uuid.uuid4().hex,
+            'key': key,
+            'config': config,
+            'stop_event': _context.Event(),
+            'pause_event': _context.Event(),
+            'status_queue': _context.Queue(),
+            'last_status': None,
+        }
+        job['process'] = _context.Process(
+            target=run_pipeline,
+            args=(config, with_initial_load, job['stop_event'], job['pause_event'], job['status_queue']),
+            name=f"pipeline-{job['id'][:8]}",
+            daemon=False
+        )
+        _jobs[key] = job
+        # Le fils configure ses propres connexions ; le parent en a besoin pour les vérifications et requêtes lancées depuis le site
+        drivers.configure_pipeline(job['id'], config.get('connections'))
+
+    job['process'].start()
+    return job
+
+
+def get_job(job_id):
+    with _jobs_lock:
+        for job in _jobs.values():
+            if job['id'] == job_id:
+                return job
+    return None
+
+
+def list_jobs():
+    with _jobs_lock:
+        return list(_jobs.values())
+
+
+def stop_job(job, timeout=STOP_TIMEOUT):
+    job['stop_event'].set()
+    job['process'].join(timeout)
+    if job['process'].is_alive():
+        logging.error(f"Pipeline process {job['process'].pid} did not stop in {timeout}s, terminating")
+        job['process'].terminate()
+        job['process'].join()
+    drivers.release_pipeline(job['id'])
+    return job
+
+
+def pause_job(job):
+    job['pause_event'].set()
+    return job
+
+
+def resume_job(job):
+    job['pause_event'].clear()
+    return job
+
+
+def stop_all_jobs():
+    for job in list_jobs():
+        if job['process'].is_alive():
+            stop_job(job)
+
+
+# Avant la jointure des fils non démons par multiprocessing, qui attendrait sinon indéfiniment
+atexit.register(stop_all_jobs)
+
+
+def job_status(job):
+    status = dict(job['last_status'] or {'pipeline': {key: value for key, value in job['config'].items() if key != 'connections'},
+                                         'state': 'starting'})
+    status['id'] = job['id']
+    status['pid'] = job['process'].pid
+    status['runner'] = 'process'
+    if not job['process'].is_alive():
+        status['state'] = 'stopped' if job['stop_event'].is_set() else 'failed'
+    return status
+
+
+def load_pipelines(config_path):
+    with open(config_path) as config_file:
+        return json.load(config_file).get('pipelines', [])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run replication pipelines in dedicated worker processes")
+    parser.add_argument('--config', required=True, help="JSON file with a 'pipelines' list")
+    args = parser.parse_args()
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+
+    for pipeline in load_pipelines(args.config):
+        pipeline = dict(pipeline)
+        with_initial_load = pipeline.pop('initial_load', False)
+        start_job(pipeline, with_initial_load)
+
+    try:
+        while not stopping.wait(STATUS_INTERVAL * 10):
+            for job in list_jobs():
+                logging.info(f"Pipeline status: {json.dumps(job_status(job), default=str)}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_all_jobs()
+        logging.info("All pipeline processes stopped")
+
+
+if __name__ == "__main__":
+    main()
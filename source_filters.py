@@ -0,0 +1,95 @@
+import hashlib
+import json
+import re
+import logging
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_PUBLICATION = "test_pub"
+PUBLICATION_PREFIX = "repl_pub_"
+
+IDENTIFIER_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_$]*(\.[A-Za-z_][A-Za-z0-9_$]*)?$')
+# Le prédicat est inséré tel quel dans CREATE PUBLICATION et dans la copie initiale : une seule expression
+FORBIDDEN_WHERE_TOKENS = (';', '--', '/*', '*/')
+
+# Filtres d'un pipeline :
+# {'tables': {'orders': {'columns': ['id', 'amount'], 'where': "status <> 'draft'"}, 'customers': {}},
+#  'schemas': [...], 'ignored_schemas': [...], 'ignored_tables': [...]}
+
+
+def validate_filters(filters):
+    # Les noms et prédicats sont interpolés dans le SQL : refusés plutôt qu'échappés
+    for table_name, table_filter in ((filters or {}).get('tables') or {}).items():
+        table_filter = table_filter or {}
+        for name in [table_name] + list(table_filter.get('columns') or []):
+            if not IDENTIFIER_PATTERN.match(name):
+                raise ValueError(f"Invalid identifier in filters: {name!r}")
+        row_filter = table_filter.get('where')
+        if row_filter is not None:
+            if not isinstance(row_filter, str) or any(token in row_filter for token in FORBIDDEN_WHERE_TOKENS):
+                raise ValueError(f"Invalid row filter for {table_name}: {row_filter!r}")
+            if row_filter.count('(') != row_filter.count(')'):
+                raise ValueError(f"Unbalanced parentheses in row filter for {table_name}")
+    return filters
+
+
+def publication_name(filters):
+    # Sans liste de tables, la publication commune reste utilisée ; sinon une publication par jeu de filtres
+    if not filters or not filters.get('tables'):
+        return DEFAULT_PUBLICATION
+    digest = hashlib.sha1(json.dumps(filters['tables'], sort_keys=True).encode()).hexdigest()[:12]
+    return f"{PUBLICATION_PREFIX}{digest}"
+
+
+def publication_table_clause(table_name, table_filter):
+    # Liste de colonnes et filtre de lignes (PostgreSQL 15+) : évalués par le walsender, avant l'envoi
+    clause = table_name
+    if table_filter.get('columns'):
+        clause += f" ({', '.join(table_filter['columns'])})"
+    if table_filter.get('where'):
+        clause += f" WHERE ({table_filter['where']})"
+    return clause
+
+
+def ensure_publication(conn, filters):
+    # Le nom dérive des filtres : une publication existante porte déjà ces tables (plus le heartbeat éventuel)
+    validate_filters(filters)
+    name = publication_name(filters)
+    if name == DEFAULT_PUBLICATION:
+        return name
+    tables = filters['tables']
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_publication WHERE pubname = %s", (name,))
+        if cur.fetchone():
+            return name
+        clauses = ', '.join(publication_table_clause(table_name, table_filter or {}) for table_name, table_filter in sorted(tables.items()))
+        cur.execute(f"CREATE PUBLICATION {name} FOR TABLE {clauses}")
+    conn.commit()
+    logging.info(f"Created publication {name} for {', '.join(sorted(tables))}")
+    return name
+
+
+def binlog_filters(filters, only_tables=None):
+    # Filtres du BinLogStreamReader : les événements des tables écartées ne sont pas décodés
+    filters = filters or {}
+    if only_tables is None and filters.get('tables'):
+        only_tables = list(filters['tables'])
+    return {
+        'only_tables': [only_tables] if isinstance(only_tables, str) else only_tables,
+        'only_schemas': filters.get('schemas'),
+        'ignored_tables': filters.get('ignored_tables'),
+        'ignored_schemas': filters.get('ignored_schemas'),
+    }
+
+
+def table_filter(filters, table_name):
+    return ((filters or {}).get('tables') or {}).get(table_name) or {}
+
+
+def table_columns(filters, table_name):
+    return table_filter(filters, table_name).get('columns')
+
+
+def table_row_filter(filters, table_name):
+    return table_filter(filters, table_name).get('where')
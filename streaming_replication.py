@@ -0,0 +1,131 @@
+import select
+import time
+import logging
+
+import psycopg2
+from psycopg2.extras import LogicalReplicationConnection
+
+import dml_replication_postgresql
+import change_batches
+import adaptive_batching
+import profiling
+import drivers
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SLOT_NAME = "user_slot"
+PUBLICATION_NAME = "test_pub"
+# Intervalle d'envoi du statut au serveur ; psycopg2 répond aussi aux keepalives avec la dernière position connue
+FEEDBACK_INTERVAL = 10
+READ_TIMEOUT = 1
+
+# Seuils de WAL retenu par le slot : alerte, puis rattrapage forcé avant que le disque source ne sature
+WAL_RETAINED_WARN_BYTES = 1024 * 1024 * 1024
+WAL_RETAINED_CRITICAL_BYTES = 4 * 1024 * 1024 * 1024
+
+
+def slot_retention(conn, slot_name=SLOT_NAME):
+    # WAL conservé par le slot (depuis restart_lsn) et retard de confirmation (depuis confirmed_flush_lsn)
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), restart_lsn),
+                   pg_wal_lsn_diff(pg_current_wal_lsn(), confirmed_flush_lsn),
+                   confirmed_flush_lsn::text, wal_status, safe_wal_size, active
+            FROM pg_replication_slots WHERE slot_name = %s
+            """, (slot_name,))
+        row = cur.fetchone()
+    if row is None:
+        return None
+    retained, unconfirmed, confirmed_flush_lsn, wal_status, safe_wal_size, active = row
+    return {
+        'slot_name': slot_name,
+        'retained_wal_bytes': int(retained or 0),
+        'unconfirmed_wal_bytes': int(unconfirmed or 0),
+        'confirmed_flush_lsn': confirmed_flush_lsn,
+        'wal_status': wal_status,
+        'safe_wal_size': int(safe_wal_size) if safe_wal_size is not None else None,
+        'active': active,
+        'checked_at': time.time(),
+    }
+
+
+def retention_level(retention):
+    if retention is None:
+        return 'unknown'
+    # safe_wal_size : marge avant que le serveur n'invalide le slot (max_slot_wal_keep_size)
+    if retention['retained_wal_bytes'] >= WAL_RETAINED_CRITICAL_BYTES or retention['wal_status'] in ('unreserved', 'lost') \
+            or (retention['safe_wal_size'] is not None and retention['safe_wal_size'] < WAL_RETAINED_WARN_BYTES):
+        return 'critical'
+    if retention['retained_wal_bytes'] >= WAL_RETAINED_WARN_BYTES or retention['wal_status'] == 'extended':
+        return 'warning'
+    return 'ok'
+
+
+def stream_changes(source_db, target_db, syst_dest, stop_event, batching=None, on_progress=None, resume_event=None,
+                   slot_name=SLOT_NAME, apply_mode='insert', publication_name=PUBLICATION_NAME):
+    # Consommation en flux du slot : le serveur n'est acquitté qu'avec le LSN effectivement validé sur la cible
+    conn_params = drivers.connection_params('postgresql', source_db)
+    replication_conn = psycopg2.connect(connection_factory=LogicalReplicationConnection, **conn_params)
+    # Connexion SQL séparée : le catalogue n'est pas interrogeable sur la connexion de réplication
+    types_conn = psycopg2.connect(**conn_params)
+    types_conn.autocommit = True
+    cur = replication_conn.cursor()
+    transaction, pending, pending_lsn = [], [], None
+    # Le serveur n'envoie chaque RELATION qu'une fois par session : la carte vit aussi longtemps que le flux
+    relations = {}
+    pending_since = None
+    try:
+        cur.start_replication(slot_name=slot_name, decode=False, status_interval=FEEDBACK_INTERVAL,
+                              options={'proto_version': '1', 'publication_names': publication_name})
+        logging.info(f"Streaming changes from slot {slot_name} of {source_db}")
+
+        def flush():
+            started = time.time()
+            records = [record for _, record in pending]
+            applied = change_batches.apply_records(records, target_db, syst_dest, dml_replication_postgresql.QUERY_BUILDERS,
+                                                   dml_replication_postgresql.target_db_connection,
+                                                   max_rows=adaptive_batching.batch_rows(batching, change_batches.BATCH_MAX_ROWS),
+                                                   apply_mode=apply_mode)
+            commit_ts = max((record.commit_ts for record in records if record.commit_ts is not None), default=None)
+            adaptive_batching.observe(batching, len(records), 0, time.time() - started, False,
+                                      time.time() - commit_ts if commit_ts is not None else None)
+            # Seul ce qui est validé sur la cible est confirmé au serveur
+            cur.send_feedback(write_lsn=pending_lsn, flush_lsn=pending_lsn, apply_lsn=pending_lsn)
+            if on_progress:
+                on_progress({'changes': applied, 'last_commit_ts': commit_ts, 'last_lsn': pending_lsn})
+
+        # En pause, on rend la main : la connexion fermée, le slot reprendra au dernier LSN confirmé
+        while not stop_event.is_set() and (resume_event is None or resume_event.is_set()):
+            with profiling.timed('fetch'):
+                message = cur.read_message()
+            if message is None:
+                if pending and time.time() - pending_since >= adaptive_batching.flush_interval(batching):
+                    flush()
+                    pending, pending_since = [], None
+                elif not pending and not transaction and cur.wal_end:
+                    # Rien en attente : le WAL sans rapport avec la publication peut être libéré
+                    cur.send_feedback(flush_lsn=cur.wal_end)
+                select.select([cur], [], [], READ_TIMEOUT)
+                continue
+
+            transaction.append((message.data_start, None, message.payload))
+            if message.payload[:1] != b'C':
+                continue
+            with profiling.timed('decode'):
+                decoded_changes, stats = dml_replication_postgresql.decode_changes(types_conn, transaction, relations=relations)
+            transaction = []
+            pending.extend(decoded_changes)
+            pending_lsn = stats['last_lsn']
+            pending_since = pending_since or time.time()
+            if len(pending) >= adaptive_batching.batch_rows(batching, change_batches.BATCH_MAX_ROWS):
+                flush()
+                pending, pending_since = [], None
+
+        if pending:
+            flush()
+    finally:
+        cur.close()
+        replication_conn.close()
+        types_conn.close()
+        logging.info(f"Stopped streaming from slot {slot_name}")
@@ -0,0 +1,35 @@
+import adaptive_batching
+
+
+def test_grows_while_behind_and_shrinks_when_caught_up():
+    controller = adaptive_batching.new_controller(min_rows=100, max_rows=1000)
+    assert adaptive_batching.observe(controller, 100, 0, 0.1, backlog=True) == 200
+    assert adaptive_batching.observe(controller, 200, 0, 0.1, backlog=False, lag=5.0) == 400
+    assert adaptive_batching.observe(controller, 50, 0, 0.1, backlog=False) == 200
+
+
+def test_slow_batch_halves_the_size_within_bounds():
+    controller = adaptive_batching.new_controller(min_rows=100, max_rows=1000)
+    controller['batch_rows'] = 150
+    assert adaptive_batching.observe(controller, 150, 0, 60.0, backlog=True) == 100
+
+
+def test_row_size_caps_the_batch_to_the_memory_budget():
+    controller = adaptive_batching.new_controller(min_rows=10, max_rows=100000, max_bytes=10000)
+    adaptive_batching.observe(controller, 10, 1000, 0.1, backlog=True)
+    assert controller['row_bytes'] == 100
+    assert adaptive_batching.observe(controller, 10, 1000, 0.1, backlog=True) <= 100
+
+
+def test_flush_interval_follows_batch_size():
+    controller = adaptive_batching.new_controller(min_rows=100, max_rows=1000)
+    assert adaptive_batching.flush_interval(controller) == adaptive_batching.MIN_FLUSH_INTERVAL
+    adaptive_batching.catch_up(controller)
+    assert controller['batch_rows'] == 1000
+    assert adaptive_batching.flush_interval(controller) == adaptive_batching.MAX_FLUSH_INTERVAL
+
+
+def test_without_controller_defaults_apply():
+    assert adaptive_batching.batch_rows(None, 42) == 42
+    assert adaptive_batching.observe(None, 10, 0, 0.1, backlog=True) == adaptive_batching.MIN_BATCH_ROWS
+    assert adaptive_batching.controller_status(None) is None
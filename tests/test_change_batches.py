@@ -0,0 +1,81 @@
+from change_records import ChangeRecord, RelationDescriptor, UNCHANGED_TOAST
+import change_batches
+
+
+def test_copy_values_are_encoded_by_type():
+    assert change_batches.format_copy_value(None) == '\\N'
+    # bytea en hexadécimal, backslash échappé pour le format texte de COPY
+    assert change_batches.format_copy_value(b'\x00\xff') == '\\\\x00ff'
+    assert change_batches.format_copy_value(memoryview(b'\x01')) == '\\\\x01'
+    assert change_batches.format_copy_value({'a': [1, None]}) == '{"a": [1, null]}'
+    assert change_batches.format_copy_value('a\tb\nc\\') == 'a\\tb\\nc\\\\'
+
+
+ACCOUNTS = RelationDescriptor(1, 'public', 'accounts', ['id', 'owner', 'balance'], key_positions=(0,))
+TAGS = RelationDescriptor(2, 'public', 'tags', ['id'], key_positions=(0,))
+EVENTS = RelationDescriptor(3, 'public', 'events', ['payload'])
+
+
+class RecordingCursor:
+    # Enregistre les requêtes au lieu de les exécuter
+    def __init__(self, statements):
+        self.statements = statements
+
+    def execute(self, query, params=None):
+        self.statements.append((query, params))
+
+    def executemany(self, query, rows):
+        self.statements.append((query, list(rows)))
+
+    def close(self):
+        pass
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.statements = []
+
+    def cursor(self):
+        return RecordingCursor(self.statements)
+
+
+def test_postgresql_upsert_updates_non_key_columns_on_conflict():
+    assert change_batches.upsert_statement(ACCOUNTS, 'postgresql') == (
+        "INSERT INTO accounts (id, owner, balance) VALUES %s "
+        "ON CONFLICT (id) DO UPDATE SET owner = EXCLUDED.owner, balance = EXCLUDED.balance")
+    # Que des colonnes de clé : rien à mettre à jour
+    assert change_batches.upsert_statement(TAGS, 'postgresql') == "INSERT INTO tags (id) VALUES %s ON CONFLICT (id) DO NOTHING"
+
+
+def test_mysql_upsert_uses_on_duplicate_key_update():
+    assert change_batches.upsert_statement(ACCOUNTS, 'mysql') == (
+        "INSERT INTO accounts (id, owner, balance) VALUES (%s, %s, %s) "
+        "ON DUPLICATE KEY UPDATE owner = VALUES(owner), balance = VALUES(balance)")
+    assert change_batches.upsert_statement(TAGS, 'mysql') == "INSERT INTO tags (id) VALUES (%s) ON DUPLICATE KEY UPDATE id = VALUES(id)"
+
+
+def test_redshift_upsert_deletes_then_inserts_the_latest_rows():
+    assert change_batches.upsert_statement(ACCOUNTS, 'redshift') is None
+    batch = change_batches.ColumnarBatch(ACCOUNTS, 'I', [
+        ChangeRecord('I', ACCOUNTS, (1, 'ann', 10)),
+        ChangeRecord('I', ACCOUNTS, (2, 'bob', 20)),
+        ChangeRecord('I', ACCOUNTS, (1, 'ann', 15)),
+    ])
+    conn = RecordingConnection()
+    change_batches.upsert_sink(conn, batch, 'redshift')
+    assert conn.statements == [
+        ("DELETE FROM accounts WHERE (id) IN ((%s), (%s))", [1, 2]),
+        ("INSERT INTO accounts (id, owner, balance) VALUES (%s, %s, %s)", [(1, 'ann', 15), (2, 'bob', 20)]),
+    ]
+
+
+def test_upsertable_requires_a_full_row_with_an_unchanged_key():
+    assert change_batches.upsertable(ChangeRecord('I', ACCOUNTS, (1, 'ann', 10)))
+    assert change_batches.upsertable(ChangeRecord('U', ACCOUNTS, (1, 'ann', 15), (1, UNCHANGED_TOAST, UNCHANGED_TOAST)))
+    # Changement de clé : l'upsert laisserait l'ancienne ligne en place
+    assert not change_batches.upsertable(ChangeRecord('U', ACCOUNTS, (2, 'ann', 15), (1, UNCHANGED_TOAST, UNCHANGED_TOAST)))
+    # TOAST inchangé : la ligne n'est pas complète
+    assert not change_batches.upsertable(ChangeRecord('U', ACCOUNTS, (1, UNCHANGED_TOAST, 15)))
+    # Sans clé, rien n'identifie la ligne à remplacer
+    assert not change_batches.upsertable(ChangeRecord('I', EVENTS, ('click',)))
+    assert not change_batches.upsertable(ChangeRecord('D', ACCOUNTS, None, (1, 'ann', 15)))
@@ -0,0 +1,50 @@
+import pytest
+
+import change_feed
+
+
+@pytest.fixture
+def subscribe():
+    subscribers = []
+
+    def subscribe(pipeline=None):
+        subscriber = change_feed.subscribe(pipeline)
+        subscribers.append(subscriber)
+        return subscriber
+
+    yield subscribe
+    for subscriber in subscribers:
+        change_feed.unsubscribe(subscriber)
+
+
+def drain(subscriber):
+    events = []
+    while not subscriber['queue'].empty():
+        events.append(subscriber['queue'].get_nowait())
+    return events
+
+
+def test_publish_without_subscriber_is_a_no_op():
+    change_feed.publish('changes', {'changes': 1})
+    assert change_feed.subscriber_count() == 0
+
+
+def test_pipeline_subscribers_only_get_their_pipeline(subscribe):
+    everything, only_a = subscribe(), subscribe('a')
+    change_feed.publish('changes', {'changes': 1}, 'a')
+    change_feed.publish('changes', {'changes': 2}, 'b')
+    assert [data['changes'] for _, _, data in drain(everything)] == [1, 2]
+    assert [data['changes'] for _, _, data in drain(only_a)] == [1]
+
+
+def test_slow_subscriber_is_dropped_instead_of_blocking(subscribe, monkeypatch):
+    monkeypatch.setattr(change_feed, 'CLIENT_BUFFER_SIZE', 2)
+    slow = subscribe()
+    for changes in range(3):
+        change_feed.publish('changes', {'changes': changes})
+    assert slow['dropped'].is_set()
+    assert change_feed.subscriber_count() == 0
+
+
+def test_format_event_is_server_sent_events():
+    assert change_feed.format_event(7, 'changes', {'changes': 1}) == 'id: 7\nevent: changes\ndata: {"changes": 1}\n\n'
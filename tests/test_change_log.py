@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+from change_records import ChangeRecord, RelationDescriptor
+import change_log
+
+
+USERS = RelationDescriptor(1, 'public', 'users', ['id', 'name'], ['int4', 'text'], (0,))
+
+
+@pytest.fixture
+def log(tmp_path, monkeypatch):
+    monkeypatch.setattr(change_log, 'CHANGE_LOG_DIR', str(tmp_path))
+    log = change_log.open_log('test')
+    yield log
+    change_log.close_log(log)
+
+
+def entries(count, start=0):
+    return [(position, ChangeRecord('I', USERS, (position, f"user {position}"), commit_ts=1.0))
+            for position in range(start, start + count)]
+
+
+def test_append_then_read_round_trip(log):
+    end = change_log.append(log, entries(3))
+    read, offset = change_log.read(log, 0)
+    assert offset == end
+    assert [position for position, _ in read] == [0, 1, 2]
+    assert read[2][1].values == (2, 'user 2')
+    # Un seul descripteur par relation relue
+    assert read[0][1].relation is read[1][1].relation
+
+
+def test_read_resumes_from_offset_and_respects_max_entries(log):
+    change_log.append(log, entries(5))
+    first, offset = change_log.read(log, 0, max_entries=2)
+    rest, _ = change_log.read(log, offset)
+    assert [position for position, _ in first + rest] == [0, 1, 2, 3, 4]
+
+
+def test_read_never_splits_a_source_transaction(log, monkeypatch):
+    # Même position : entrées d'une même transaction, relues ensemble même à cheval sur deux segments
+    monkeypatch.setattr(change_log, 'SEGMENT_MAX_SIZE', 1)
+    change_log.append(log, [(7, record) for _, record in entries(3)] + entries(1, start=8))
+    first, offset = change_log.read(log, 0, max_entries=2)
+    rest, _ = change_log.read(log, offset)
+    assert [position for position, _ in first] == [7, 7, 7]
+    assert [position for position, _ in rest] == [8]
+
+
+def test_segments_roll_and_purge_keeps_retention(log, monkeypatch):
+    monkeypatch.setattr(change_log, 'SEGMENT_MAX_SIZE', 1)
+    end = change_log.append(log, entries(4))
+    assert len(log['segments']) == 4
+    read, _ = change_log.read(log, 0)
+    assert len(read) == 4
+    assert change_log.purge(log, end, keep_segments=1) == 2
+    assert len(log['segments']) == 2
+
+
+def test_torn_tail_is_truncated_on_reopen(log):
+    change_log.append(log, entries(2))
+    path = change_log.segment_path(log, log['segments'][-1])
+    change_log.close_log(log)
+    with open(path, 'ab') as segment:
+        segment.write(b'\x00\x00\x01\x00partial')
+    reopened = change_log.open_log('test')
+    try:
+        read, _ = change_log.read(reopened, 0)
+        assert [position for position, _ in read] == [0, 1]
+        assert os.path.getsize(path) == reopened['size']
+    finally:
+        change_log.close_log(reopened)
+    log['active'] = open(path, 'ab')
+
+
+def test_last_position_and_cursors(log):
+    assert change_log.last_position(log) is None
+    end = change_log.append(log, entries(3, start=10))
+    assert change_log.last_position(log) == 12
+    assert change_log.load_cursor(log, 'target') == 0
+    change_log.save_cursor(log, 'target', end)
+    assert change_log.load_cursor(log, 'target') == end
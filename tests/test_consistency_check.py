@@ -0,0 +1,25 @@
+import consistency_check
+
+
+def test_equivalent_types_share_a_family_across_engines():
+    pairs = [
+        (('postgresql', 'timestamp with time zone'), ('mysql', 'timestamp')),
+        (('postgresql', 'timestamp without time zone'), ('mysql', 'datetime')),
+        (('postgresql', 'numeric(10,2)'), ('mysql', 'decimal')),
+        (('postgresql', 'double precision'), ('mysql', 'double')),
+        (('postgresql', 'bytea'), ('mysql', 'varbinary')),
+        (('redshift', 'timestamp with time zone'), ('postgresql', 'timestamp with time zone')),
+    ]
+    for (left_syst, left_type), (right_syst, right_type) in pairs:
+        assert consistency_check.type_family(left_syst, left_type) == consistency_check.type_family(right_syst, right_type)
+
+
+def test_mysql_timestamp_format_survives_parameter_binding():
+    expression = consistency_check.row_hash_expression('mysql', ['id', 'created_at'], {'created_at': 'timestamp'})
+    # Les requêtes sont exécutées avec des paramètres : les % littéraux sont doublés
+    assert "'%Y-%m-%d %H:%i:%s.%f'" in (expression % ())
+
+
+def test_unknown_columns_hash_as_text():
+    expression = consistency_check.row_hash_expression('postgresql', ['id', 'name'])
+    assert "COALESCE(id::text, 'NULL')" in expression and "COALESCE(name::text, 'NULL')" in expression
@@ -0,0 +1,43 @@
+import pytest
+
+from change_records import ChangeRecord, RelationDescriptor
+import dead_letter
+
+
+ORDERS = RelationDescriptor(1, 'public', 'orders', ['id', 'total'], key_positions=(0,))
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(dead_letter, 'DEAD_LETTER_DB', str(tmp_path / 'dead_letters.db'))
+
+
+def test_retry_delay_doubles_then_caps():
+    assert dead_letter.retry_delay(1) == dead_letter.RETRY_BASE_DELAY
+    assert dead_letter.retry_delay(3) == 4 * dead_letter.RETRY_BASE_DELAY
+    assert dead_letter.retry_delay(50) == dead_letter.RETRY_MAX_DELAY
+
+
+def test_row_keys_follow_the_row_through_a_key_change():
+    update = ChangeRecord('U', ORDERS, (2, 10), (1, 10))
+    assert dead_letter.row_keys(update) == ("orders:(1,)", "orders:(2,)")
+    assert dead_letter.row_keys(ChangeRecord('T', ORDERS)) == (None, None)
+
+
+def test_later_change_of_a_row_waits_behind_its_dead_letter():
+    dead_letter.add(ChangeRecord('I', ORDERS, (1, 10)), 'shop', 'postgresql', 'dml_replication_postgresql', 'insert', 'boom')
+    dead_letter.add(ChangeRecord('U', ORDERS, (1, 20), (1, 10)), 'shop', 'postgresql', 'dml_replication_postgresql',
+                    'insert', 'parked')
+    assert dead_letter.pending_rows('shop', 'postgresql') == {"orders:(1,)"}
+    assert dead_letter.pending_rows('other', 'postgresql') == set()
+
+    conn = dead_letter.connect()
+    try:
+        first, second = conn.execute("SELECT * FROM dead_letters ORDER BY id").fetchall()
+        assert dead_letter.blocking_entry(conn, first) is None
+        assert dead_letter.blocking_entry(conn, second)['id'] == first['id']
+    finally:
+        conn.close()
+
+    assert dead_letter.discard([first['id']]) == {'requested': 1, 'discarded': 1}
+    assert dead_letter.counts('shop', 'postgresql') == {'discarded': 1, 'pending': 1}
@@ -0,0 +1,18 @@
+import re
+
+import metadata_cache
+
+
+def test_pool_name_is_valid_for_any_database_name():
+    for dbname in ('sales', 'ventes 2024', 'db/with\\odd"chars', 'x' * 200):
+        name = metadata_cache.pool_name(dbname)
+        assert len(name) <= metadata_cache.POOL_NAME_MAX_SIZE
+        assert re.fullmatch(r'[a-zA-Z0-9._:$#*-]+', name)
+    # Deux bases que le remplacement des caractères confondrait gardent des pools distincts
+    assert metadata_cache.pool_name('a b') != metadata_cache.pool_name('a_b')
+
+
+def test_catalog_statements_invalidate_table_lists():
+    assert metadata_cache.changes_catalog('CREATE TABLE')
+    assert metadata_cache.changes_catalog('  drop table orders')
+    assert not metadata_cache.changes_catalog('COMMIT')
@@ -0,0 +1,48 @@
+from change_records import ChangeRecord, RelationDescriptor
+import parallel_apply
+
+
+ACCOUNTS = RelationDescriptor(1, 'public', 'accounts', ['id', 'balance'], key_positions=(0,))
+EVENTS = RelationDescriptor(2, 'public', 'events', ['payload'])
+
+
+def insert(relation, *values):
+    return [ChangeRecord('I', relation, values)]
+
+
+def test_logical_clocks_group_transactions_committed_together():
+    transactions = [
+        (0, 1, insert(ACCOUNTS, 1, 10)),
+        (0, 2, insert(ACCOUNTS, 2, 20)),
+        (2, 3, insert(ACCOUNTS, 3, 30)),
+    ]
+    waves = parallel_apply.plan_waves(transactions)
+    assert [len(wave) for wave in waves] == [2, 1]
+
+
+def test_write_sets_split_conflicting_transactions_without_clocks():
+    transactions = [
+        (None, None, insert(ACCOUNTS, 1, 10)),
+        (None, None, insert(ACCOUNTS, 2, 20)),
+        (None, None, [ChangeRecord('U', ACCOUNTS, (1, 15), (1, 10))]),
+    ]
+    waves = parallel_apply.plan_waves(transactions)
+    assert [len(wave) for wave in waves] == [2, 1]
+    assert waves[1][0][0].op == 'U'
+
+
+def test_update_changing_key_conflicts_with_new_key():
+    transactions = [
+        (None, None, [ChangeRecord('U', ACCOUNTS, (5, 10), (1, 10))]),
+        (None, None, insert(ACCOUNTS, 5, 50)),
+    ]
+    assert len(parallel_apply.plan_waves(transactions)) == 2
+
+
+def test_keyless_tables_are_applied_one_transaction_at_a_time():
+    transactions = [(None, None, insert(EVENTS, 'a')), (None, None, insert(EVENTS, 'b'))]
+    assert [len(wave) for wave in parallel_apply.plan_waves(transactions)] == [1, 1]
+
+
+def test_no_transaction_no_wave():
+    assert parallel_apply.plan_waves([]) == []
@@ -0,0 +1,65 @@
+import pytest
+
+from benchmark_replication import encode_relation, encode_tuple, encode_update
+from change_records import UNCHANGED_TOAST
+import dml_replication_postgresql
+
+
+OID = 16384
+
+
+@pytest.fixture
+def relations():
+    # Carte de session : chaque test part des RELATION qu'il a lui-même décodées
+    relations = {}
+    dml_replication_postgresql.decode_message(encode_relation(OID, 'public', 'documents', ['id', 'title', 'body'], (0,)),
+                                              relations)
+    return relations
+
+
+def decode(message, relations):
+    return dml_replication_postgresql.decode_message(message, relations)
+
+
+def test_unchanged_toast_is_left_out_of_the_set_clause(relations):
+    record = decode(encode_update(OID, ('1', 'new title', UNCHANGED_TOAST)), relations)
+    assert record.values == ('1', 'new title', UNCHANGED_TOAST)
+    assert record.old_values is None
+    query, params = dml_replication_postgresql.build_update_query(record)
+    assert query == "UPDATE documents SET title = %s WHERE id = %s;"
+    assert params == ['new title', '1']
+
+
+def test_key_change_matches_the_old_key(relations):
+    # 'K' : seule l'ancienne clé est transmise, les autres colonnes ne servent pas de comparaison
+    record = decode(encode_update(OID, ('2', 'title', UNCHANGED_TOAST), key_values=('1', None, None)), relations)
+    assert record.old_values == ('1', UNCHANGED_TOAST, UNCHANGED_TOAST)
+    query, params = dml_replication_postgresql.build_update_query(record)
+    assert query == "UPDATE documents SET id = %s, title = %s WHERE id = %s;"
+    assert params == ['2', 'title', '1']
+
+
+def test_full_old_row_skips_unchanged_columns(relations):
+    # 'O' : REPLICA IDENTITY FULL, l'ancienne ligne complète précède le nouveau tuple
+    message = b'U' + OID.to_bytes(4, 'big') + b'O' + encode_tuple(('1', 'title', 'body')) \
+        + b'N' + encode_tuple(('1', 'new title', 'body'))
+    record = decode(message, relations)
+    assert record.old_values == ('1', 'title', 'body')
+    query, params = dml_replication_postgresql.build_update_query(record)
+    assert query == "UPDATE documents SET title = %s WHERE id = %s;"
+    assert params == ['new title', '1']
+
+
+def test_full_old_row_without_key_identifies_by_known_columns():
+    relations = {}
+    decode(encode_relation(OID, 'public', 'events', ['kind', 'payload'], ()), relations)
+    message = b'U' + OID.to_bytes(4, 'big') + b'O' + encode_tuple(('click', None)) \
+        + b'N' + encode_tuple(('view', UNCHANGED_TOAST))
+    query, params = dml_replication_postgresql.build_update_query(decode(message, relations))
+    assert query == "UPDATE events SET kind = %s WHERE kind = %s AND payload IS NULL;"
+    assert params == ['view', 'click']
+
+
+def test_update_without_changed_columns_is_skipped(relations):
+    record = decode(encode_update(OID, ('1', UNCHANGED_TOAST, UNCHANGED_TOAST)), relations)
+    assert dml_replication_postgresql.build_update_query(record) is None
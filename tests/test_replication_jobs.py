@@ -0,0 +1,63 @@
+import pytest
+
+import replication_jobs
+
+
+@pytest.fixture(autouse=True)
+def empty_registry():
+    replication_jobs._pipelines.clear()
+    yield
+    replication_jobs._pipelines.clear()
+
+
+def key(syst_source, source_db, target_db):
+    return replication_jobs.pipeline_key({'syst_source': syst_source, 'source_db': source_db,
+                                          'target_db': target_db, 'syst_dest': 'postgresql'})
+
+
+def running(job):
+    return True
+
+
+def test_create_runs_outside_the_registry_lock():
+    def create():
+        assert not replication_jobs._jobs_lock.locked()
+        return {'id': 'a'}
+
+    job, created = replication_jobs.claim_pipeline(key('postgresql', 'src', 'tgt'), create, running)
+    assert created and job == {'id': 'a'}
+
+
+def test_same_pipeline_returns_the_running_job():
+    pipeline = key('postgresql', 'src', 'tgt')
+    first, _ = replication_jobs.claim_pipeline(pipeline, lambda: {'id': 'a'}, running)
+    second, created = replication_jobs.claim_pipeline(pipeline, lambda: {'id': 'b'}, running)
+    assert second is first and not created
+
+
+def test_second_postgresql_pipeline_on_the_same_slot_is_rejected():
+    replication_jobs.claim_pipeline(key('postgresql', 'src', 'tgt1'), lambda: {'id': 'a'}, running)
+    with pytest.raises(ValueError):
+        replication_jobs.claim_pipeline(key('postgresql', 'src', 'tgt2'), lambda: {'id': 'b'}, running)
+    # Un pipeline arrêté libère le slot
+    replication_jobs._pipelines[key('postgresql', 'src', 'tgt1')]['alive'] = lambda job: False
+    job, created = replication_jobs.claim_pipeline(key('postgresql', 'src', 'tgt2'), lambda: {'id': 'b'}, running)
+    assert created and job['id'] == 'b'
+
+
+def test_mysql_pipelines_on_the_same_source_are_independent():
+    replication_jobs.claim_pipeline(key('mysql', 'src', 'tgt1'), lambda: {'id': 'a'}, running)
+    job, created = replication_jobs.claim_pipeline(key('mysql', 'src', 'tgt2'), lambda: {'id': 'b'}, running)
+    assert created
+
+
+def test_failed_creation_releases_the_pipeline():
+    pipeline = key('postgresql', 'src', 'tgt')
+
+    def fail():
+        raise ConnectionError("source unreachable")
+
+    with pytest.raises(ConnectionError):
+        replication_jobs.claim_pipeline(pipeline, fail, running)
+    job, created = replication_jobs.claim_pipeline(pipeline, lambda: {'id': 'a'}, running)
+    assert created
@@ -1,12 +1,20 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 import psycopg2
 import psycopg2.extras
-import dml_replication_postgresql, ddl_replication_postgresql, dml_replication_mysql, ddl_replication_mysql
+import metadata_cache
+import replication_jobs
+import runner
+import consistency_check
+import profiling
+import replication_lag
+import dead_letter
+import drivers
+import query_jobs
+import change_feed
 from flask_cors import CORS
-import threading
+import json
 import time
-import mysql.connector
-from mysql.connector import Error
+import uuid
 import logging
 
 app = Flask(__name__)
@@ -16,15 +24,13 @@ app.config['CORS_HEADERS'] = 'Content-Type'
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+SHOW_TABLE_PAGE_SIZE = 500
+SHOW_TABLE_MAX_PAGE_SIZE = 10000
+SHOW_TABLE_STREAM_ITERSIZE = 2000
+
 def connection_postgresql():
     try:
-        conn_params = {
-            'host': 'localhost',
-            'port': 5555,
-            'dbname': 'project-data',
-            'user': 'postgres',
-            'password': 'postgres'
-        }
+        conn_params = drivers.connection_params('postgresql', 'project-data')
         conn = psycopg2.connect(**conn_params)
 
         logging.info(f"Connecting to PostgreSQL")
@@ -38,30 +44,24 @@ def decode():
     data = request.json
     source_db = data.get('sourceDatabase')
     target_db = data.get('targetDatabase')
-    sql_query = data.get('sqlQuery')
-
-    source_conn = ddl_replication_postgresql.source_db_connection(source_db)
-    target_conn = ddl_replication_postgresql.source_db_connection(target_db)
+    # Une instruction (sqlQuery) ou une liste (sqlQueries), exécutées en arrière-plan dans l'ordre
+    statements = data.get('sqlQueries') or [data.get('sqlQuery')]
+    statements = [statement.strip() for statement in statements if statement and statement.strip()]
+    if not statements:
+        return jsonify({'status': 'error', 'message': 'No query given'}), 400
 
-    table_name = sql_query.split(' ')[2]
+    # Avec jobId, mêmes paramètres de connexion que le pipeline concerné
+    job = query_jobs.submit(source_db, target_db, statements, data.get('sourceType', 'postgresql'),
+                            data.get('targetType', 'postgresql'), pipeline_id=data.get('jobId'))
+    return jsonify({'status': 'queued', 'jobId': job['id']}), 202
 
-    if sql_query.split(' ')[0].upper() == 'ALTER':
-        ddl_replication_postgresql.execute_query_ddl(source_db, sql_query)
-        if 'ADD' in sql_query.upper():
-            ddl_replication_postgresql.replicate_alter_table_add(source_conn, target_conn, table_name)
-        elif 'DROP' in sql_query.upper():
-            ddl_replication_postgresql.replicate_alter_table_drop(source_conn, target_conn, table_name)
-        elif 'ALTER COLUMN' in sql_query.upper():
-            ddl_replication_postgresql.replicate_alter_table_modify(source_conn, target_conn, table_name)
-        else:
-            print("Commande ALTER non prise en charge.")
 
-    else :
-        execute_query_dml(source_db,sql_query)
-        dml_replication_postgresql.target_db_connection(target_db)
-        dml_replication_postgresql.main(source_db,target_db)
-
-    return jsonify({'status': 'success', 'message': 'Query executed successfully'})
+@app.route('/execute_query/<job_id>', methods=['GET'])
+def query_job_status(job_id):
+    job = query_jobs.get_job(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'message': 'Unknown query job'}), 404
+    return jsonify(query_jobs.job_status(job))
 
 @app.route('/show_table', methods=['POST'])
 def show_table():
@@ -69,65 +69,105 @@ def show_table():
     source_db = data.get('sourceDatabase')
     target_db = data.get('targetDatabase')
     table_name = data.get('tableDatabase')
+    try:
+        page_size = int(data.get('pageSize', SHOW_TABLE_PAGE_SIZE))
+    except (TypeError, ValueError):
+        page_size = None
+    if page_size is None or not 1 <= page_size <= SHOW_TABLE_MAX_PAGE_SIZE:
+        return jsonify({'status': 'error', 'message': f'pageSize must be an integer between 1 and {SHOW_TABLE_MAX_PAGE_SIZE}'}), 400
 
-    source_data = get_table_data(source_db, table_name)
-    target_data = get_table_data(target_db, table_name)
+    if data.get('stream'):
+        return Response(stream_with_context(stream_tables_data(source_db, target_db, table_name)),
+                        mimetype='application/x-ndjson')
+
+    source_data = get_table_data(source_db, table_name, data.get('sourceAfterKey'), page_size)
+    target_data = get_table_data(target_db, table_name, data.get('targetAfterKey'), page_size)
 
     return jsonify({'sourceData': source_data, 'targetData': target_data})
 
-def execute_query_dml(source_db, sql_query):
-    conn_params = {
-        'host': 'localhost',
-        'port': 5555,
-        'dbname': source_db,
-        'user': 'postgres',
-        'password': 'postgres'
-    }
+def get_table_key_columns(cur, table_name):
+    cur.execute("""
+        SELECT a.attname
+        FROM pg_catalog.pg_index i
+        JOIN pg_catalog.pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        WHERE i.indrelid = %s::regclass AND i.indisprimary
+        ORDER BY array_position(i.indkey, a.attnum);
+        """, (table_name,))
+    key_columns = [row[0] for row in cur.fetchall()]
+    # Sans clé primaire, on pagine sur l'adresse physique des lignes
+    return key_columns or ['ctid']
+
+
+def get_table_data(db_name, table_name, after_key=None, page_size=SHOW_TABLE_PAGE_SIZE):
+    conn_params = drivers.connection_params('postgresql', db_name)
     conn = psycopg2.connect(**conn_params)
+    table_data = {'columns': [], 'rows': [], 'next_key': None}
     try:
         with conn.cursor() as cur:
-            cur.execute(sql_query)
-            conn.commit()
+            key_columns = get_table_key_columns(cur, table_name)
+            key_list = ', '.join(key_columns)
+            select_keys = ', '.join(f"{column}::text" if column == 'ctid' else column for column in key_columns)
+
+            query = f"SELECT {select_keys}, * FROM {table_name}"
+            params = []
+            if after_key:
+                key_values = after_key if isinstance(after_key, list) else [after_key]
+                placeholders = ', '.join('%s::tid' if column == 'ctid' else '%s' for column in key_columns)
+                query += f" WHERE ({key_list}) > ({placeholders})"
+                params.extend(key_values)
+            query += f" ORDER BY {key_list} LIMIT %s"
+            params.append(page_size)
+
+            cur.execute(query, params)
+            n_keys = len(key_columns)
+            table_data['columns'] = [desc[0] for desc in cur.description][n_keys:]
+            rows = cur.fetchall()
+            table_data['rows'] = [row[n_keys:] for row in rows]
+            if len(rows) == page_size:
+                table_data['next_key'] = list(rows[-1][:n_keys])
     except Exception as e:
-        print(f"Erreur lors de l'exécution de la requête: {e}")
+        print(f"Erreur lors de la récupération des données de la table: {e}")
     finally:
         conn.close()
+    return table_data
 
-def get_table_data(db_name, table_name):
-    conn_params = {
-        'dbname': db_name,
-        'user': 'postgres',
-        'password': 'postgres',
-        'host': 'localhost',
-        'port': 5555
-    }
+
+def stream_table_data(db_name, table_name, side):
+    conn_params = drivers.connection_params('postgresql', db_name)
     conn = psycopg2.connect(**conn_params)
-    table_data = {'columns': [], 'rows': []}
     try:
-        with conn.cursor() as cur:
+        # Curseur nommé : les lignes restent côté serveur et arrivent par paquets
+        with conn.cursor(name=f"show_table_{uuid.uuid4().hex}") as cur:
+            cur.itersize = SHOW_TABLE_STREAM_ITERSIZE
             cur.execute(f"SELECT * FROM {table_name}")
-            table_data['columns'] = [desc[0] for desc in cur.description]
-            table_data['rows'] = cur.fetchall()
+            columns_sent = False
+            for row in cur:
+                if not columns_sent:
+                    yield json.dumps({'side': side, 'columns': [desc[0] for desc in cur.description]}) + '\n'
+                    columns_sent = True
+                yield json.dumps({'side': side, 'row': row}, default=str) + '\n'
+            if not columns_sent:
+                # Table vide : la description n'est connue qu'après le premier FETCH, l'entête part quand même
+                yield json.dumps({'side': side, 'columns': [desc[0] for desc in cur.description or []]}) + '\n'
     except Exception as e:
-        print(f"Erreur lors de la récupération des données de la table: {e}")
+        logging.error(f"Error streaming table {table_name} from {db_name}: {e}")
+        yield json.dumps({'side': side, 'error': str(e)}) + '\n'
     finally:
         conn.close()
-    return table_data
+
+
+def stream_tables_data(source_db, target_db, table_name):
+    yield from stream_table_data(source_db, table_name, 'source')
+    yield from stream_table_data(target_db, table_name, 'target')
 
 
 def mysql_connection():
 
     try:
-        connection = mysql.connector.connect(
-            host="localhost",
-            database="receive_replication",
-            port = 3306,
-            user="nass",
-            password="mysql"
-        )
+        connection = drivers.connect('mysql', "receive_replication")
         logging.info(f"Connecting to MySQL")
         return connection
-    except Error as e:
+    except Exception as e:
         logging.error(f"Error connecting to MySQL: {e}")
         return None
 
@@ -135,13 +175,7 @@ def postgresql_connection(dbname, db_type='postgresql'):
     try :
         if db_type == 'postgresql':
 
-            conn_params = {
-                'host': 'localhost',
-                'port': 5555,
-                'dbname': dbname,
-                'user': 'postgres',
-                'password': 'postgres'
-            }
+            conn_params = drivers.connection_params('postgresql', dbname)
             logging.info(f"Connecting to PostgreSQL")
             return psycopg2.connect(**conn_params)
         else:
@@ -154,34 +188,16 @@ def get_databases():
     data = request.json
     db_type = data.get('type', 'postgresql')
 
-    if db_type == 'mysql':
-        conn = mysql_connection()
-        if not conn:
-            logging.error(f"Error connecting to MySQL")
-            return jsonify({"error": "Connection to MySQL failed"}), 500
-        query = "SHOW DATABASES"
-    else:
-        conn = postgresql_connection('postgres')
-        if not conn:
-            logging.error(f"Error connecting to PostgreSQL")
-            return jsonify({"error": "Connection to PostgreSQL failed"}), 500
-        query = "SELECT datname FROM pg_database"
-
     try:
-        with conn.cursor() as cur:
-            cur.execute(query)
-            db_list = cur.fetchall()
-            logging.info("Retrieved list of databases.")
+        db_list = metadata_cache.list_databases(db_type)
+    except TimeoutError as e:
+        logging.warning(f"Metadata connections busy: {e}")
+        return jsonify({"error": "Metadata connections busy, retry later"}), 503
     except Exception as e:
         logging.error(f"Error retrieving databases: {e}")
         return jsonify({"error": "Error retrieving databases"}), 500
-    finally:
-        conn.close()
 
-    if db_type == 'mysql':
-        return jsonify([{"name": db[0]} for db in db_list])
-    else:
-        return jsonify([{"name": db[0]} for db in db_list])
+    return jsonify([{"name": db} for db in db_list])
 
 @app.route('/get_tables', methods=['POST'])
 def get_tables():
@@ -189,28 +205,16 @@ def get_tables():
     db_type = data.get('type')
     db_name = data.get('dbname')
 
-    if db_type == 'mysql':
-        conn = mysql_connection()
-        query = "SELECT table_name FROM information_schema.tables WHERE table_schema = %s;"
-    else:
-        conn = postgresql_connection(db_name)
-        query = "SELECT table_name FROM information_schema.tables WHERE table_schema = 'public';"
-
     try:
-        with conn.cursor() as cur:
-            cur.execute(query, (db_name,))
-            tables_list = cur.fetchall()
-            logging.info("Retrieved list of tables.")
+        tables_list = metadata_cache.list_tables(db_type, db_name)
+    except TimeoutError as e:
+        logging.warning(f"Metadata connections busy: {e}")
+        return jsonify({"error": "Metadata connections busy, retry later"}), 503
     except Exception as e :
         logging.error(f"Error retrieving tables: {e}")
         return jsonify({"error": "Error retrieving tables"}), 500
-    finally:
-        conn.close()
 
-    if db_type == 'mysql':
-        return jsonify([{"table": table[0]} for table in tables_list])
-    else:
-        return jsonify([{"table": table[0]} for table in tables_list])
+    return jsonify([{"table": table} for table in tables_list])
 
 
 @app.route('/listen_continue', methods=['POST'])
@@ -219,94 +223,202 @@ def listen_continue():
 
     source_config = data.get('sourceConfig')
     destination_config = data.get('destinationConfig')
+    # Une liste de destinations diffuse le même flux capturé vers chacune d'elles
+    destination_configs = destination_config if isinstance(destination_config, list) else [destination_config]
+    destination_config = destination_configs[0]
+
+    pipeline_config = {
+        'syst_source': source_config.get('syst_source'),
+        'syst_dest': destination_config.get('syst_dest'),
+        'table_source': source_config.get('table'),
+        'table_dest': destination_config.get('table'),
+        'source_db': source_config.get('database'),
+        'target_db': destination_config.get('database'),
+    }
+    if data.get('batching'):
+        # Bornes du micro-batching adaptatif : min_rows, max_rows, max_bytes, target_lag, max_batch_seconds
+        pipeline_config['batching'] = data['batching']
+    if data.get('streaming'):
+        # Consommation en flux du slot avec retour de statut au serveur (LSN validé sur la cible)
+        pipeline_config['streaming'] = True
+    if data.get('heartbeat'):
+        # Écrit périodiquement sur la source pour mesurer le retard même sans trafic
+        pipeline_config['heartbeat'] = True
+    if data.get('changeLog'):
+        # Capture écrite dans un journal local sur disque, appliquée par un thread séparé
+        pipeline_config['change_log'] = True
+    if data.get('applyMode') == 'upsert':
+        # INSERT ... ON CONFLICT / ON DUPLICATE KEY UPDATE : une reprise peut rejouer des changements déjà appliqués
+        pipeline_config['apply_mode'] = 'upsert'
+    if data.get('parallelApply'):
+        # Nombre de connexions cible pour appliquer en parallèle les transactions MySQL indépendantes
+        pipeline_config['parallel_apply'] = int(data['parallelApply'])
+    if data.get('connections'):
+        # Paramètres de connexion propres au pipeline, par système : {'mysql': {'host': ..., 'port': ...}}
+        pipeline_config['connections'] = data['connections']
+    if data.get('filters'):
+        # Filtres poussés à la source : colonnes et lignes publiées (PostgreSQL), schémas et tables lus (binlog)
+        pipeline_config['filters'] = data['filters']
+    if len(destination_configs) > 1:
+        pipeline_config['targets'] = [{'target_db': config.get('database'), 'syst_dest': config.get('syst_dest')}
+                                      for config in destination_configs]
+
+    with_initial_load = data.get('initialLoad', False)
+
+    try:
+        logging.info("Starting replication process.")
+        # Avec 'runner': 'process', le pipeline tourne dans son propre processus
+        jobs_module = runner if data.get('runner') == 'process' else replication_jobs
+        job, started = jobs_module.start_job(pipeline_config, with_initial_load)
+        if not started:
+            return jsonify({'status': 'success', 'message': 'Replication already running', 'jobId': job['id']})
 
-    syst_source = source_config.get('syst_source')
-    syst_dest = destination_config.get('syst_dest')
+        logging.info("Replication activated successfully.")
+        return jsonify({'status': 'success', 'message': 'Replication activated', 'jobId': job['id']})
+    except Exception as e:
+        logging.error(f"Error during replication: {e}")
+        return jsonify({'status': 'error', 'message': str(e)})
 
-    table_source = source_config.get('table')
-    table_dest = destination_config.get('table')
 
-    source_db = source_config.get('database')
-    target_db = destination_config.get('database')
+@app.route('/verify_table', methods=['POST'])
+def verify_table():
+    data = request.json
+    source_config = data.get('sourceConfig')
+    destination_config = data.get('destinationConfig')
 
     try:
-        logging.info("Starting replication process.")
+        report = consistency_check.verify_table(
+            source_config.get('syst_source'), source_config.get('database'), source_config.get('table'),
+            destination_config.get('syst_dest'), destination_config.get('database'), destination_config.get('table'),
+            repair=data.get('repair', False),
+            # Avec jobId, mêmes paramètres de connexion que le pipeline vérifié
+            pipeline_id=data.get('jobId')
+        )
+    except Exception as e:
+        logging.error(f"Error verifying table: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
 
-        if syst_source == 'postgresql':
-            logging.info("Starting replication from PostgreSQL.")
-            # Démarrage de la réplication DML pour PostgreSQL
-            dml_replication_postgresql_thread = threading.Thread(target=continuous_dml_replication_postgresql, args=(source_db, target_db, syst_dest))
-            dml_replication_postgresql_thread.start()
+    return jsonify({'status': 'success', 'report': report})
 
-            # Démarrage de la réplication DDL pour PostgreSQL
-            ddl_replication_postgresql_thread = threading.Thread(target=continuous_ddl_replication_postgresql, args=(source_db, target_db, syst_dest, table_dest))
-            ddl_replication_postgresql_thread.start()
 
-        elif syst_source == 'mysql':
-            logging.info("Starting replication from MySQL.")
-            # Démarrage de la réplication DML pour MySQL
-            dml_replication_mysql_thread = threading.Thread(target=continuous_dml_replication_mysql, args=(source_db, target_db, syst_dest, table_source, table_dest))
-            dml_replication_mysql_thread.start()
+def find_job(job_id):
+    for jobs_module in (replication_jobs, runner):
+        job = jobs_module.get_job(job_id)
+        if job:
+            return jobs_module, job
+    return None, None
 
-            # Démarrage de la réplication DDL pour MySQL
-            ddl_replication_mysql_thread = threading.Thread(target=continuous_ddl_replication_mysql, args=(source_db, target_db, syst_dest, table_dest))
-            ddl_replication_mysql_thread.start()
 
-        logging.info("Replication activated successfully.")
-        return jsonify({'status': 'success', 'message': 'Replication activated'})
-    except Exception as e:
-        logging.error(f"Error during replication: {e}")
-        return jsonify({'status': 'error', 'message': str(e)})
-def continuous_dml_replication_postgresql(source_db, target_db, syst_dest):
-    while True:
-        try:
-            dml_replication_postgresql.target_db_connection(target_db, syst_dest)
-            dml_replication_postgresql.main(source_db, target_db, syst_dest)
-
-        except Exception as e:
-            logging.error(f"Waiting for DML modifications to replicate: {e}")
-        time.sleep(1)
-
-def continuous_ddl_replication_postgresql(source_db, target_db, syst_dest, table_dest):
-    while True:
-        try:
-            source_conn = ddl_replication_postgresql.source_db_connection(source_db)
-            target_conn = ddl_replication_postgresql.target_db_connection(target_db, syst_dest)
-
-            ddl_replication_postgresql.replicate_alter_table_add(source_conn, target_conn, table_dest)
-            ddl_replication_postgresql.replicate_alter_table_drop(source_conn, target_conn, table_dest)
-            ddl_replication_postgresql.replicate_alter_table_modify(source_conn, target_conn, table_dest, syst_dest)
-
-            source_conn.close()
-            target_conn.close()
-        except Exception as e:
-            logging.error(f"Waiting for DDL modifications to replicate: {e}")
-        time.sleep(1)
-
-def continuous_dml_replication_mysql(source_db, target_db, syst_dest, table_source, table_dest):
-    while True:
-        try:
-            dml_replication_mysql.target_db_connection(target_db, syst_dest)
-            dml_replication_mysql.main(source_db, target_db, syst_dest, table_source, table_dest)
-        except Exception as e:
-            logging.error(f"Waiting for DML modifications to replicate: {e}")
-        time.sleep(1)
-
-def continuous_ddl_replication_mysql(source_db, target_db, syst_dest, table_dest):
-    while True:
-        try:
-            source_conn = ddl_replication_mysql.source_db_connection(source_db)
-            target_conn = ddl_replication_mysql.target_db_connection(target_db, syst_dest)
-
-            ddl_replication_mysql.replicate_alter_table_add(source_conn, target_conn, table_dest, target_db, source_db, syst_dest)
-            ddl_replication_mysql.replicate_alter_table_drop(source_conn, target_conn, table_dest, target_db, source_db, syst_dest)
-            ddl_replication_mysql.replicate_alter_table_modify(source_conn, target_conn, table_dest, target_db, syst_dest, source_db)
-
-            source_conn.close()
-            target_conn.close()
-        except Exception as e:
-            logging.error(f"Waiting for DDL modifications to replicate: {e}")
-        time.sleep(1)
+@app.route('/jobs', methods=['GET'])
+def list_replication_jobs():
+    return jsonify([jobs_module.job_status(job) for jobs_module in (replication_jobs, runner) for job in jobs_module.list_jobs()])
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def replication_job_status(job_id):
+    jobs_module, job = find_job(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'message': 'Unknown job'}), 404
+    return jsonify(jobs_module.job_status(job))
+
+
+@app.route('/jobs/<job_id>/lag', methods=['GET'])
+def replication_job_lag(job_id):
+    jobs_module, job = find_job(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'message': 'Unknown job'}), 404
+    if jobs_module is runner:
+        # Les jobs en processus séparé ne remontent que la jauge et l'histogramme
+        return jsonify({'lag': jobs_module.job_status(job).get('lag'), 'history': None})
+
+    since = request.args.get('since', type=float)
+    return jsonify({'lag': replication_lag.lag_snapshot(job['id']), 'history': replication_lag.lag_history(job['id'], since)})
+
+
+@app.route('/jobs/<job_id>/<action>', methods=['POST'])
+def control_replication_job(job_id, action):
+    jobs_module, job = find_job(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'message': 'Unknown job'}), 404
+
+    actions = {
+        'stop': jobs_module.stop_job,
+        'pause': jobs_module.pause_job,
+        'resume': jobs_module.resume_job,
+    }
+    if action not in actions:
+        return jsonify({'status': 'error', 'message': f'Unsupported action {action}'}), 400
+
+    actions[action](job)
+    return jsonify(jobs_module.job_status(job))
+
+
+def feed_stats():
+    # Jauges lues en mémoire : les jobs en processus séparé publient leur dernier état remonté
+    stats = [replication_jobs.job_summary(job) for job in replication_jobs.list_jobs()]
+    for job in runner.list_jobs():
+        status = runner.job_status(job)
+        stats.append({key: status.get(key) for key in ('id', 'pipeline', 'state', 'changes_applied', 'errors',
+                                                       'throughput_per_second', 'lag_seconds', 'last_applied_at')})
+    return stats
+
+
+change_feed.set_stats_source(feed_stats)
+
+
+@app.route('/feed', methods=['GET'])
+def change_feed_stream():
+    # Server-Sent Events : changements appliqués et jauges des pipelines, au lieu de relire les tables
+    subscriber = change_feed.subscribe(request.args.get('pipeline'))
+    if subscriber is None:
+        return jsonify({'status': 'error', 'message': 'Too many feed subscribers'}), 503
+    return Response(stream_with_context(change_feed.events(subscriber)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/dead_letters', methods=['GET'])
+def list_dead_letters():
+    entries = dead_letter.list_entries(request.args.get('state'), request.args.get('pipeline'),
+                                       request.args.get('limit', 100, type=int))
+    return jsonify({'counts': dead_letter.counts(), 'entries': entries})
+
+
+@app.route('/dead_letters/<action>', methods=['POST'])
+def control_dead_letters(action):
+    # replay : rejoue immédiatement les entrées ; discard : les écarte de la reprise automatique
+    actions = {
+        'replay': dead_letter.replay,
+        'discard': dead_letter.discard,
+    }
+    if action not in actions:
+        return jsonify({'status': 'error', 'message': f'Unsupported action {action}'}), 400
+    entry_ids = (request.json or {}).get('ids') or []
+    if not entry_ids:
+        return jsonify({'status': 'error', 'message': 'No dead-letter ids given'}), 400
+    return jsonify(actions[action]([int(entry_id) for entry_id in entry_ids]))
+
+
+@app.route('/admin/profile/<job_id>', methods=['POST'])
+def start_job_profile(job_id):
+    # Échantillonne les piles des threads du job pendant N secondes, sans redémarrer le pipeline
+    job = replication_jobs.get_job(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'message': 'Unknown job or job running in a worker process'}), 404
+    seconds = float((request.json or {}).get('seconds', 10))
+    profile = profiling.start_profile(job['threads'], seconds)
+    return jsonify({'status': 'success', 'profileId': profile['id'], 'seconds': profile['seconds']})
+
+
+@app.route('/admin/profile/<profile_id>/download', methods=['GET'])
+def download_job_profile(profile_id):
+    profile = profiling.get_profile(profile_id)
+    if not profile:
+        return jsonify({'status': 'error', 'message': 'Unknown profile'}), 404
+    if profile['state'] != 'finished':
+        return jsonify({'status': 'running', 'remaining_seconds': round(profile['started_at'] + profile['seconds'] - time.time(), 1)}), 202
+    return Response(profiling.profile_output(profile), mimetype='text/plain',
+                    headers={'Content-Disposition': f'attachment; filename=profile-{profile_id}.folded'})
+
 
 if __name__ == '__main__':
     app.run(debug=True, port=5432)